@@ -1,13 +1,37 @@
 import asyncio
+import os
+import re
 
 from langchain.agents import initialize_agent, AgentType
 from langchain.memory import ConversationBufferMemory
+from langchain_core.agents import AgentAction
+from langchain_core.messages import HumanMessage, SystemMessage, get_buffer_string
 from langchain_core.prompts import PromptTemplate
 
-from agent.retriever import DocumentRetrieverTool
-from agent.prompts import SYSTEM_MESSAGE, TOOLS, FORMAT_INSTRUCTIONS, SUFFIX 
+from agent.document_retrieval_chain import SOURCES_MARKER, format_retrieval_prompt, split_answer_sources
+from agent.retriever import RETRIEVER_TOOL_NAME, DocumentRetrieverTool
+from agent.prompts import SYSTEM_MESSAGE, TOOLS, FORMAT_INSTRUCTIONS, SUFFIX, CONDENSE_QUESTION_PROMPT
 
 from agent.llm import LLM
+from agent.memory import SummarizingTokenBufferMemory
+from data_pipeline.document_retriever import run_in_retrieval_executor
+from data_pipeline.metrics import llm_stage, track_stage
+
+# "buffer" keeps the whole history, "summary" keeps it within a token budget
+MEMORY_MODE = os.getenv("AGENT_MEMORY_MODE", "buffer")
+MEMORY_MAX_TOKENS = int(os.getenv("AGENT_MEMORY_MAX_TOKENS", 2000))
+
+# "agent" lets the ReAct agent decide when to call the retriever tool,
+# "rag" retrieves directly and answers in one streamed LLM call
+AGENT_MODES = ("agent", "rag")
+AGENT_MODE = os.getenv("AGENT_MODE", "agent")
+
+# Words that refer to the previous turns, a question with them is rewritten before retrieval
+FOLLOW_UP_WORDS = {
+    "it", "its", "this", "that", "these", "those", "they", "them", "their",
+    "he", "she", "his", "her", "above", "previous", "same", "more", "else", "other"
+}
+SOURCES_MARKER_LENGTH = len("SOURCES:")
 
 
 class AgentInterruptionError(Exception):
@@ -15,25 +39,61 @@ class AgentInterruptionError(Exception):
 
 
 class Agent():
-    def __init__(self):
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history", input_key='input', output_key='output', return_messages=True
-        )
-        self.llm = LLM()
+    """
+    A conversational agent with its own memory.
+
+    Args:
+        llm: An LLM object, can be shared between agents. A new one is created if not provided.
+        retriever: A DocumentRetrieverTool object, can be shared between agents.
+        memory_mode: "buffer" to keep the whole history or "summary" to keep recent turns
+            within max_memory_tokens and summarize the older ones.
+        max_memory_tokens: The token budget of the "summary" memory.
+        mode: The default execution mode, "agent" or "rag". Can be overridden per request.
+    """
+
+    def __init__(
+        self,
+        llm=None,
+        retriever=None,
+        memory_mode=MEMORY_MODE,
+        max_memory_tokens=MEMORY_MAX_TOKENS,
+        mode=AGENT_MODE
+    ):
+        if mode not in AGENT_MODES:
+            raise ValueError(f"Unknown agent mode: {mode}")
+
+        self.mode = mode
+        self.llm = llm or LLM()
+        self.memory = self.create_memory(memory_mode, max_memory_tokens)
         
         self.vectorstore = None
         self.retriever = None
         self.tools = []
 
-        self.update_vectorstore()
-
-        self.prompt_template = self.create_prompt_template()
-
-        self.agent = self.create_chat_agent()
+        # Creates the prompt template and the agent
+        self.set_retriever(retriever)
 
         # Used for agent async calls
         self.agent_execution_task = None
 
+    def create_memory(self, memory_mode, max_memory_tokens):
+        """
+        Create a conversation memory of the given mode.
+        """
+        if memory_mode == "summary":
+            return SummarizingTokenBufferMemory(
+                llm=self.llm.model,
+                max_token_limit=max_memory_tokens,
+                memory_key="chat_history", input_key='input', output_key='output', return_messages=True
+            )
+
+        if memory_mode == "buffer":
+            return ConversationBufferMemory(
+                memory_key="chat_history", input_key='input', output_key='output', return_messages=True
+            )
+
+        raise ValueError(f"Unknown memory mode: {memory_mode}")
+
     def create_prompt_template(self):
         """
         Create a prompt template based on the provider of the model.
@@ -95,26 +155,43 @@ class Agent():
         """
         self.agent.memory.clear()
 
-    async def generate_response(self, input):
+    async def generate_response(self, input, event_queue=None, mode=None):
         """
         Generate a response from the agent.
 
         Args:
             input (str): The input to the agent.
+            event_queue (asyncio.Queue): An optional queue that receives agent events
+                (tool calls, retrieved sources and final answer tokens) as they happen.
+            mode (str): "agent" or "rag", defaults to the agent's mode.
 
         Returns:
             Returns the agent's response object.
         """
+        mode = mode or self.mode
+        if mode not in AGENT_MODES:
+            raise ValueError(f"Unknown agent mode: {mode}")
 
-        # Create a coroutine and wrap it in a task
-        coro = self.agent.ainvoke({
+        agent_input = {
             "input": input,
             "chat_history": self.memory.buffer_as_messages,
-        })
-        self.agent_execution_task = asyncio.create_task(coro)
+        }
+
+        # Create a coroutine and wrap it in a task
+        if mode == "rag":
+            coro = self._run_single_shot(agent_input, event_queue)
+        elif event_queue is None:
+            coro = self.agent.ainvoke(agent_input)
+        else:
+            coro = self._run_with_events(agent_input, event_queue)
+
+        # The task copies the context, so the agent's LLM calls outside of tools are recorded as "agent_llm"
+        with llm_stage("agent_llm"):
+            self.agent_execution_task = asyncio.create_task(coro)
 
         try:
-            response = await self.agent_execution_task
+            with track_stage(f"{mode}_response"):
+                response = await self.agent_execution_task
             self.agent_execution_task = None
         except asyncio.CancelledError:
             self.agent_execution_task = None
@@ -122,6 +199,241 @@ class Agent():
 
         return response
 
+    async def stream_response(self, input, mode=None):
+        """
+        Generate a response from the agent and yield its events as they happen.
+        The generation can be interrupted with interrupt_generation.
+
+        Args:
+            input (str): The input to the agent.
+            mode (str): "agent" or "rag", defaults to the agent's mode.
+
+        Yields:
+            Event dictionaries with "event" and "data" keys. The last event is
+            "final" with the agent's response, "interrupted" or "error".
+        """
+        event_queue = asyncio.Queue()
+
+        response_task = asyncio.create_task(self.generate_response(input, event_queue=event_queue, mode=mode))
+        response_task.add_done_callback(lambda _: event_queue.put_nowait(None))
+
+        try:
+            while (event := await event_queue.get()) is not None:
+                yield event
+
+            try:
+                response = response_task.result()
+            except AgentInterruptionError:
+                yield {"event": "interrupted", "data": {}}
+                return
+            except Exception as e:
+                yield {"event": "error", "data": {"detail": str(e)}}
+                return
+
+            yield {"event": "final", "data": {
+                "input": response["input"],
+                "output": response["output"],
+                "sources": self.get_sources(response)
+            }}
+
+        finally:
+            # The client went away before the response was complete
+            if not response_task.done():
+                self.interrupt_generation()
+
+    async def _run_with_events(self, agent_input, event_queue):
+        """
+        Run the agent and translate its callback events to the events of stream_response.
+        Only tokens of the agent's final answer are streamed, not its reasoning
+        or the LLM calls made inside the tools.
+        """
+        response = None
+        tool_depth = 0
+        llm_output = ""
+        answer_started = False
+
+        async for event in self.agent.astream_events(agent_input, version="v2"):
+            kind = event["event"]
+
+            if kind == "on_tool_start":
+                tool_depth += 1
+                event_queue.put_nowait({
+                    "event": "tool_start",
+                    "data": {"tool": event["name"], "input": event["data"].get("input")}
+                })
+
+            elif kind == "on_tool_end":
+                tool_depth -= 1
+                event_queue.put_nowait({"event": "tool_end", "data": {"tool": event["name"]}})
+
+            elif kind == "on_retriever_end":
+                documents = event["data"].get("output") or []
+                event_queue.put_nowait({
+                    "event": "sources",
+                    "data": {"sources": [
+                        {"source": document.metadata.get("source"), "content": document.page_content}
+                        for document in documents
+                    ]}
+                })
+
+            elif kind == "on_chat_model_start" and tool_depth == 0:
+                llm_output = ""
+                answer_started = False
+
+            elif kind == "on_chat_model_stream" and tool_depth == 0:
+                chunk = event["data"]["chunk"].content
+                llm_output += chunk
+
+                # The final answer follows the "AI:" prefix of the agent's output
+                if answer_started:
+                    token = chunk
+                elif "AI:" in llm_output:
+                    answer_started = True
+                    token = llm_output.split("AI:", 1)[1].lstrip()
+                else:
+                    token = ""
+
+                if token:
+                    event_queue.put_nowait({"event": "token", "data": {"token": token}})
+
+            elif kind == "on_chain_end" and not event.get("parent_ids"):
+                response = event["data"]["output"]
+
+        return response
+
+    async def _run_single_shot(self, agent_input, event_queue=None):
+        """
+        Answer without the agent loop: rewrite the question only if it refers to the conversation,
+        retrieve the documents directly and write the answer in one streamed LLM call.
+        The response has the same shape as the agent's one, so get_sources works for both modes.
+        """
+        input = agent_input["input"]
+        chat_history = agent_input["chat_history"]
+        intermediate_steps = []
+
+        if self.retriever is not None:
+            question = input
+            if self._needs_rewrite(input, chat_history):
+                with llm_stage("rewrite_llm"):
+                    rewritten = await self.llm.model.ainvoke(CONDENSE_QUESTION_PROMPT.format(
+                        chat_history=get_buffer_string(chat_history), question=input
+                    ))
+                question = rewritten.content.strip() or input
+
+            if event_queue is not None:
+                event_queue.put_nowait({
+                    "event": "tool_start",
+                    "data": {"tool": RETRIEVER_TOOL_NAME, "input": question}
+                })
+
+            documents = await self.retriever.document_retriever.ainvoke(question)
+            packed = await run_in_retrieval_executor(self.retriever.context_packer.pack, f"{question}\n{input}", documents)
+            documents = packed.documents
+
+            if event_queue is not None:
+                event_queue.put_nowait({
+                    "event": "sources",
+                    "data": {"sources": [
+                        {"source": document.metadata.get("source"), "content": document.page_content}
+                        for document in documents
+                    ]}
+                })
+                event_queue.put_nowait({"event": "tool_end", "data": {"tool": RETRIEVER_TOOL_NAME}})
+
+            prompt = format_retrieval_prompt(question, input, documents)
+            messages = chat_history + [HumanMessage(content=prompt)]
+        else:
+            question = input
+            messages = [SystemMessage(content=SYSTEM_MESSAGE)] + chat_history + [HumanMessage(content=input)]
+
+        output = ""
+        num_streamed = 0
+        with llm_stage("answer_llm"):
+            async for chunk in self.llm.model.astream(messages):
+                output += chunk.content
+                if event_queue is not None:
+                    num_streamed = self._stream_answer_tokens(
+                        output, num_streamed, event_queue, has_sources=self.retriever is not None
+                    )
+
+        if event_queue is not None:
+            self._stream_answer_tokens(
+                output, num_streamed, event_queue, has_sources=self.retriever is not None, is_final=True
+            )
+
+        if self.retriever is not None:
+            answer, sources = split_answer_sources(output)
+            intermediate_steps.append(
+                (AgentAction(tool=RETRIEVER_TOOL_NAME, tool_input=question, log=""), {"answer": answer, "sources": sources})
+            )
+        else:
+            answer = output.strip()
+
+        await self.memory.asave_context({"input": input}, {"output": answer})
+
+        return {
+            "input": input,
+            "chat_history": chat_history,
+            "output": answer,
+            "intermediate_steps": intermediate_steps
+        }
+
+    @staticmethod
+    def _needs_rewrite(question, chat_history):
+        """
+        Whether a question depends on the conversation and must be rewritten before retrieval.
+        """
+        if not chat_history:
+            return False
+
+        words = re.findall(r"\w+", question.lower())
+        return len(words) <= 3 or any(word in FOLLOW_UP_WORDS for word in words)
+
+    @staticmethod
+    def _stream_answer_tokens(output, num_streamed, event_queue, has_sources, is_final=False):
+        """
+        Put the new part of the answer to the queue. An answer based on retrieved documents
+        is streamed without its trailing "SOURCES:" line, and its last characters are held back
+        until it is clear they do not start the marker.
+
+        Returns:
+            The number of characters of the output streamed so far.
+        """
+        match = SOURCES_MARKER.search(output) if has_sources else None
+        if match:
+            end = match.start()
+        elif is_final or not has_sources:
+            end = len(output)
+        else:
+            end = len(output) - SOURCES_MARKER_LENGTH
+
+        if end > num_streamed:
+            event_queue.put_nowait({"event": "token", "data": {"token": output[num_streamed:end]}})
+            return end
+
+        return num_streamed
+
+    @staticmethod
+    def get_sources(response):
+        """
+        Collect the sources returned by the retriever tool during the agent's run.
+
+        Args:
+            response: The agent's response object.
+
+        Returns:
+            A list of unique sources in the order they were returned.
+        """
+        sources = []
+        for _, observation in response.get("intermediate_steps", []):
+            if isinstance(observation, dict) and observation.get("sources"):
+                for source in observation["sources"].split(","):
+                    source = source.strip()
+                    if source and source not in sources:
+                        sources.append(source)
+
+        return sources
+
     def interrupt_generation(self):
         """
         Interrupt agent's response.
@@ -132,20 +444,44 @@ class Agent():
     
     def update_vectorstore(self, vectorstore=None):
         """
-        
+        Create a retriever tool for the vectorstore and rebuild the agent with it.
+
+        Args:
+            vectorstore: A VectorStore object or None to detach the documents.
         """
         self.vectorstore = vectorstore
 
         if self.vectorstore is not None:
+            retriever = DocumentRetrieverTool(self.vectorstore, llm=self.llm)
+        else:
+            retriever = None
 
-            self.retriever = DocumentRetrieverTool(self.vectorstore)
+        self.set_retriever(retriever)
 
+    def set_retriever(self, retriever=None):
+        """
+        Rebuild the agent with an existing retriever tool, e.g. the one shared between sessions.
+
+        Args:
+            retriever: A DocumentRetrieverTool object or None to detach the documents.
+        """
+        self.retriever = retriever
+
+        if self.retriever is not None:
+            self.vectorstore = self.retriever.vectorstore
             self.tools = [
                 self.retriever.retriever_tool
             ]
         else:
-            self.retriever = None
+            self.vectorstore = None
             self.tools = []
         
         self.prompt_template = self.create_prompt_template()
-        self.agent = self.create_chat_agent()
\ No newline at end of file
+        self.agent = self.create_chat_agent()
+
+    @property
+    def is_busy(self):
+        """
+        Whether the agent is generating a response.
+        """
+        return self.agent_execution_task is not None and not self.agent_execution_task.done()
\ No newline at end of file
@@ -0,0 +1,153 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    A cache of agent answers keyed by the embedding of the question.
+
+    A question hits the cache if a question asked about the same corpus version
+    has a cosine similarity of at least similarity_threshold with it.
+    Entries are keyed by the corpus version and the question, so the answers of several versions,
+    e.g. of the execution modes, are kept side by side.
+    Entries expire after ttl seconds and the least recently used ones are evicted.
+
+    Args:
+        embedding_function: The embedding function used for questions.
+        similarity_threshold: The minimum cosine similarity of a hit.
+        ttl: The number of seconds an answer stays valid.
+        max_entries: The maximum number of cached answers.
+    """
+
+    def __init__(self, embedding_function, similarity_threshold=0.95, ttl=3600, max_entries=1000):
+        self.embedding_function = embedding_function
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+
+        self.entries = OrderedDict()  # (Corpus version, normalized question) -> entry
+        self._keys = []
+        self._matrix = None  # Embeddings of the entries, rebuilt on the next lookup after a change
+        self._lock = threading.Lock()
+
+    def lookup(self, question, corpus_version):
+        """
+        Find a cached answer for the question. Blocking, as the question may be embedded.
+
+        Args:
+            question: The user question.
+            corpus_version: The version of the corpus the answer must be based on.
+
+        Returns:
+            A dictionary with "answer" and "sources" or None.
+        """
+        key = (corpus_version, self._normalize(question))
+
+        with self._lock:
+            self._remove_expired()
+
+            # Identical questions do not need an embedding
+            entry = self.entries.get(key)
+            if entry is not None:
+                return self._hit(key, entry)
+
+            if len(self.entries) == 0:
+                self.misses += 1
+                return None
+
+        embedding = self._embed(question)
+
+        with self._lock:
+            if self._matrix is None:
+                self._keys = list(self.entries)
+                self._matrix = np.stack([self.entries[key]["embedding"] for key in self._keys]) \
+                    if self._keys else np.zeros((0, len(embedding)), dtype=np.float32)
+
+            similarities = self._matrix @ embedding
+            for i in np.argsort(-similarities):
+                if similarities[i] < self.similarity_threshold:
+                    break
+
+                entry = self.entries.get(self._keys[i])
+                if entry is not None and entry["corpus_version"] == corpus_version:
+                    return self._hit(self._keys[i], entry)
+
+            self.misses += 1
+            return None
+
+    def store(self, question, corpus_version, answer, sources):
+        """
+        Cache an answer. Blocking, as the question is embedded.
+
+        Args:
+            question: The user question.
+            corpus_version: The version of the corpus the answer is based on.
+            answer: The answer of the agent.
+            sources: A list of sources of the answer.
+        """
+        embedding = self._embed(question)
+        key = (corpus_version, self._normalize(question))
+
+        with self._lock:
+            self.entries[key] = {
+                "embedding": embedding,
+                "corpus_version": corpus_version,
+                "answer": answer,
+                "sources": sources,
+                "created_at": time.monotonic(),
+            }
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+            self._matrix = None
+
+    def invalidate(self):
+        """
+        Remove all cached answers, e.g. after the corpus changed.
+        """
+        with self._lock:
+            self.entries.clear()
+            self._matrix = None
+
+    def stats(self):
+        """
+        Returns the cache statistics.
+        """
+        requests = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.0,
+            "entries": len(self.entries),
+        }
+
+    def _hit(self, key, entry):
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return {"answer": entry["answer"], "sources": entry["sources"]}
+
+    def _remove_expired(self):
+        now = time.monotonic()
+        expired = [key for key, entry in self.entries.items() if now - entry["created_at"] > self.ttl]
+
+        for key in expired:
+            del self.entries[key]
+
+        if expired:
+            self._matrix = None
+
+    def _embed(self, question):
+        embedding = np.asarray(self.embedding_function.embed_query(question), dtype=np.float32)
+        return embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+
+    def _normalize(self, question):
+        return " ".join(question.lower().split())
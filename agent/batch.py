@@ -0,0 +1,126 @@
+import asyncio
+import os
+
+from agent.document_retrieval_chain import format_retrieval_prompt, split_answer_sources
+from data_pipeline.document_retriever import run_in_retrieval_executor
+from data_pipeline.metrics import llm_stage
+
+# The number of questions retrieved with one embedding call and one search of each index
+BATCH_RETRIEVAL_SIZE = int(os.getenv("BATCH_RETRIEVAL_SIZE", 64))
+
+
+class BatchAnswerer:
+    """
+    A class for answering many independent questions at once, without memory.
+
+    The retrieval runs for batches of questions: their embeddings are computed with one model call
+    and the dense and sparse searches run once per batch. The LLM calls of the questions
+    run concurrently, at most max_concurrency at a time, and the answers are yielded as they finish.
+    With a context packer, the documents of every question are packed into its token budget.
+
+    Args:
+        llm: The shared LLM object.
+        document_retriever: The HybridRetriever over the documents.
+        max_concurrency: The maximum number of concurrent LLM calls.
+        retrieval_batch_size: The number of questions retrieved at once.
+        context_packer: An optional ContextPacker, the documents are used as is if not set.
+    """
+
+    def __init__(
+        self,
+        llm,
+        document_retriever,
+        max_concurrency=8,
+        retrieval_batch_size=BATCH_RETRIEVAL_SIZE,
+        context_packer=None
+    ):
+        self.llm = llm
+        self.document_retriever = document_retriever
+        self.context_packer = context_packer
+        self.max_concurrency = max_concurrency
+        self.retrieval_batch_size = retrieval_batch_size
+
+    async def stream_answers(self, questions):
+        """
+        Answer the questions and yield the results in the order they finish.
+        The next batch is retrieved while the answers of the previous one are generated,
+        the answers of older batches are awaited first, so the documents of at most
+        two batches are held in memory.
+
+        Yields:
+            Dicts with the "index" of the question, its "input" and either
+            the "output" and "sources" or the "error". With a context packer, the answers
+            also have the "context_tokens" retrieved, packed and saved.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        pending = set()
+
+        try:
+            for start in range(0, len(questions), self.retrieval_batch_size):
+                batch = questions[start:start + self.retrieval_batch_size]
+
+                # Wait until at most one batch of answers is in flight
+                while len(pending) >= self.retrieval_batch_size:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        yield task.result()
+
+                try:
+                    batch_documents = await run_in_retrieval_executor(
+                        self.document_retriever.batch_get_relevant_documents, batch
+                    )
+                except Exception as e:
+                    for index, question in enumerate(batch, start):
+                        yield {"index": index, "input": question, "error": f"Retrieval failed: {e}"}
+                    continue
+
+                for index, (question, documents) in enumerate(zip(batch, batch_documents), start):
+                    pending.add(asyncio.create_task(self._answer(index, question, documents, semaphore)))
+
+                # Yield the answers that finished during the retrieval
+                done = {task for task in pending if task.done()}
+                pending -= done
+                for task in done:
+                    yield task.result()
+
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            # The client went away or the stream was closed early
+            for task in pending:
+                task.cancel()
+
+    async def _answer(self, index, question, documents, semaphore):
+        context_tokens = None
+        if self.context_packer is not None:
+            try:
+                packed = await run_in_retrieval_executor(self.context_packer.pack, question, documents)
+            except Exception as e:
+                return {"index": index, "input": question, "error": f"Context packing failed: {e}"}
+
+            documents = packed.documents
+            context_tokens = {
+                "retrieved": packed.retrieved_tokens, "packed": packed.packed_tokens, "saved": packed.saved_tokens
+            }
+
+        async with semaphore:
+            try:
+                with llm_stage("answer_llm"):
+                    response = await self.llm.model.ainvoke(format_retrieval_prompt(question, question, documents))
+            except Exception as e:
+                return {"index": index, "input": question, "error": str(e)}
+
+        answer, sources = split_answer_sources(response.content)
+
+        result = {
+            "index": index,
+            "input": question,
+            "output": answer,
+            "sources": [source.strip() for source in sources.split(",") if source.strip()]
+        }
+        if context_tokens is not None:
+            result["context_tokens"] = context_tokens
+
+        return result
@@ -0,0 +1,278 @@
+import os
+import re
+from typing import NamedTuple
+
+from langchain.chains.qa_with_sources.stuff_prompt import EXAMPLE_PROMPT
+from langchain_core.documents import Document
+from langchain_core.prompts import format_document
+
+from data_pipeline.metrics import record_context_tokens, track_stage
+
+# Token budget of the retrieved documents in the answer prompt
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", 4000))
+# Share of the word trigrams of the smaller chunk found in a kept chunk above which it is a duplicate
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", 0.8))
+# Keep only the sentences sharing words with the question and their neighbours
+CONTEXT_TRIM_SENTENCES = os.getenv("CONTEXT_TRIM_SENTENCES", "true").lower() == "true"
+
+# Marks the sentences left out of a trimmed chunk
+ELISION = " [...] "
+
+# Words too frequent to tell whether a sentence is relevant
+STOPWORDS = {
+    "the", "and", "for", "are", "was", "were", "what", "which", "who", "whom", "how", "why", "when", "where",
+    "does", "did", "has", "have", "had", "can", "could", "should", "would", "will", "with", "from", "into",
+    "about", "that", "this", "these", "those", "there", "their", "them", "they", "its", "than", "then",
+    "not", "but", "all", "any", "you", "your", "our", "his", "her", "also", "been", "being", "such",
+}
+
+# Sentence ends and line breaks, kept when a chunk is trimmed
+SENTENCE_SEPARATOR = re.compile(r"((?<=[.!?])\s+|\s*\n\s*)")
+
+
+class PackedContext(NamedTuple):
+    documents: list
+    retrieved_tokens: int  # Tokens of the retrieved documents as they were
+    packed_tokens: int  # Tokens of the packed documents
+
+    @property
+    def saved_tokens(self):
+        return self.retrieved_tokens - self.packed_tokens
+
+
+def estimate_tokens(text):
+    """
+    Returns an estimate of the number of tokens of a text: words and punctuation marks,
+    long words counted as several tokens.
+    """
+    return sum(1 + len(word) // 8 for word in re.findall(r"\w+|[^\w\s]", text))
+
+
+class ContextPacker:
+    """
+    A class for packing retrieved documents into a token budget of the answer prompt.
+
+    The documents, best first, are packed in four steps:
+    - near-duplicate chunks, e.g. the same passage found by the dense and the sparse search, are dropped
+    - adjacent chunks of the same file are merged into one document with a single source line
+    - chunks are trimmed to the sentences sharing words with the question and their neighbours
+    - documents are added until the budget is full, the least relevant sentences of the last one are left out
+
+    Args:
+        max_tokens: The token budget of the documents.
+        count_tokens: A function returning the number of tokens of a text,
+            e.g. the get_num_tokens method of the chat model. Defaults to estimate_tokens.
+        dedup_threshold: The trigram overlap above which a chunk is a near-duplicate of a kept one.
+        trim_sentences: Whether to trim the chunks to the relevant sentences.
+    """
+
+    def __init__(
+        self,
+        max_tokens=CONTEXT_MAX_TOKENS,
+        count_tokens=None,
+        dedup_threshold=CONTEXT_DEDUP_THRESHOLD,
+        trim_sentences=CONTEXT_TRIM_SENTENCES
+    ):
+        self.max_tokens = max_tokens
+        self.dedup_threshold = dedup_threshold
+        self.trim_sentences = trim_sentences
+
+        self._count_tokens = count_tokens or estimate_tokens
+
+    def pack(self, question, documents):
+        """
+        Pack the documents for the question and record the tokens saved in the metrics and the request timings.
+
+        Args:
+            question: The question, or the question and the original question of the user joined by a new line.
+            documents: A list of Document objects, best first.
+
+        Returns:
+            A PackedContext object.
+        """
+        with track_stage("context_packing"):
+            retrieved_tokens = sum(self.count_tokens(self.format(document)) for document in documents)
+
+            terms = self.get_terms(question)
+            documents = self.merge_adjacent(self.deduplicate(documents))
+            if self.trim_sentences:
+                documents = [self.trim(document, terms) for document in documents]
+            documents, packed_tokens = self.fill_budget(documents, terms)
+
+        record_context_tokens(retrieved_tokens, packed_tokens)
+
+        return PackedContext(documents, retrieved_tokens, packed_tokens)
+
+    def count_tokens(self, text):
+        try:
+            return self._count_tokens(text)
+        except Exception:
+            # The tokenizer of the model may not be available offline
+            self._count_tokens = estimate_tokens
+            return estimate_tokens(text)
+
+    @staticmethod
+    def format(document):
+        """
+        Returns the document as it appears in the prompt.
+        """
+        return format_document(document, EXAMPLE_PROMPT)
+
+    @staticmethod
+    def get_terms(text):
+        """
+        Returns the words of a text that tell relevant sentences apart, cut to a common prefix
+        so the inflected forms of a word match.
+        """
+        words = re.findall(r"\w+", text.lower())
+        return {word[:6] for word in words if len(word) > 2 and word not in STOPWORDS}
+
+    def deduplicate(self, documents):
+        """
+        Drop the documents whose word trigrams are mostly contained in a better ranked document.
+        """
+        kept = []
+        kept_shingles = []
+
+        for document in documents:
+            words = re.findall(r"\w+", document.page_content.lower())
+            shingles = {tuple(words[i:i + 3]) for i in range(max(1, len(words) - 2))}
+
+            is_duplicate = any(
+                len(shingles & other) / max(1, min(len(shingles), len(other))) >= self.dedup_threshold
+                for other in kept_shingles
+            )
+            if not is_duplicate:
+                kept.append(document)
+                kept_shingles.append(shingles)
+
+        return kept
+
+    @staticmethod
+    def merge_adjacent(documents):
+        """
+        Merge the chunks of the same file with consecutive chunk indexes, in file order.
+        A merged document takes the place and the metadata of its best ranked chunk.
+        """
+        positions = {}
+        for position, document in enumerate(documents):
+            filename = document.metadata.get("filename", document.metadata.get("source"))
+            chunk_index = document.metadata.get("chunk_index")
+            if filename is not None and chunk_index is not None:
+                positions[(filename, chunk_index)] = position
+
+        # Every chunk points to the first chunk of its run of consecutive chunks
+        run_start = {}
+        for (filename, chunk_index), position in sorted(positions.items()):
+            previous = positions.get((filename, chunk_index - 1))
+            run_start[position] = run_start[previous] if previous is not None else position
+
+        runs = {}
+        for position, document in enumerate(documents):
+            runs.setdefault(run_start.get(position, position), []).append((position, document))
+
+        merged = []
+        for run in runs.values():
+            if len(run) == 1:
+                merged.append(run[0])
+                continue
+
+            best_position, best_document = min(run, key=lambda item: item[0])
+            run.sort(key=lambda item: item[1].metadata["chunk_index"])
+            merged.append((best_position, Document(
+                page_content="\n\n".join(document.page_content for _, document in run),
+                metadata={
+                    **best_document.metadata,
+                    "chunk_index": run[0][1].metadata["chunk_index"],
+                    "merged_chunks": len(run)
+                }
+            )))
+
+        return [document for _, document in sorted(merged, key=lambda item: item[0])]
+
+    @staticmethod
+    def split_sentences(text):
+        """
+        Returns the sentences of a text and the separators that follow them.
+        """
+        parts = SENTENCE_SEPARATOR.split(text)
+        sentences = parts[0::2]
+        separators = parts[1::2] + [""]
+
+        return [(sentence, separator) for sentence, separator in zip(sentences, separators) if sentence.strip()]
+
+    def trim(self, document, terms):
+        """
+        Keep the sentences sharing words with the question and their neighbours.
+        A document without such sentences was found by meaning and is kept whole.
+        """
+        sentences = self.split_sentences(document.page_content)
+        relevant = [i for i, (sentence, _) in enumerate(sentences) if self.get_terms(sentence) & terms]
+
+        if not relevant:
+            return document
+
+        keep = {j for i in relevant for j in (i - 1, i, i + 1) if 0 <= j < len(sentences)}
+        if len(keep) == len(sentences):
+            return document
+
+        return self._with_sentences(document, sentences, keep)
+
+    def fill_budget(self, documents, terms):
+        """
+        Add the documents in order until the token budget is full. A document that does not fit
+        is cut to its most relevant sentences that do, and skipped if not even one does.
+
+        Returns:
+            A tuple of the list of packed documents and their number of tokens.
+        """
+        packed = []
+        used_tokens = 0
+
+        for document in documents:
+            remaining_tokens = self.max_tokens - used_tokens
+            tokens = self.count_tokens(self.format(document))
+
+            if tokens > remaining_tokens:
+                document = self._cut_to_budget(document, terms, remaining_tokens)
+                if document is None:
+                    continue
+                tokens = self.count_tokens(self.format(document))
+
+            packed.append(document)
+            used_tokens += tokens
+
+        return packed, used_tokens
+
+    def _cut_to_budget(self, document, terms, max_tokens):
+        sentences = self.split_sentences(document.page_content)
+        overhead = self.count_tokens(self.format(Document(page_content="", metadata=document.metadata)))
+
+        # Sentences with more question words first, then in the order of the text
+        ranked = sorted(
+            range(len(sentences)),
+            key=lambda i: (-len(self.get_terms(sentences[i][0]) & terms), i)
+        )
+
+        keep = set()
+        used_tokens = overhead
+        for i in ranked:
+            tokens = self.count_tokens(sentences[i][0]) + 1
+            if used_tokens + tokens <= max_tokens:
+                keep.add(i)
+                used_tokens += tokens
+
+        if not keep:
+            return None
+
+        return self._with_sentences(document, sentences, keep)
+
+    @staticmethod
+    def _with_sentences(document, sentences, keep):
+        parts = []
+        for i in sorted(keep):
+            if parts and i - 1 not in keep:
+                parts[-1] = ELISION
+            parts += [sentences[i][0], sentences[i][1]]
+
+        return Document(page_content="".join(parts[:-1]).strip(), metadata=dict(document.metadata))
@@ -1,17 +1,24 @@
 import ast
+import os
 import re
-from typing import Tuple
+from typing import Any, Tuple
 from langchain.chains import RetrievalQAWithSourcesChain
-from langchain_core.prompts import PromptTemplate
+from langchain.chains.qa_with_sources.stuff_prompt import EXAMPLE_PROMPT
+from langchain_core.prompts import PromptTemplate, format_document
 
+from data_pipeline.document_retriever import run_in_retrieval_executor
 
-RETRIEVAL_CHAIN_PROMPT_TEMPLATE = """Given the following extracted parts of a long document and a question, create a well-detailed answer with as much numerical data and arguments as possible with references ("SOURCES"). Consider "LONG QUESTION" to understand the original question.
+
+RETRIEVAL_CHAIN_INSTRUCTIONS = """Given the following extracted parts of a long document and a question, create a well-detailed answer with as much numerical data and arguments as possible with references ("SOURCES"). Consider "LONG QUESTION" to understand the original question.
 
 If you don't know the answer, just say that you don't know. Don't try to make up an answer.
 
 ALWAYS return a "SOURCES" part in your answer, use the following format when returning sources: "SOURCES: <source_1>, <source_2>, <source_n>". For example: "SOURCES: Documentation.pdf, data_orders.xlsx".
 
-QUESTION: What are the key differences between TCP and UDP protocols?
+"""
+
+# Show the answer format, at the cost of several hundred tokens per call
+RETRIEVAL_CHAIN_EXAMPLES = """QUESTION: What are the key differences between TCP and UDP protocols?
 =========
 Content: TCP (Transmission Control Protocol) is a connection-oriented protocol that provides reliable data transfer with error checking and flow control mechanisms. It ensures that data packets are delivered in order and retransmits lost packets.
 Source: networking_fundamentals.pdf
@@ -47,20 +54,66 @@ FINAL ANSWER: Остання версія програмного продукт
 
 SOURCES: abc_release_notes.pdf, abc_user_manual_ua.docx
 
-QUESTION: {question}
+"""
+
+RETRIEVAL_CHAIN_QUESTION = """QUESTION: {question}
 LONG QUESTION: {long_question}
 =========
 {summaries}
 =========
 FINAL ANSWER:"""
 
+# Set RETRIEVAL_PROMPT_EXAMPLES to "false" to leave the examples out of the answer prompts
+RETRIEVAL_PROMPT_EXAMPLES = os.getenv("RETRIEVAL_PROMPT_EXAMPLES", "true").lower() == "true"
+
+RETRIEVAL_CHAIN_PROMPT_TEMPLATE = (
+    RETRIEVAL_CHAIN_INSTRUCTIONS
+    + (RETRIEVAL_CHAIN_EXAMPLES if RETRIEVAL_PROMPT_EXAMPLES else "")
+    + RETRIEVAL_CHAIN_QUESTION
+)
+
 RETRIEVAL_CHAIN_PROMPT = PromptTemplate(
     template=RETRIEVAL_CHAIN_PROMPT_TEMPLATE,
     input_variables=["summaries", "question", "long_question"],
 )
 
+# The line of sources the prompt asks for, "source:" within the answer text does not end it
+SOURCES_MARKER = re.compile(r"^SOURCES:", re.MULTILINE)
+
+
+def format_retrieval_prompt(question, long_question, documents):
+    """
+    Fill RETRIEVAL_CHAIN_PROMPT with the retrieved documents, the same way the chain's "stuff" step does.
+    """
+    return RETRIEVAL_CHAIN_PROMPT.format(
+        question=question,
+        long_question=long_question,
+        summaries="\n\n".join(format_document(document, EXAMPLE_PROMPT) for document in documents)
+    )
+
+
+def split_answer_sources(output):
+    """
+    Split an answer written with RETRIEVAL_CHAIN_PROMPT into the answer and its sources
+    at the SOURCES_MARKER line.
+
+    Returns:
+        A tuple of the answer and a comma separated string of sources.
+    """
+    match = SOURCES_MARKER.search(output)
+    if match:
+        answer = re.split(r"QUESTION:\s", output[:match.start()], flags=re.IGNORECASE)[0]
+        sources = output[match.end():].split("\n")[0].strip()
+    else:
+        answer, sources = output, ""
+
+    return answer.strip(), sources
+
 
 class DocumentRetrievalChain(RetrievalQAWithSourcesChain):
+    # A ContextPacker fitting the retrieved documents into its token budget, the documents are used as is if not set
+    context_packer: Any = None
+
     @classmethod
     def from_chain_type(
         cls,
@@ -76,6 +129,47 @@ class DocumentRetrievalChain(RetrievalQAWithSourcesChain):
 
     def invoke(self, query):
 
+        question, long_question = self._parse_query(query)
+
+        chain_output = super().invoke({"question": question, "long_question": long_question})
+
+        output = {"answer": chain_output["answer"], "sources": chain_output["sources"]}
+
+        return output
+
+    async def ainvoke(self, query):
+        """
+        Async version of invoke: the retrieval runs in the retrieval thread pool
+        and the answer LLM call is awaited.
+        """
+
+        question, long_question = self._parse_query(query)
+
+        chain_output = await super().ainvoke({"question": question, "long_question": long_question})
+
+        output = {"answer": chain_output["answer"], "sources": chain_output["sources"]}
+
+        return output
+
+    def _get_docs(self, inputs, *, run_manager):
+        documents = super()._get_docs(inputs, run_manager=run_manager)
+        return self._pack_documents(inputs, documents)
+
+    async def _aget_docs(self, inputs, *, run_manager):
+        documents = await super()._aget_docs(inputs, run_manager=run_manager)
+        # Packing counts tokens of every sentence, it runs off the event loop
+        return await run_in_retrieval_executor(self._pack_documents, inputs, documents)
+
+    def _pack_documents(self, inputs, documents):
+        if self.context_packer is None:
+            return documents
+
+        # Sentences are relevant to the search query or to the original question of the user
+        question = f"{inputs['question']}\n{inputs.get('long_question', '')}"
+        return self.context_packer.pack(question, documents).documents
+
+    def _parse_query(self, query):
+
         # Parse input string from the agent
         try:
             parsed_query = ast.literal_eval(query)
@@ -90,8 +184,4 @@ class DocumentRetrievalChain(RetrievalQAWithSourcesChain):
             question = query
             long_question = question
 
-        chain_output = super().invoke({"question": question, "long_question": long_question})
-
-        output = {"answer": chain_output["answer"], "sources": chain_output["sources"]}
-
-        return output
\ No newline at end of file
+        return question, long_question
@@ -1,19 +1,384 @@
+import asyncio
 import os
+import threading
+import time
 
+import httpx
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_openai import ChatOpenAI
 from dotenv import load_dotenv
 
+from data_pipeline.metrics import get_llm_stage, metrics, record_llm_tokens, record_stage
+
 load_dotenv()
 
+LLM_MODEL_NAME = os.getenv("LLM_MODEL_NAME", "gpt-4o-mini")
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", 0.2))
+# Point it at any OpenAI-compatible server, e.g. a local mock
+LLM_BASE_URL = os.getenv("LLM_BASE_URL") or None
+
+# Connection pool shared by all requests to the LLM API
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 100))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", 20))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", 60))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", 5))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))
+
+# Retries with exponential backoff on connection errors, 429 and 5xx responses
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 3))
+# Requests beyond the limit wait for a free slot instead of being sent
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 16))
+
+_llm_client_factory = None
+_llm_client_factory_lock = threading.Lock()
+
+llm_errors = metrics.counter("rag_llm_errors_total", "Failed LLM calls", ["stage"])
+
+
+class ConcurrencyLimiter:
+    """
+    A limit of in-flight requests. Sync and async requests have separate limits of the same size,
+    as they use separate connection pools. A slot is held until the response body is closed,
+    so streamed responses count until they end.
+
+    Args:
+        max_concurrency: The maximum number of in-flight requests of each kind.
+    """
+
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.waiting = 0
+
+        self._semaphore = threading.Semaphore(max_concurrency)
+        self._async_semaphore = None  # Created on first use in the event loop
+        # Guards the counters, updated by the threads of sync requests and the event loop
+        self._counter_lock = threading.Lock()
+
+    def acquire(self):
+        self._update(waiting=1)
+        try:
+            self._semaphore.acquire()
+        except BaseException:
+            self._update(waiting=-1)
+            raise
+        # One update, so stats never miss a request between waiting and in flight
+        self._update(waiting=-1, in_flight=1)
+
+    def release(self):
+        self._update(in_flight=-1)
+        self._semaphore.release()
+
+    async def aacquire(self):
+        if self._async_semaphore is None:
+            self._async_semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        self._update(waiting=1)
+        try:
+            await self._async_semaphore.acquire()
+        except BaseException:
+            self._update(waiting=-1)
+            raise
+        # One update, so stats never miss a request between waiting and in flight
+        self._update(waiting=-1, in_flight=1)
+
+    def arelease(self):
+        self._update(in_flight=-1)
+        self._async_semaphore.release()
+
+    def stats(self):
+        with self._counter_lock:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+            }
+
+    def _update(self, waiting=0, in_flight=0):
+        with self._counter_lock:
+            self.waiting += waiting
+            self.in_flight += in_flight
+
+
+class _LimitedByteStream(httpx.SyncByteStream):
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._release()
+            self._release = lambda: None
+
+
+class _AsyncLimitedByteStream(httpx.AsyncByteStream):
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+            self._release = lambda: None
+
+
+class LimitedTransport(httpx.HTTPTransport):
+    """
+    A pooled HTTP transport that waits for a slot of the limiter before sending a request.
+    """
+
+    def __init__(self, limiter, **kwargs):
+        super().__init__(**kwargs)
+        self.limiter = limiter
+
+    def handle_request(self, request):
+        self.limiter.acquire()
+        try:
+            response = super().handle_request(request)
+        except BaseException:
+            self.limiter.release()
+            raise
+
+        response.stream = _LimitedByteStream(response.stream, self.limiter.release)
+        return response
+
+
+class AsyncLimitedTransport(httpx.AsyncHTTPTransport):
+    """
+    Async version of LimitedTransport.
+    """
+
+    def __init__(self, limiter, **kwargs):
+        super().__init__(**kwargs)
+        self.limiter = limiter
+
+    async def handle_async_request(self, request):
+        await self.limiter.aacquire()
+        try:
+            response = await super().handle_async_request(request)
+        except BaseException:
+            self.limiter.arelease()
+            raise
+
+        response.stream = _AsyncLimitedByteStream(response.stream, self.limiter.arelease)
+        return response
+
+
+class LLMMetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Records the duration and the token usage of every LLM call under the stage set with llm_stage.
+    Runs inline, so the durations are added to the timings of the request that made the call.
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self._calls = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._calls[run_id] = (get_llm_stage(), time.perf_counter())
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._calls[run_id] = (get_llm_stage(), time.perf_counter())
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        call = self._calls.pop(run_id, None)
+        if call is None:
+            return
+
+        stage, start = call
+        record_stage(stage, time.perf_counter() - start)
+
+        # Streamed responses only report usage in their generation message
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+
+        if not usage:
+            for generations in response.generations:
+                for generation in generations:
+                    usage_metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    prompt_tokens += usage_metadata.get("input_tokens", 0)
+                    completion_tokens += usage_metadata.get("output_tokens", 0)
+
+        record_llm_tokens(stage, prompt_tokens, completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        call = self._calls.pop(run_id, None)
+        if call is not None:
+            llm_errors.inc(stage=call[0])
+
+
+class LLMClientFactory:
+    """
+    A class that owns the HTTP clients of the LLM API and the chat model using them.
+
+    One sync and one async connection pool with keep-alive are shared by every agent,
+    retrieval chain and memory, so requests reuse warm connections.
+
+    Args:
+        model_name: The name of the chat model.
+        temperature: The sampling temperature.
+        base_url: The base URL of an OpenAI-compatible API. Defaults to the OpenAI API.
+        api_key: The API key.
+        max_connections: The maximum number of connections of each pool.
+        max_keepalive_connections: The maximum number of idle connections kept open.
+        keepalive_expiry: The number of seconds an idle connection is kept open.
+        connect_timeout: The connection timeout in seconds.
+        timeout: The timeout of reading, writing and waiting for a pooled connection in seconds.
+        max_retries: The number of retries of a failed request, with exponential backoff.
+        max_concurrency: The maximum number of in-flight requests.
+    """
+
+    def __init__(
+        self,
+        model_name="gpt-4o-mini",
+        temperature=0.2,
+        base_url=None,
+        api_key=None,
+        max_connections=100,
+        max_keepalive_connections=20,
+        keepalive_expiry=60,
+        connect_timeout=5,
+        timeout=60,
+        max_retries=3,
+        max_concurrency=16
+    ):
+        self.model_name = model_name
+        self.temperature = temperature
+        self.base_url = base_url
+        self.api_key = api_key
+        self.max_retries = max_retries
+
+        self.limiter = ConcurrencyLimiter(max_concurrency)
+
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+
+        self.http_client = httpx.Client(
+            transport=LimitedTransport(self.limiter, limits=limits),
+            timeout=self.timeout
+        )
+        self.http_async_client = httpx.AsyncClient(
+            transport=AsyncLimitedTransport(self.limiter, limits=limits),
+            timeout=self.timeout
+        )
+
+        self.metrics_callback = LLMMetricsCallbackHandler()
+
+        self._chat_model = None
+        self._lock = threading.Lock()
+
+    @property
+    def chat_model(self):
+        """
+        The shared chat model, created on the first access.
+        """
+        if self._chat_model is None:
+            with self._lock:
+                if self._chat_model is None:
+                    self._chat_model = self.create_chat_model()
+
+        return self._chat_model
+
+    def create_chat_model(self, **kwargs):
+        """
+        Create a chat model that uses the shared HTTP clients.
+
+        Args:
+            kwargs: Options overriding the defaults, e.g. temperature.
+        """
+        options = {
+            "model_name": self.model_name,
+            "temperature": self.temperature,
+            "api_key": self.api_key,
+            "base_url": self.base_url,
+            "timeout": self.timeout,
+            "max_retries": self.max_retries,
+            "http_client": self.http_client,
+            "http_async_client": self.http_async_client,
+            # Streamed responses report their token usage in the last chunk
+            "stream_usage": True,
+            "callbacks": [self.metrics_callback],
+        }
+        options.update(kwargs)
+
+        return ChatOpenAI(**options)
+
+    def stats(self):
+        """
+        Returns the statistics of the concurrency limiter.
+        """
+        return self.limiter.stats()
+
+    async def aclose(self):
+        """
+        Close the connection pools.
+        """
+        self.http_client.close()
+        await self.http_async_client.aclose()
+
+
+def get_llm_client_factory():
+    """
+    Returns the process-wide LLMClientFactory configured from the environment.
+    """
+    global _llm_client_factory
+
+    with _llm_client_factory_lock:
+        if _llm_client_factory is None:
+            _llm_client_factory = LLMClientFactory(
+                model_name=LLM_MODEL_NAME,
+                temperature=LLM_TEMPERATURE,
+                base_url=LLM_BASE_URL,
+                api_key=os.getenv("OPENAI_API_KEY"),
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+                connect_timeout=LLM_CONNECT_TIMEOUT,
+                timeout=LLM_TIMEOUT,
+                max_retries=LLM_MAX_RETRIES,
+                max_concurrency=LLM_MAX_CONCURRENCY
+            )
+
+    return _llm_client_factory
+
+
+async def close_llm_clients():
+    """
+    Close the connection pools of the process-wide LLMClientFactory if it was created.
+    """
+    global _llm_client_factory
+
+    with _llm_client_factory_lock:
+        factory, _llm_client_factory = _llm_client_factory, None
+
+    if factory is not None:
+        await factory.aclose()
+
+
 class LLM:
+    """
+    A handle of the shared chat model. Every instance uses the same connection pools.
+    """
+
     def __init__(self):
         self.model = self._create_llm()
-        
+
     def _create_llm(self):
-        model = ChatOpenAI(
-            temperature=0.2,
-            model_name="gpt-4o-mini",
-            api_key=os.getenv("OPENAI_API_KEY")
-        )
-        
-        return model
\ No newline at end of file
+        return get_llm_client_factory().chat_model
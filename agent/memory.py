@@ -0,0 +1,133 @@
+import asyncio
+from collections import deque
+from typing import Any
+
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain.memory.prompt import SUMMARY_PROMPT
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.messages import BaseMessage, SystemMessage, get_buffer_string
+from pydantic import PrivateAttr
+
+from data_pipeline.metrics import llm_stage
+
+
+class SummarizingTokenBufferMemory(BaseChatMemory):
+    """
+    A conversation memory that keeps its size within a token budget.
+
+    Recent messages are kept verbatim. When the budget is exceeded, the oldest messages are
+    moved out of the buffer and compacted into a rolling summary by the LLM in the background.
+    Until the summary is updated, the moved messages are still returned verbatim.
+    Token counts are computed once per message and tracked incrementally.
+    """
+
+    llm: BaseLanguageModel
+    max_token_limit: int = 2000
+    memory_key: str = "chat_history"
+    moving_summary: str = ""
+
+    _message_tokens: deque = PrivateAttr(default_factory=deque)
+    _buffer_tokens: int = PrivateAttr(default=0)
+    _summary_tokens: int = PrivateAttr(default=0)
+    _pending_messages: list = PrivateAttr(default_factory=list)
+    _summary_task: Any = PrivateAttr(default=None)
+
+    @property
+    def memory_variables(self) -> list[str]:
+        return [self.memory_key]
+
+    @property
+    def buffer_as_messages(self) -> list[BaseMessage]:
+        """
+        The summary of the older messages followed by the recent messages.
+        """
+        messages = []
+        if self.moving_summary:
+            messages.append(SystemMessage(content=f"Summary of the earlier conversation: {self.moving_summary}"))
+
+        return messages + self._pending_messages + self.chat_memory.messages
+
+    def load_memory_variables(self, inputs: dict[str, Any]) -> dict[str, Any]:
+        if self.return_messages:
+            return {self.memory_key: self.buffer_as_messages}
+
+        return {self.memory_key: get_buffer_string(self.buffer_as_messages)}
+
+    def save_context(self, inputs: dict[str, Any], outputs: dict[str, str]) -> None:
+        num_messages = len(self.chat_memory.messages)
+        super().save_context(inputs, outputs)
+
+        for message in self.chat_memory.messages[num_messages:]:
+            tokens = self.llm.get_num_tokens(get_buffer_string([message]))
+            self._message_tokens.append(tokens)
+            self._buffer_tokens += tokens
+
+        self._prune()
+
+    async def asave_context(self, inputs: dict[str, Any], outputs: dict[str, str]) -> None:
+        # Counting tokens is cheap, the summary itself is scheduled as a task
+        self.save_context(inputs, outputs)
+
+    def clear(self) -> None:
+        super().clear()
+
+        if self._summary_task is not None and not self._summary_task.done():
+            self._summary_task.cancel()
+
+        self.moving_summary = ""
+        self._message_tokens.clear()
+        self._buffer_tokens = 0
+        self._summary_tokens = 0
+        self._pending_messages = []
+        self._summary_task = None
+
+    def _prune(self):
+        # Keep at least the last exchange verbatim
+        messages = self.chat_memory.messages
+        while self._summary_tokens + self._buffer_tokens > self.max_token_limit and len(messages) > 2:
+            self._pending_messages.append(messages.pop(0))
+            self._buffer_tokens -= self._message_tokens.popleft()
+
+        if self._pending_messages:
+            self._schedule_summary()
+
+    def _schedule_summary(self):
+        if self._summary_task is not None and not self._summary_task.done():
+            # The running task picks up the new messages when it finishes
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._summarize()
+            return
+
+        self._summary_task = loop.create_task(self._asummarize())
+
+    def _summarize(self):
+        while self._pending_messages:
+            messages = list(self._pending_messages)
+            prompt = SUMMARY_PROMPT.format(summary=self.moving_summary, new_lines=get_buffer_string(messages))
+            with llm_stage("memory_llm"):
+                summary = self.llm.invoke(prompt)
+            self._update_summary(summary, messages)
+
+    async def _asummarize(self):
+        while self._pending_messages:
+            messages = list(self._pending_messages)
+            prompt = SUMMARY_PROMPT.format(summary=self.moving_summary, new_lines=get_buffer_string(messages))
+            try:
+                with llm_stage("memory_llm"):
+                    summary = await self.llm.ainvoke(prompt)
+            except Exception as e:
+                # The messages stay pending and are summarized after the next turn
+                print(f"Failed to summarize the conversation: {e}")
+                return
+            self._update_summary(summary, messages)
+
+    def _update_summary(self, summary, messages):
+        self.moving_summary = summary.content if isinstance(summary, BaseMessage) else str(summary)
+        self._summary_tokens = self.llm.get_num_tokens(self.moving_summary)
+
+        # Messages added while the summary was generated stay pending
+        self._pending_messages = self._pending_messages[len(messages):]
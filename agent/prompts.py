@@ -60,4 +60,15 @@ Previous conversation history:
 
 New input: {input}
 {agent_scratchpad}
-"""
\ No newline at end of file
+"""
+
+CONDENSE_QUESTION_PROMPT = """\
+Given the following conversation and a follow up question, rephrase the follow up question \
+to be a standalone question with important keywords, in its original language. \
+Return only the standalone question.
+
+Conversation:
+{chat_history}
+
+Follow up question: {question}
+Standalone question:"""
@@ -1,9 +1,11 @@
 from langchain.agents.react.base import Tool
 
+from agent.context_packing import CONTEXT_MAX_TOKENS, ContextPacker
 from agent.document_retrieval_chain import DocumentRetrievalChain
 from data_pipeline.document_retriever import create_document_retriever
 from data_pipeline.vectorstore import VectorStore
 from agent.llm import LLM
+from data_pipeline.metrics import llm_stage, track_stage
 
 RETRIEVER_TOOL_NAME = "retriever_tool"
 RETRIEVER_TOOL_DESCRIPTION = """\
@@ -15,10 +17,14 @@ If you want to use this tool, you MUST provide the following parameters in this
 
 
 class DocumentRetrieverTool:
-    def __init__(self, vectorstore: VectorStore, num_documents=3, max_tokens_limit=4000):
+    def __init__(self, vectorstore: VectorStore, num_documents=3, max_tokens_limit=CONTEXT_MAX_TOKENS, llm: LLM = None):
         self.num_documents = num_documents
         self.max_tokens_limit = max_tokens_limit
         self.vectorstore = vectorstore
+        self.llm = llm or LLM()
+
+        # Shared by the chain, the agent's single-shot mode and batch answers
+        self.context_packer = ContextPacker(max_tokens=max_tokens_limit, count_tokens=self.llm.model.get_num_tokens)
         self.retriever_tool = self.create_retriever_tool()
 
     def create_retriever_tool(self):
@@ -26,24 +32,43 @@ class DocumentRetrieverTool:
         Create a tool to retrieve documents from vectorstore
         """
 
-        llm = LLM()
-
         retriever = create_document_retriever(
             vectorstore=self.vectorstore,
             num_documents=self.num_documents
         )
 
+        # Also used directly by the agent's single-shot mode
+        self.document_retriever = retriever
+
         retrieval_chain = DocumentRetrievalChain.from_chain_type(
-            llm=llm.model,
+            llm=self.llm.model,
             retriever= retriever,
             max_tokens_limit=self.max_tokens_limit,
+            context_packer=self.context_packer,
             verbose=True
         )
 
+        self.retrieval_chain = retrieval_chain
+
         retriever_tool = Tool(
             name=RETRIEVER_TOOL_NAME,
-            func=retrieval_chain.invoke,
+            func=self.run_retrieval_chain,
+            coroutine=self.arun_retrieval_chain,
             description=RETRIEVER_TOOL_DESCRIPTION
         )
 
-        return retriever_tool
\ No newline at end of file
+        return retriever_tool
+
+    def run_retrieval_chain(self, query):
+        """
+        Run the retrieval chain, its answer LLM call is recorded as the "answer_llm" stage.
+        """
+        with track_stage(RETRIEVER_TOOL_NAME), llm_stage("answer_llm"):
+            return self.retrieval_chain.invoke(query)
+
+    async def arun_retrieval_chain(self, query):
+        """
+        Async version of run_retrieval_chain.
+        """
+        with track_stage(RETRIEVER_TOOL_NAME), llm_stage("answer_llm"):
+            return await self.retrieval_chain.ainvoke(query)
\ No newline at end of file
@@ -0,0 +1,143 @@
+import threading
+import time
+from collections import OrderedDict
+
+from agent.agent import Agent
+from agent.llm import LLM
+from agent.retriever import DocumentRetrieverTool
+
+DEFAULT_SESSION_ID = "default"
+
+
+class SessionLimitError(Exception):
+    pass
+
+
+class Session:
+    """
+    Lightweight per-session state: an agent with its own memory.
+    """
+
+    def __init__(self, session_id, agent, retriever_version):
+        self.session_id = session_id
+        self.agent = agent
+        self.retriever_version = retriever_version
+        self.last_used = time.monotonic()
+
+
+class SessionManager:
+    """
+    A class for serving many users with one process.
+
+    The LLM client and the retriever tool (with its vectorstore and indexes) are shared,
+    while every session gets an agent with its own memory and execution task.
+
+    Args:
+        max_sessions: The maximum number of sessions kept at once.
+        idle_timeout: The number of seconds after which an idle session is evicted.
+    """
+
+    def __init__(self, max_sessions=100, idle_timeout=1800):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+
+        self.llm = LLM()
+        self.retriever = None
+        self.retriever_version = 0
+
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def update_vectorstore(self, vectorstore=None):
+        """
+        Create a shared retriever tool for the vectorstore.
+        Sessions switch to it on their next request.
+
+        Args:
+            vectorstore: A VectorStore object or None to detach the documents.
+        """
+        if vectorstore is not None:
+            retriever = DocumentRetrieverTool(vectorstore, llm=self.llm)
+        else:
+            retriever = None
+
+        with self.lock:
+            self.retriever = retriever
+            self.retriever_version += 1
+
+    def get_session(self, session_id):
+        """
+        Returns the agent of a session, creating the session if it does not exist.
+
+        Raises:
+            SessionLimitError: If the session limit is reached and no session can be evicted.
+        """
+        with self.lock:
+            self._evict_idle_sessions()
+
+            session = self.sessions.get(session_id)
+
+            if session is None:
+                if len(self.sessions) >= self.max_sessions and not self._evict_least_recently_used():
+                    raise SessionLimitError(f"The limit of {self.max_sessions} sessions is reached")
+
+                agent = Agent(llm=self.llm, retriever=self.retriever)
+                session = Session(session_id, agent, self.retriever_version)
+                self.sessions[session_id] = session
+
+            elif session.retriever_version != self.retriever_version and not session.agent.is_busy:
+                session.agent.set_retriever(self.retriever)
+                session.retriever_version = self.retriever_version
+
+            session.last_used = time.monotonic()
+            self.sessions.move_to_end(session_id)
+
+            return session.agent
+
+    def find_session(self, session_id):
+        """
+        Returns the agent of an existing session or None.
+        """
+        with self.lock:
+            session = self.sessions.get(session_id)
+            return session.agent if session is not None else None
+
+    def remove_session(self, session_id):
+        """
+        Interrupt the session's generation and forget the session.
+        """
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+
+        if session is not None:
+            session.agent.interrupt_generation()
+
+    def interrupt_all(self):
+        """
+        Interrupt the generation of all sessions.
+        """
+        with self.lock:
+            agents = [session.agent for session in self.sessions.values()]
+
+        for agent in agents:
+            agent.interrupt_generation()
+
+    def _evict_idle_sessions(self):
+        now = time.monotonic()
+
+        expired = [
+            session_id for session_id, session in self.sessions.items()
+            if now - session.last_used > self.idle_timeout and not session.agent.is_busy
+        ]
+
+        for session_id in expired:
+            del self.sessions[session_id]
+
+    def _evict_least_recently_used(self):
+        # Sessions are ordered from the least recently used
+        for session_id, session in self.sessions.items():
+            if not session.agent.is_busy:
+                del self.sessions[session_id]
+                return True
+
+        return False
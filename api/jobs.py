@@ -0,0 +1,154 @@
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+
+from data_pipeline.metrics import collect_timings
+
+
+class JobStatus(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class Job:
+    """
+    State of a single background job.
+
+    Args:
+        name: A human readable name of the job.
+    """
+
+    def __init__(self, name):
+        self.job_id = uuid.uuid4().hex
+        self.name = name
+        self.status = JobStatus.PENDING
+        self.stage = None
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.timings = {}  # Seconds per stage, e.g. parse and embed_documents
+
+    def update_progress(self, stage, done=None, total=None):
+        """
+        Update the progress of the job. Called from the worker thread.
+
+        Args:
+            stage: The name of the current stage.
+            done: The number of processed items of the stage.
+            total: The total number of items of the stage.
+        """
+        self.stage = stage
+        if total is not None:
+            self.total = total
+        if done is not None:
+            self.done = done
+
+    def to_dict(self):
+        """
+        Returns a JSON serializable representation of the job.
+        """
+        return {
+            "job_id": self.job_id,
+            "name": self.name,
+            "status": self.status.value,
+            "stage": self.stage,
+            "progress": {"done": self.done, "total": self.total},
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "timings": {stage: round(seconds, 4) for stage, seconds in self.timings.items()},
+        }
+
+
+class JobManager:
+    """
+    A class for running blocking jobs in a worker pool outside of the event loop.
+
+    Args:
+        max_workers: The number of worker threads.
+        max_finished_jobs: The number of finished jobs to keep for status requests.
+    """
+
+    def __init__(self, max_workers=1, max_finished_jobs=100):
+        self.max_finished_jobs = max_finished_jobs
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, name, func, *args, **kwargs):
+        """
+        Schedule a job in the worker pool.
+
+        Args:
+            name: A human readable name of the job.
+            func: A callable that receives the Job object as the first argument.
+                Its return value is stored as the job result.
+
+        Returns:
+            The created Job object.
+        """
+        job = Job(name)
+
+        with self.lock:
+            self.jobs[job.job_id] = job
+            self._remove_finished_jobs()
+
+        self.executor.submit(self._run, job, func, args, kwargs)
+
+        return job
+
+    def get_job(self, job_id):
+        """
+        Returns a Job object by its id or None if it does not exist.
+        """
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self):
+        """
+        Returns a list of all known jobs, oldest first.
+        """
+        with self.lock:
+            return list(self.jobs.values())
+
+    def shutdown(self):
+        """
+        Stop accepting new jobs and wait for the running ones.
+        """
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def _run(self, job, func, args, kwargs):
+        job.status = JobStatus.RUNNING
+        job.started_at = time.time()
+
+        try:
+            with collect_timings() as job.timings:
+                job.result = func(job, *args, **kwargs)
+            job.status = JobStatus.SUCCEEDED
+        except Exception as e:
+            traceback.print_exc()
+            job.error = str(e)
+            job.status = JobStatus.FAILED
+        finally:
+            job.finished_at = time.time()
+
+    def _remove_finished_jobs(self):
+        finished = [
+            job_id for job_id, job in self.jobs.items()
+            if job.status in (JobStatus.SUCCEEDED, JobStatus.FAILED)
+        ]
+
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[job_id]
@@ -1,29 +1,197 @@
-from fastapi import HTTPException, FastAPI, status
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import Depends, HTTPException, FastAPI, Request, status
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+import json
 import os
+import time
+from typing import Literal
 from pydantic import BaseModel
 import base64
 from io import BytesIO
 
 from agent.agent import Agent
+from agent.answer_cache import SemanticAnswerCache
+from agent.batch import BatchAnswerer
+from agent.llm import close_llm_clients, get_llm_client_factory
+from agent.sessions import DEFAULT_SESSION_ID, SessionLimitError, SessionManager
 from api.exception_handling import handle_exceptions
+from api.jobs import JobManager, JobStatus
+from api.uploads import UploadError, UploadTooLargeError, receive_uploads, remove_uploads
 
-from data_pipeline.vectorstore import VectorStore
-from data_pipeline.documents_preparation import load_single_document
+from data_pipeline.document_retriever import retrieval_cache, retrieval_executor, run_in_retrieval_executor
+from data_pipeline.embeddings import get_embedding_provider
+from data_pipeline.index_generations import IndexGenerations
+from data_pipeline.ingestion import IngestionPipeline
+from data_pipeline.metrics import collect_context_tokens, collect_timings, metrics, track_stage
+from data_pipeline.vectorstore import compute_file_hash
+from data_pipeline.documents_preparation import DEFAULT_CHUNKING, ensure_nltk_data, shutdown_process_pool
 
-agent = Agent()
+# Number of parser processes used by ingestion jobs
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", os.cpu_count() or 1))
 
-app = FastAPI()
+# Limits of multipart uploads, the files are spooled to UPLOAD_DIR until they are ingested
+UPLOAD_DIR = os.getenv("UPLOAD_DIR") or None
+UPLOAD_MAX_FILE_BYTES = int(os.getenv("UPLOAD_MAX_FILE_BYTES", 100 * 1024 ** 2))
+UPLOAD_MAX_TOTAL_BYTES = int(os.getenv("UPLOAD_MAX_TOTAL_BYTES", 1024 ** 3))
 
-handle_exceptions(
-    app=app,
-    on_error=agent.interrupt_generation
+# Semantic cache of answers to first questions of sessions
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", 3600))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 1000))
+
+# Limits of /batch_chat_completion, the LLM client limits the concurrency of all requests on top
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", 1000))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 8))
+
+# Ingestion is serialized with a single worker as every job modifies the vectorstore
+ingestion_jobs = JobManager(max_workers=1)
+
+# Created in the startup phase, shared by ingestion jobs and the agents.
+# Agents of concurrent users share the LLM client and the retriever through the session manager.
+session_manager = None
+index_generations = None
+answer_cache = None
+
+# Progress of the startup phase reported by /readiness
+startup_status = {"ready": False, "stage": None, "durations": {}, "error": None}
+
+
+def get_cache_stats():
+    """
+    Returns the statistics of the caches that are enabled, by cache name.
+    """
+    caches = {
+        "embedding": get_embedding_provider().cache,
+        "answer": answer_cache,
+        "retrieval": retrieval_cache,
+    }
+    return {name: cache.stats() for name, cache in caches.items() if cache is not None}
+
+# Read from the components when /metrics is scraped
+metrics.gauge(
+    "rag_cache_requests", "Lookups of the caches by result", ["cache", "result"],
+    callback=lambda: {
+        (name, result): stats[key]
+        for name, stats in get_cache_stats().items() for result, key in (("hit", "hits"), ("miss", "misses"))
+    }
+)
+metrics.gauge(
+    "rag_cache_hit_ratio", "Hit rate of the caches", ["cache"],
+    callback=lambda: {(name,): stats["hit_rate"] for name, stats in get_cache_stats().items()}
+)
+metrics.gauge(
+    "rag_llm_requests", "LLM API requests in flight and waiting for a slot", ["state"],
+    callback=lambda: {
+        (state,): get_llm_client_factory().stats()[state] for state in ("in_flight", "waiting")
+    }
+)
+metrics.gauge("rag_sessions", "Active chat sessions", callback=lambda: len(session_manager.sessions))
+metrics.gauge(
+    "rag_ingestion_jobs", "Ingestion jobs by status", ["status"],
+    callback=lambda: {
+        (status.value,): sum(job.status == status for job in ingestion_jobs.list_jobs()) for status in JobStatus
+    }
 )
 
+
+def run_startup():
+    """
+    Provision the NLTK data, load the embedding model and the stored vectorstore and create the agents.
+    Blocking, runs in a thread while the server already answers /healthcheck and /readiness.
+    """
+    global session_manager, index_generations, answer_cache
+
+    def stage(name, func):
+        startup_status["stage"] = name
+        start = time.perf_counter()
+        result = func()
+        startup_status["durations"][name] = round(time.perf_counter() - start, 3)
+        return result
+
+    stage("nltk_data", ensure_nltk_data)
+    stage("embedding_model", get_embedding_provider().warm_up)
+
+    if ANSWER_CACHE_ENABLED:
+        answer_cache = SemanticAnswerCache(
+            get_embedding_provider().embedding_function,
+            similarity_threshold=ANSWER_CACHE_THRESHOLD,
+            ttl=ANSWER_CACHE_TTL,
+            max_entries=ANSWER_CACHE_MAX_ENTRIES
+        )
+
+    session_manager = stage("agents", lambda: SessionManager(
+        max_sessions=int(os.getenv("MAX_SESSIONS", 100)),
+        idle_timeout=int(os.getenv("SESSION_IDLE_TIMEOUT", 1800))
+    ))
+    index_generations = stage("vectorstore", lambda: IndexGenerations("vectorstore_data"))
+    update_agent_vectorstore()
+
+async def startup():
+    """
+    Run the startup phase and mark the server as ready.
+    """
+    try:
+        await asyncio.to_thread(run_startup)
+    except Exception as e:
+        startup_status["error"] = f"{type(e).__name__}: {e}"
+        print(f"Startup failed in stage {startup_status['stage']}: {startup_status['error']}")
+        return
+
+    startup_status["ready"] = True
+    startup_status["stage"] = None
+    print(f"Startup finished: {startup_status['durations']}")
+
+def require_ready():
+    """
+    A dependency of the endpoints that need the models and the vectorstore.
+    """
+    if not startup_status["ready"]:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The service is starting up, check /readiness."
+        )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start the startup phase in the background, so the server accepts connections right away.
+    """
+    startup_task = asyncio.create_task(startup())
+
+    yield
+
+    startup_task.cancel()
+    ingestion_jobs.shutdown()
+    shutdown_process_pool()
+    retrieval_executor.shutdown(wait=False)
+    await close_llm_clients()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# A failed request has already finished its own generation,
+# other sessions must not be interrupted because of it
+handle_exceptions(app=app)
+
 class PDFRequest(BaseModel):
     files: list[str]  # List of base64-encoded file bytes
+    filenames: list[str] | None = None  # Optional names of the files, one per file
+
+class RemoveFilesRequest(BaseModel):
+    filenames: list[str]
 
 class AgentInput(BaseModel):
     input: str
+    session_id: str = DEFAULT_SESSION_ID
+    mode: Literal["agent", "rag"] | None = None  # Execution mode, defaults to AGENT_MODE
+    timings: bool = False  # Add the seconds per stage of the request to the response
+
+class BatchInput(BaseModel):
+    questions: list[str]
+    max_concurrency: int | None = None  # Defaults to and is capped by BATCH_MAX_CONCURRENCY
 
 
 @app.get("/healthcheck")
@@ -33,7 +201,43 @@ def healthcheck():
     """
     return {"description": "Agent API is up and running..."}
 
-@app.post("/get_chat_completion")
+@app.get("/readiness")
+def readiness():
+    """
+    A public endpoint that shows if the API is ready to serve requests.
+
+    Returns:
+        HTTP 200 once the startup phase has finished, HTTP 503 with its current stage
+        or its error before that. Durations of the finished stages are included in seconds.
+    """
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if startup_status["ready"] else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content=startup_status
+    )
+
+@app.get("/stats")
+def stats():
+    """
+    An endpoint that returns runtime statistics of the caches and the LLM client.
+    """
+    embedding_cache = get_embedding_provider().cache
+
+    return {
+        "embedding_cache": embedding_cache.stats() if embedding_cache is not None else None,
+        "answer_cache": answer_cache.stats() if answer_cache is not None else None,
+        "retrieval_cache": retrieval_cache.stats(),
+        "llm": get_llm_client_factory().stats()
+    }
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    A public endpoint that returns the metrics in the Prometheus text format: histograms of the stage durations,
+    LLM token counts, cache hit rates, queue depths and the resident memory of the process.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.post("/get_chat_completion", dependencies=[Depends(require_ready)])
 async def get_chat_completion(
     request: AgentInput
 ):
@@ -42,9 +246,15 @@ async def get_chat_completion(
 
     Query parameters:
         input: The input to the agent.
+        session_id: The id of the conversation, every session has its own history.
+        mode: "agent" to let the agent decide when to retrieve documents or
+            "rag" to retrieve directly and answer in a single LLM call.
+        timings: Whether to add the seconds per stage of the request to the response.
 
     Returns:
-        HTTP response containing the user input and agent output.
+        HTTP response containing the user input, agent output, its sources
+        and whether the answer was served from the cache. If documents were retrieved,
+        "context_tokens" has the tokens of the retrieved documents and the tokens packed into the prompt and saved.
     """
 
     # Raise an error if the input is empty
@@ -54,21 +264,384 @@ async def get_chat_completion(
             detail="Input cannot be empty",
         )
 
-    llm_response = await agent.generate_response(request.input)
+    try:
+        agent = session_manager.get_session(request.session_id)
+    except SessionLimitError as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+        )
 
-    response = {
-        "input": llm_response["input"],
-        "output": llm_response["output"]
-    }
+    # Answers that depend on the conversation history are not cached
+    is_first_turn = len(agent.memory.buffer_as_messages) == 0
+    cache_version = get_cache_version(agent, request.mode)
+
+    with collect_timings() as timings, collect_context_tokens() as context_tokens:
+        cached_answer = await lookup_cached_answer(request.input, cache_version) if is_first_turn else None
+        if cached_answer is not None:
+            agent.memory.save_context({"input": request.input}, {"output": cached_answer["answer"]})
+            response = {
+                "input": request.input,
+                "output": cached_answer["answer"],
+                "sources": cached_answer["sources"],
+                "cached": True
+            }
+        else:
+            llm_response = await agent.generate_response(request.input, mode=request.mode)
+            sources = Agent.get_sources(llm_response)
+
+            if is_first_turn:
+                await store_cached_answer(request.input, cache_version, llm_response["output"], sources)
+
+            response = {
+                "input": llm_response["input"],
+                "output": llm_response["output"],
+                "sources": sources,
+                "cached": False
+            }
+
+    if context_tokens:
+        response["context_tokens"] = context_tokens
+    if request.timings:
+        response["timings"] = format_timings(timings)
 
     return response
 
-@app.post("/ingest_data")
+@app.post("/stream_chat_completion", dependencies=[Depends(require_ready)])
+async def stream_chat_completion(
+    request: AgentInput
+):
+    """
+    An endpoint that streams a chat completion as Server-Sent Events.
+
+    Query parameters:
+        input: The input to the agent.
+        session_id: The id of the conversation, every session has its own history.
+        mode: "agent" or "rag", see /get_chat_completion.
+        timings: Whether to add the seconds per stage of the request to the "final" event.
+
+    Returns:
+        An event stream with "tool_start", "tool_end", "sources" and "token" events,
+        followed by a "final" event with the user input and agent output, and the "context_tokens"
+        of the retrieved documents as in /get_chat_completion.
+        The stream ends with an "interrupted" event if /interrupt is called for the session.
+    """
+
+    # Raise an error if the input is empty
+    if len(request.input) == 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Input cannot be empty",
+        )
+
+    try:
+        agent = session_manager.get_session(request.session_id)
+    except SessionLimitError as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+        )
+
+    async def event_stream():
+        # Answers that depend on the conversation history are not cached
+        is_first_turn = len(agent.memory.buffer_as_messages) == 0
+        cache_version = get_cache_version(agent, request.mode)
+
+        with collect_timings() as timings, collect_context_tokens() as context_tokens:
+            cached_answer = await lookup_cached_answer(request.input, cache_version) if is_first_turn else None
+            if cached_answer is not None:
+                agent.memory.save_context({"input": request.input}, {"output": cached_answer["answer"]})
+                events = cached_answer_events(request.input, cached_answer)
+            else:
+                events = agent.stream_response(request.input, mode=request.mode)
+
+            async for event in events:
+                if event["event"] == "final":
+                    if cached_answer is None and is_first_turn:
+                        await store_cached_answer(
+                            request.input, cache_version, event["data"]["output"], event["data"]["sources"]
+                        )
+                    if context_tokens:
+                        event["data"]["context_tokens"] = context_tokens
+                    if request.timings:
+                        event["data"]["timings"] = format_timings(timings)
+                yield f"event: {event['event']}\ndata: {json.dumps(event['data'], default=str)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/batch_chat_completion", dependencies=[Depends(require_ready)])
+async def batch_chat_completion(
+    request: BatchInput
+):
+    """
+    An endpoint that answers a batch of independent questions as Server-Sent Events.
+    The questions have no conversation history and are answered in the "rag" mode,
+    with batched retrieval and concurrent LLM calls.
+
+    Query parameters:
+        questions: The list of questions.
+        max_concurrency: The maximum number of concurrent LLM calls.
+
+    Returns:
+        An event stream with a "result" event per question in the order the answers finish,
+        with the "index" of the question, its "input", "output", "sources" and "context_tokens",
+        or an "error" event with the "index", "input" and "error" of a failed question.
+        The stream ends with a "done" event with the number of answered and failed questions.
+    """
+
+    if len(request.questions) == 0 or any(len(question) == 0 for question in request.questions):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Questions cannot be empty",
+        )
+
+    if len(request.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {BATCH_MAX_QUESTIONS} questions can be answered in one batch",
+        )
+
+    if session_manager.retriever is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No documents have been ingested",
+        )
+
+    max_concurrency = min(request.max_concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY)
+    answerer = BatchAnswerer(
+        session_manager.llm,
+        session_manager.retriever.document_retriever,
+        max_concurrency=max(1, max_concurrency),
+        context_packer=session_manager.retriever.context_packer
+    )
+
+    async def event_stream():
+        num_failed = 0
+        async for result in answerer.stream_answers(request.questions):
+            event = "error" if "error" in result else "result"
+            num_failed += event == "error"
+            yield f"event: {event}\ndata: {json.dumps(result, default=str)}\n\n"
+
+        done = {"answered": len(request.questions) - num_failed, "failed": num_failed}
+        yield f"event: done\ndata: {json.dumps(done)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def cached_answer_events(question, cached_answer):
+    """
+    Yield a cached answer as the final event of a stream.
+    """
+    yield {"event": "final", "data": {
+        "input": question,
+        "output": cached_answer["answer"],
+        "sources": cached_answer["sources"],
+        "cached": True
+    }}
+
+def format_timings(timings):
+    """
+    Returns the seconds per stage of a request rounded for a response, slowest first.
+    """
+    return {stage: round(seconds, 4) for stage, seconds in sorted(timings.items(), key=lambda item: -item[1])}
+
+def get_cache_version(agent, mode):
+    """
+    Returns the version cached answers are scoped by: the current corpus and the execution mode,
+    so the answers of the modes can be compared.
+    """
+    return f"{index_generations.corpus_version}:{mode or agent.mode}"
+
+async def lookup_cached_answer(question, cache_version):
+    """
+    Returns a cached answer to the question for the given version or None.
+    """
+    if answer_cache is None:
+        return None
+
+    with track_stage("answer_cache_lookup"):
+        return await run_in_retrieval_executor(answer_cache.lookup, question, cache_version)
+
+async def store_cached_answer(question, cache_version, answer, sources):
+    """
+    Cache an answer computed for the given version.
+    """
+    if answer_cache is None:
+        return
+
+    await run_in_retrieval_executor(answer_cache.store, question, cache_version, answer, sources)
+
+@app.post("/ingest_data", dependencies=[Depends(require_ready)])
 async def ingest_data(
     request: PDFRequest
 ):
     """
-    An endpoint that accepts .zip from user.
+    An endpoint that accepts files from user and schedules their ingestion.
+    The files replace the whole corpus: stored files that are not in the request are removed.
+    Unchanged files and chunks are not embedded again.
+
+    Returns:
+        HTTP response containing the id of the ingestion job.
+        Use /ingest_jobs/{job_id} to track its progress.
+    """
+    # Decoding and hashing large files would block the event loop
+    files = await asyncio.to_thread(decode_files, request)
+
+    job = ingestion_jobs.submit("ingest_data", run_ingestion, files, replace=True)
+
+    return {
+        "description": "The files were accepted for processing",
+        "job_id": job.job_id,
+        "status": job.status.value
+    }
+
+@app.post("/add_files", dependencies=[Depends(require_ready)])
+async def add_files(
+    request: PDFRequest
+):
+    """
+    An endpoint that adds files to the corpus or updates the stored files with the same names.
+
+    Returns:
+        HTTP response containing the id of the ingestion job.
+    """
+    files = await asyncio.to_thread(decode_files, request)
+
+    job = ingestion_jobs.submit("add_files", run_ingestion, files, replace=False)
+
+    return {
+        "description": "The files were accepted for processing",
+        "job_id": job.job_id,
+        "status": job.status.value
+    }
+
+@app.post("/remove_files", dependencies=[Depends(require_ready)])
+async def remove_files(
+    request: RemoveFilesRequest
+):
+    """
+    An endpoint that removes files from the corpus by their names.
+
+    Returns:
+        HTTP response containing the id of the ingestion job.
+    """
+    if not request.filenames:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No filenames provided in the request."
+        )
+
+    job = ingestion_jobs.submit("remove_files", run_file_removal, request.filenames)
+
+    return {
+        "description": "The files were scheduled for removal",
+        "job_id": job.job_id,
+        "status": job.status.value
+    }
+
+@app.post("/upload_files", dependencies=[Depends(require_ready)])
+async def upload_files(
+    request: Request,
+    replace: bool = False
+):
+    """
+    An endpoint that accepts files as a multipart/form-data upload and schedules their ingestion.
+    The files are streamed to temporary files as they arrive, so the memory use does not depend on their size.
+
+    Query parameters:
+        replace: Whether the files replace the whole corpus, as in /ingest_data,
+            or are added to it, as in /add_files.
+
+    Returns:
+        HTTP response containing the id of the ingestion job.
+    """
+    try:
+        uploads = await receive_uploads(
+            request,
+            upload_dir=UPLOAD_DIR,
+            max_file_bytes=UPLOAD_MAX_FILE_BYTES,
+            max_total_bytes=UPLOAD_MAX_TOTAL_BYTES
+        )
+    except UploadTooLargeError as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(e)
+        )
+    except UploadError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    job = ingestion_jobs.submit("upload_files", run_upload_ingestion, uploads, replace=replace)
+
+    return {
+        "description": "The files were accepted for processing",
+        "job_id": job.job_id,
+        "status": job.status.value
+    }
+
+@app.post("/rechunk", dependencies=[Depends(require_ready)])
+async def rechunk(
+    force: bool = False
+):
+    """
+    An endpoint that chunks the stored files again with the configured chunking parameters
+    from their cached elements, without parsing them. Only the chunks that changed are embedded.
+
+    Query parameters:
+        force: Whether to chunk all stored files, not only the ones chunked with other parameters.
+
+    Returns:
+        HTTP response containing the id of the ingestion job.
+        Files whose elements are not cached are reported as failed and have to be ingested again.
+    """
+    job = ingestion_jobs.submit("rechunk", run_rechunk, force=force)
+
+    return {
+        "description": "The stored files were scheduled for chunking",
+        "job_id": job.job_id,
+        "status": job.status.value
+    }
+
+@app.get("/ingest_jobs")
+def list_ingestion_jobs():
+    """
+    An endpoint that returns the state of all known ingestion jobs.
+    """
+    return {"jobs": [job.to_dict() for job in ingestion_jobs.list_jobs()]}
+
+@app.get("/ingest_jobs/{job_id}")
+def get_ingestion_job(job_id: str):
+    """
+    An endpoint that returns the progress and the result of an ingestion job.
+    """
+    job = ingestion_jobs.get_job(job_id)
+
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Job {job_id} not found."
+        )
+
+    return job.to_dict()
+
+def decode_files(request: PDFRequest):
+    """
+    Validate and decode base64-encoded files of the request.
+
+    Args:
+        request: The request containing the files.
+
+    Returns:
+        A list of (filename, file hash, file bytes) tuples.
     """
     # Validate input is not empty
     if not request.files:
@@ -77,23 +650,39 @@ async def ingest_data(
             detail="No files provided in the request."
         )
 
-    pdf_files = []
+    if request.filenames is not None:
+        if len(request.filenames) != len(request.files):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="The number of filenames must match the number of files."
+            )
+        if len(set(request.filenames)) != len(request.filenames):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Filenames must be unique."
+            )
+
+    files = []
 
     for i, file_data in enumerate(request.files):
         try:
             # Validate Base64
             try:
-                pdf_bytes = base64.b64decode(file_data)
+                file_bytes = base64.b64decode(file_data)
             except base64.binascii.Error:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST, 
                     detail=f"File {i} is not a valid Base64 string."
                 )
 
-            # Check if PDF content can be processed
-            pdf_stream = BytesIO(pdf_bytes)
+            # Unnamed files are named by their content, so the same file keeps its name
+            file_hash = compute_file_hash(file_bytes)
+            if request.filenames is not None:
+                filename = request.filenames[i]
+            else:
+                filename = f"{file_hash[:12]}.pdf"
 
-            pdf_files.append(pdf_stream)
+            files.append((filename, file_hash, file_bytes))
 
         except HTTPException as e:
             raise e
@@ -102,39 +691,193 @@ async def ingest_data(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
                 detail=f"An unexpected error occurred while processing file {i}: {str(e)}"
             )
-    
-    all_documents = []
-    for file in pdf_files:
-        documents = load_single_document(file)
-        all_documents += documents
 
-    chroma_client = VectorStore("vectorstore_data")
-    chroma_client.clear_vectorstore()
-    vectorstore = chroma_client.create_vectorstore(all_documents)
+    return files
+
+def run_ingestion(job, files, replace, force=False):
+    """
+    Parse and embed new and changed files into a new generation of the vectorstore, then publish it.
+    Queries are served by the current generation until then.
+    Runs in the ingestion worker pool, outside of the event loop.
+
+    Args:
+        job: The Job object used to report progress.
+        files: A list of (filename, file hash, file bytes or path) tuples.
+        replace: Whether to remove the stored files that are not in the list.
+        force: Whether to chunk and store the files even if they are current.
+
+    Returns:
+        A summary of the ingested data.
+    """
+    job.update_progress("preparing")
+    vectorstore = index_generations.prepare()
+
+    try:
+        summary = update_corpus(job, vectorstore, files, replace, force)
+    except BaseException:
+        index_generations.discard(vectorstore)
+        raise
+
+    if summary["num_changed_files"] == 0 and summary["deleted_chunks"] == 0:
+        index_generations.discard(vectorstore)
+    else:
+        index_generations.publish(vectorstore)
+        update_agent_vectorstore()
+
+    return summary
+
+def update_corpus(job, vectorstore, files, replace, force=False):
+    """
+    Apply the files to a prepared generation of the vectorstore.
+
+    Returns:
+        A summary of the ingested data.
+    """
+    removed_chunks = 0
+    if replace:
+        filenames = {filename for filename, _, _ in files}
+        removed_chunks = vectorstore.remove_files(
+            [filename for filename in vectorstore.list_files() if filename not in filenames]
+        )
+
+    # Only new, changed and differently chunked files are processed, a file given twice is ingested once
+    # in its last version. Files parsed before are chunked from their cached elements.
+    chunking = DEFAULT_CHUNKING._asdict()
+    changed_files = {}
+    for filename, file_hash, file in files:
+        if force or not vectorstore.is_file_current(filename, file_hash, chunking):
+            changed_files[filename] = (filename, file_hash, file)
+    changed_files = list(changed_files.values())
+
+    # Parsing, embedding and writing overlap, uploaded files are passed to the parsers by their paths
+    job.update_progress("ingesting", done=0, total=len(changed_files))
+    pipeline = IngestionPipeline(vectorstore, workers=INGESTION_WORKERS)
+    stats, failed_files = pipeline.run(
+        [
+            (filename, file_hash, BytesIO(file) if isinstance(file, bytes) else file)
+            for filename, file_hash, file in changed_files
+        ],
+        on_progress=lambda done: job.update_progress("ingesting", done=done)
+    )
+
+    vectorstore.save()
+
+    if changed_files and len(failed_files) == len(changed_files):
+        raise RuntimeError(f"None of the files could be processed: {failed_files}")
+
+    return {
+        "num_files": len(files),
+        "num_changed_files": len(changed_files),
+        "added_chunks": stats["added"],
+        "deleted_chunks": stats["deleted"] + removed_chunks,
+        "unchanged_chunks": stats["unchanged"],
+        "failed_files": failed_files
+    }
+
+def run_rechunk(job, force):
+    """
+    Chunk the stored files again from their cached elements.
+
+    Args:
+        job: The Job object used to report progress.
+        force: Whether to chunk all stored files, not only the ones chunked with other parameters.
+
+    Returns:
+        A summary of the ingested data.
+    """
+    files = [(filename, file_hash, None) for filename, file_hash in index_generations.list_file_hashes().items()]
+
+    return run_ingestion(job, files, replace=False, force=force)
+
+def run_upload_ingestion(job, uploads, replace):
+    """
+    Ingest spooled uploads and delete their temporary files afterwards.
 
-    agent.update_vectorstore(vectorstore)
+    Args:
+        job: The Job object used to report progress.
+        uploads: A list of UploadedFile objects.
+        replace: Whether to remove the stored files that are not in the upload.
+    """
+    try:
+        return run_ingestion(
+            job,
+            [(uploaded.filename, uploaded.file_hash, uploaded.path) for uploaded in uploads],
+            replace=replace
+        )
+    finally:
+        remove_uploads(uploads)
+
+def run_file_removal(job, filenames):
+    """
+    Remove the files in a new generation of the vectorstore, then publish it.
+
+    Args:
+        job: The Job object used to report progress.
+        filenames: A list of names of the files.
+
+    Returns:
+        A summary of the removed data.
+    """
+    job.update_progress("removing", done=0, total=len(filenames))
+    missing_files = [filename for filename in filenames if filename not in index_generations.list_files()]
+    if len(missing_files) == len(filenames):
+        job.update_progress("removing", done=len(filenames))
+        return {"deleted_chunks": 0, "missing_files": missing_files}
+
+    vectorstore = index_generations.prepare()
+    try:
+        deleted_chunks = vectorstore.remove_files(filenames)
+        vectorstore.save()
+    except BaseException:
+        index_generations.discard(vectorstore)
+        raise
+
+    index_generations.publish(vectorstore)
+    job.update_progress("removing", done=len(filenames))
+
+    update_agent_vectorstore()
+
+    return {"deleted_chunks": deleted_chunks, "missing_files": missing_files}
+
+def update_agent_vectorstore():
+    """
+    Attach the vectorstore generations to the agents, or detach them if the corpus is empty.
+    Cached answers and retrieval results of the previous corpus are dropped.
+    """
+    if answer_cache is not None:
+        answer_cache.invalidate()
+    retrieval_cache.clear()
 
-    return {"description": "The PDFs were processed successfully"}
+    # The retriever reads the current generation on every query,
+    # so the agents are only rebuilt when the documents are attached or detached
+    has_documents = index_generations.count() > 0
+    if has_documents != (session_manager.retriever is not None):
+        session_manager.update_vectorstore(index_generations if has_documents else None)
 
 
 # Not necessary but useful
-@app.post("/interrupt")
-def interrupt_completion():
+# Async, as the agent's task must be cancelled from the event loop thread
+@app.post("/interrupt", dependencies=[Depends(require_ready)])
+async def interrupt_completion(session_id: str = DEFAULT_SESSION_ID):
     """
-    An endpoint that interrupts the agent's generation.
+    An endpoint that interrupts the agent's generation in the session.
     """
-    agent.interrupt_generation()
+    agent = session_manager.find_session(session_id)
+    if agent is not None:
+        agent.interrupt_generation()
     response = {"description": "Request interrupted"}
 
     return response
 
 # Not necessary but useful
-@app.post("/clean_history")
-def clean_history():
+@app.post("/clean_history", dependencies=[Depends(require_ready)])
+async def clean_history(session_id: str = DEFAULT_SESSION_ID):
     """
-    An endpoint that cleans the chat history of the agent.
+    An endpoint that cleans the chat history of the session.
     """
-    agent.clean_memory()
+    agent = session_manager.find_session(session_id)
+    if agent is not None:
+        agent.clean_memory()
     response = {"description": "History cleaned"}
 
     return response
\ No newline at end of file
@@ -0,0 +1,183 @@
+import hashlib
+import os
+import tempfile
+from typing import NamedTuple
+
+from fastapi import Request
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadTooLargeError(UploadError):
+    pass
+
+
+class UploadedFile(NamedTuple):
+    filename: str
+    path: str
+    size: int
+    file_hash: str
+
+
+class _MultipartSpooler:
+    """
+    Callbacks of the multipart parser that write every file part to its own temporary file.
+    """
+
+    def __init__(self, upload_dir, max_file_bytes, max_total_bytes):
+        self.upload_dir = upload_dir
+        self.max_file_bytes = max_file_bytes
+        self.max_total_bytes = max_total_bytes
+
+        self.files = []
+        self.total_size = 0
+
+        self._header_field = b""
+        self._header_value = b""
+        self._headers = {}
+        self._file = None
+        self._filename = None
+        self._size = 0
+        self._hash = None
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        }
+
+    def on_part_begin(self):
+        self._headers = {}
+
+    def on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+
+        # Parts without a filename are form fields, they are ignored
+        if b"filename" not in options:
+            self._file = None
+            return
+
+        self._filename = os.path.basename(options[b"filename"].decode("utf-8", errors="replace"))
+        if not self._filename:
+            raise UploadError("An uploaded file has no name.")
+        if any(uploaded.filename == self._filename for uploaded in self.files):
+            raise UploadError("Filenames must be unique.")
+
+        # The extension is kept as it is used to detect the type of the file
+        self._file = tempfile.NamedTemporaryFile(
+            dir=self.upload_dir, suffix=os.path.splitext(self._filename)[1], delete=False
+        )
+        self._size = 0
+        self._hash = hashlib.sha256()
+
+    def on_part_data(self, data, start, end):
+        if self._file is None:
+            return
+
+        size = end - start
+        self._size += size
+        self.total_size += size
+
+        if self._size > self.max_file_bytes:
+            raise UploadTooLargeError(f"File {self._filename} exceeds the limit of {self.max_file_bytes} bytes.")
+        if self.total_size > self.max_total_bytes:
+            raise UploadTooLargeError(f"The upload exceeds the limit of {self.max_total_bytes} bytes.")
+
+        chunk = data[start:end]
+        self._file.write(chunk)
+        self._hash.update(chunk)
+
+    def on_part_end(self):
+        if self._file is None:
+            return
+
+        self._file.close()
+        self.files.append(UploadedFile(self._filename, self._file.name, self._size, self._hash.hexdigest()))
+        self._file = None
+
+    def cleanup(self):
+        if self._file is not None:
+            self._file.close()
+            self.files.append(UploadedFile(self._filename, self._file.name, self._size, ""))
+            self._file = None
+
+        remove_uploads(self.files)
+
+
+async def receive_uploads(request: Request, upload_dir=None, max_file_bytes=100 * 1024 ** 2, max_total_bytes=1024 ** 3):
+    """
+    Stream the files of a multipart/form-data request to temporary files as the body arrives.
+    Only one chunk of the body is held in memory at a time.
+
+    Args:
+        request: The request with a multipart/form-data body.
+        upload_dir: The directory of the temporary files. Defaults to the system temporary directory.
+        max_file_bytes: The maximum size of a file.
+        max_total_bytes: The maximum total size of the files.
+
+    Returns:
+        A list of UploadedFile objects. The caller must remove the files with remove_uploads().
+
+    Raises:
+        UploadError: If the body is not a valid upload.
+        UploadTooLargeError: If a size limit is exceeded. The upload is aborted without reading the rest of the body.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise UploadError("The request must be multipart/form-data.")
+
+    # Fail before reading the body if its declared size is already too large
+    content_length = request.headers.get("content-length")
+    if content_length is not None and content_length.isdigit() and int(content_length) > max_total_bytes + 64 * 1024:
+        raise UploadTooLargeError(f"The upload exceeds the limit of {max_total_bytes} bytes.")
+
+    if upload_dir is not None:
+        os.makedirs(upload_dir, exist_ok=True)
+
+    spooler = _MultipartSpooler(upload_dir, max_file_bytes, max_total_bytes)
+    parser = MultipartParser(options[b"boundary"], spooler.callbacks())
+
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+        parser.finalize()
+    except BaseException as e:
+        spooler.cleanup()
+        if isinstance(e, UploadError) or not isinstance(e, Exception):
+            raise
+        raise UploadError(f"The multipart body could not be parsed: {e}") from e
+
+    if len(spooler.files) == 0:
+        raise UploadError("No files provided in the request.")
+
+    return spooler.files
+
+
+def remove_uploads(files):
+    """
+    Delete the temporary files of an upload.
+    """
+    for uploaded in files:
+        try:
+            os.remove(uploaded.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,101 @@
+"""
+Measure the import time of the server module in a fresh interpreter and check it against a budget.
+Heavy modules that must only be loaded on first use are reported as violations.
+
+Usage:
+    python -m benchmarks.import_time --budget-seconds 3 --output import_time.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+# Loaded lazily by the parser and the embedding model, never by importing the server
+LAZY_MODULES = ["torch", "unstructured", "langchain_unstructured", "sentence_transformers", "chromadb", "nltk"]
+
+
+def measure_import(module):
+    """
+    Import the module in a new interpreter with -X importtime.
+
+    Returns:
+        A tuple of the wall time in seconds, a list of (module, cumulative seconds) tuples
+        of the top-level imports and the lazy modules that were loaded.
+    """
+    code = (
+        f"import json, sys; import {module}; "
+        f"print(json.dumps([name for name in {LAZY_MODULES!r} if name in sys.modules]))"
+    )
+
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    wall_seconds = time.perf_counter() - start
+
+    if process.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{process.stderr[-2000:]}")
+
+    # Lines look like "import time:       self [us] |  cumulative | imported package"
+    imports = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nested imports are indented, only the top-level ones add up to the total
+        if not name.startswith("  "):
+            imports.append((name.strip(), int(cumulative) / 1e6))
+
+    loaded_lazy_modules = json.loads(process.stdout.strip().splitlines()[-1])
+
+    return wall_seconds, imports, loaded_lazy_modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="api.server")
+    parser.add_argument("--budget-seconds", type=float, default=float(os.getenv("IMPORT_TIME_BUDGET", 3.0)))
+    parser.add_argument("--top", type=int, default=15, help="The number of slowest imports to report")
+    parser.add_argument("--output", help="A path to write the results as JSON")
+    args = parser.parse_args()
+
+    wall_seconds, imports, loaded_lazy_modules = measure_import(args.module)
+    import_seconds = sum(seconds for _, seconds in imports)
+    slowest = sorted(imports, key=lambda item: -item[1])[:args.top]
+
+    results = {
+        "module": args.module,
+        "wall_seconds": wall_seconds,
+        "import_seconds": import_seconds,
+        "budget_seconds": args.budget_seconds,
+        "slowest_imports": [{"module": name, "seconds": seconds} for name, seconds in slowest],
+        "loaded_lazy_modules": loaded_lazy_modules,
+    }
+
+    print(f"Importing {args.module} took {import_seconds:.2f}s ({wall_seconds:.2f}s with interpreter startup)")
+    for name, seconds in slowest:
+        print(f"  {seconds:8.3f}s  {name}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    failed = False
+    if import_seconds > args.budget_seconds:
+        print(f"Import time exceeds the budget of {args.budget_seconds:.2f}s")
+        failed = True
+    if loaded_lazy_modules:
+        print(f"Modules that must be imported lazily were loaded: {', '.join(loaded_lazy_modules)}")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
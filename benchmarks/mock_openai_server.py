@@ -0,0 +1,119 @@
+"""
+A local OpenAI-compatible chat completions server with configurable latency and rate limiting,
+for load tests of the API without calling OpenAI.
+
+Usage:
+    python -m benchmarks.mock_openai_server --port 8001 --latency 0.5 --rate-limit-every 10
+    LLM_BASE_URL=http://localhost:8001/v1 OPENAI_API_KEY=mock uvicorn api.server:app
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+def create_app(latency=0.2, token_delay=0.01, rate_limit_every=0):
+    """
+    Create the mock server.
+
+    Args:
+        latency: The number of seconds before the first token.
+        token_delay: The number of seconds between streamed tokens.
+        rate_limit_every: Answer every n-th request with 429, 0 disables rate limiting.
+    """
+    app = FastAPI()
+    state = {"requests": 0, "rate_limited": 0, "in_flight": 0, "max_in_flight": 0}
+
+    def answer_for(messages):
+        question = messages[-1]["content"] if messages else ""
+        # The format of the conversational agent, so it answers without calling the tool
+        return f"Do I need to use a tool? No\nAI: Mock answer to: {question[-80:]}"
+
+    @app.get("/stats")
+    def stats():
+        return state
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        state["requests"] += 1
+
+        if rate_limit_every and state["requests"] % rate_limit_every == 0:
+            state["rate_limited"] += 1
+            return JSONResponse(
+                status_code=429,
+                headers={"Retry-After": "0.1"},
+                content={"error": {"message": "Rate limit reached", "type": "rate_limit_error"}}
+            )
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        answer = answer_for(body.get("messages", []))
+
+        state["in_flight"] += 1
+        state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+
+        if not body.get("stream"):
+            try:
+                await asyncio.sleep(latency)
+            finally:
+                state["in_flight"] -= 1
+
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": body.get("model", "mock"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": answer},
+                    "finish_reason": "stop"
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(answer.split()), "total_tokens": 0}
+            }
+
+        async def events():
+            try:
+                await asyncio.sleep(latency)
+                for token in answer.split(" "):
+                    chunk = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": body.get("model", "mock"),
+                        "choices": [{"index": 0, "delta": {"content": token + " "}, "finish_reason": None}]
+                    }
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    await asyncio.sleep(token_delay)
+
+                chunk["choices"] = [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+                yield f"data: {json.dumps(chunk)}\n\n"
+                yield "data: [DONE]\n\n"
+            finally:
+                state["in_flight"] -= 1
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    parser.add_argument("--rate-limit-every", type=int, default=0)
+    args = parser.parse_args()
+
+    app = create_app(latency=args.latency, token_delay=args.token_delay, rate_limit_every=args.rate_limit_every)
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
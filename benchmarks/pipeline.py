@@ -0,0 +1,435 @@
+"""
+Offline benchmark of the ingestion and retrieval hot paths on synthetic data:
+
+- parse: load_single_document throughput on synthetic PDF and DOCX files, in pages per second,
+  and the throughput of chunking them again from the element cache
+- ingest: VectorStore.create_vectorstore rate, split into embedding and writing
+- retriever: the time and memory of opening the vectorstore and create_document_retriever
+- query: p50/p95/p99 latency of the hybrid retriever and the throughput of batched retrieval
+- answer: the throughput of batched single-shot answers with a deterministic fake LLM
+  and the tokens of their retrieved documents before and after context packing
+
+The index stages run at every corpus size. Embeddings come from a hashing function by default,
+so the suite runs on a CPU-only machine without network access. Use --embeddings model to measure
+the sentence-transformers model, which must be provisioned with python -m data_pipeline.provision.
+
+Results are written as JSON and compared with a previous run with --baseline, exiting with 1
+if a metric got worse by more than the tolerance.
+
+Usage:
+    python -m benchmarks.pipeline --sizes 1000 10000 100000 --output results.json
+    python -m benchmarks.pipeline --sizes 1000 10000 --baseline results.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import gc
+import importlib.metadata
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+# No model downloads and no usage statistics of unstructured
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+os.environ.setdefault("DO_NOT_TRACK", "true")
+os.environ.setdefault("SCARF_NO_ANALYTICS", "true")
+
+from benchmarks.synthetic import FakeLLM, HashingEmbeddings, TextGenerator, generate_chunks, generate_files
+from data_pipeline.document_retriever import create_document_retriever
+from data_pipeline.documents_preparation import (
+    NLTK_DATA_DIR, NLTK_PACKAGES, chunk_elements, load_single_document, parse_elements
+)
+from data_pipeline.element_cache import ElementCache
+from data_pipeline.embeddings import EMBEDDING_BATCH_SIZE, EMBEDDING_MODEL_NAME, EmbeddingProvider
+from data_pipeline.vectorstore import VectorStore
+
+
+# Packages whose upgrades the suite is meant to catch
+TRACKED_PACKAGES = [
+    "unstructured", "langchain-unstructured", "chromadb", "sentence-transformers", "torch",
+    "langchain-core", "langchain-community", "numpy",
+]
+
+# Metrics compared with the baseline, by the suffix of their names
+HIGHER_IS_BETTER_SUFFIXES = ("_per_second",)
+LOWER_IS_BETTER_SUFFIXES = ("_seconds", "_ms", "_mb")
+
+
+class TimedEmbeddings:
+    """
+    Wraps an embedding function and adds up the seconds spent embedding documents.
+    """
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.seconds = 0.0
+
+    def embed_documents(self, texts):
+        start = time.perf_counter()
+        try:
+            return self.embeddings.embed_documents(texts)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+
+def get_rss_mb():
+    """
+    Returns the resident set size of the process in MB.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except OSError:
+        # Not Linux, the peak is the closest available figure
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentiles_ms(latencies):
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "latency_p50_ms": float(np.percentile(latencies_ms, 50)),
+        "latency_p95_ms": float(np.percentile(latencies_ms, 95)),
+        "latency_p99_ms": float(np.percentile(latencies_ms, 99)),
+    }
+
+
+def check_nltk_data():
+    """
+    Make the provisioned NLTK data visible, without downloading anything.
+
+    Returns:
+        The names of the missing packages.
+    """
+    import nltk
+
+    data_dir = os.path.abspath(NLTK_DATA_DIR)
+    if data_dir not in nltk.data.path:
+        nltk.data.path.insert(0, data_dir)
+
+    missing = []
+    for package, resource_name in NLTK_PACKAGES.items():
+        try:
+            nltk.data.find(resource_name)
+        except LookupError:
+            missing.append(package)
+
+    return missing
+
+
+def benchmark_parse(tmp_dir, num_files, num_pages, formats):
+    """
+    Parse synthetic files one by one in this process, then chunk them again from a temporary element cache.
+
+    Returns:
+        The metrics per file format. The first file of a format is parsed as a warm-up.
+    """
+    missing = check_nltk_data()
+    if missing:
+        raise SystemExit(f"NLTK data is missing ({', '.join(missing)}), run python -m data_pipeline.provision")
+
+    files_dir = os.path.join(tmp_dir, "files")
+    os.makedirs(files_dir, exist_ok=True)
+    files = generate_files(files_dir, num_files + 1, num_pages, formats=formats)
+    element_cache = ElementCache(os.path.join(tmp_dir, "element_cache"))
+
+    results = {}
+    for file_format in formats:
+        format_files = [(path, pages) for path, fmt, pages in files if fmt == file_format]
+
+        start = time.perf_counter()
+        load_single_document(format_files[0][0], filename=os.path.basename(format_files[0][0]))
+        first_file_seconds = time.perf_counter() - start
+
+        num_chunks = 0
+        start = time.perf_counter()
+        for path, _ in format_files[1:]:
+            num_chunks += len(load_single_document(path, filename=os.path.basename(path)))
+        seconds = time.perf_counter() - start
+
+        for path, _ in format_files[1:]:
+            element_cache.put(path, parse_elements(path, filename=os.path.basename(path)))
+
+        start = time.perf_counter()
+        for path, _ in format_files[1:]:
+            chunk_elements(element_cache.get(path), filename=os.path.basename(path))
+        rechunk_seconds = time.perf_counter() - start
+
+        num_pages_total = sum(pages for _, pages in format_files[1:])
+        results[file_format] = {
+            "files": len(format_files) - 1,
+            "pages": num_pages_total,
+            "chunks": num_chunks,
+            "first_file_seconds": first_file_seconds,
+            "parse_seconds": seconds,
+            "pages_per_second": num_pages_total / seconds,
+            "chunks_per_second": num_chunks / seconds,
+            "rechunk_seconds": rechunk_seconds,
+            "rechunk_pages_per_second": num_pages_total / rechunk_seconds,
+        }
+        print(f"parse {file_format}: {results[file_format]}")
+
+    return results
+
+
+def benchmark_ingest(vectorstore_dir, documents, embeddings, backend):
+    """
+    Embed and store the documents in a new vectorstore.
+    """
+    timed_embeddings = TimedEmbeddings(embeddings)
+    vectorstore = VectorStore(vectorstore_dir, embedding_function=timed_embeddings, backend=backend)
+
+    start = time.perf_counter()
+    vectorstore.create_vectorstore(documents)
+    seconds = time.perf_counter() - start
+
+    return {
+        "ingest_seconds": seconds,
+        "embed_seconds": timed_embeddings.seconds,
+        "write_seconds": seconds - timed_embeddings.seconds,
+        "chunks_per_second": len(documents) / seconds,
+    }
+
+
+def benchmark_retriever_build(vectorstore_dir, embeddings, backend, k):
+    """
+    Open the stored vectorstore and create the retriever, once timed and once with memory tracing.
+    """
+    gc.collect()
+    rss_before = get_rss_mb()
+
+    start = time.perf_counter()
+    vectorstore = VectorStore(vectorstore_dir, embedding_function=embeddings, backend=backend)
+    open_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    create_document_retriever(vectorstore, num_documents=k)
+    create_seconds = time.perf_counter() - start
+
+    rss_delta = get_rss_mb() - rss_before
+    del vectorstore
+    gc.collect()
+
+    tracemalloc.start()
+    vectorstore = VectorStore(vectorstore_dir, embedding_function=embeddings, backend=backend)
+    retriever = create_document_retriever(vectorstore, num_documents=k)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    metrics = {
+        "open_seconds": open_seconds,
+        "create_retriever_seconds": create_seconds,
+        "python_peak_mb": peak / 1024 ** 2,
+        "rss_delta_mb": rss_delta,
+    }
+
+    return retriever, metrics
+
+
+def benchmark_queries(retriever, queries, warm_up=5):
+    """
+    Measure the latency of single queries and the throughput of one batch of all queries.
+    Cached rankings are disabled, so every query is searched.
+    """
+    retriever.cache = None
+
+    for query in queries[:warm_up]:
+        retriever.invoke(query)
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        retriever.invoke(query)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    retriever.batch_get_relevant_documents(queries)
+    batch_seconds = time.perf_counter() - start
+
+    return {
+        **percentiles_ms(latencies),
+        "queries_per_second": len(queries) / sum(latencies),
+        "batch_queries_per_second": len(queries) / batch_seconds,
+    }
+
+
+def benchmark_answers(retriever, queries, llm_latency, max_concurrency):
+    """
+    Answer the queries with the batch answerer and the fake LLM, packing the retrieved documents
+    with the estimated token counts.
+    """
+    from agent.batch import BatchAnswerer
+    from agent.context_packing import ContextPacker
+
+    answerer = BatchAnswerer(
+        FakeLLM(latency=llm_latency), retriever, max_concurrency=max_concurrency, context_packer=ContextPacker()
+    )
+
+    async def run():
+        return [result async for result in answerer.stream_answers(queries)]
+
+    start = time.perf_counter()
+    results = asyncio.run(run())
+    seconds = time.perf_counter() - start
+
+    answered = [result for result in results if "context_tokens" in result]
+    return {
+        "answer_seconds": seconds,
+        "questions_per_second": len(queries) / seconds,
+        "failed": sum("error" in result for result in results),
+        "retrieved_context_tokens": sum(result["context_tokens"]["retrieved"] for result in answered),
+        "packed_context_tokens": sum(result["context_tokens"]["packed"] for result in answered),
+    }
+
+
+def flatten_metrics(results, prefix=""):
+    """
+    Returns a dict of the numeric leaves of nested results keyed by their "/" separated paths.
+    """
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}/{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten_metrics(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare_results(metrics, baseline_metrics, tolerance):
+    """
+    Find the metrics that got worse than the baseline by more than the tolerance.
+
+    Returns:
+        A list of dicts with the metric, its baseline and current values and the relative change.
+    """
+    current = flatten_metrics(metrics)
+    baseline = flatten_metrics(baseline_metrics)
+
+    regressions = []
+    for path, value in current.items():
+        base = baseline.get(path)
+        if not base:
+            continue
+
+        change = (value - base) / base
+        if path.endswith(HIGHER_IS_BETTER_SUFFIXES):
+            regressed = change < -tolerance
+        elif path.endswith(LOWER_IS_BETTER_SUFFIXES):
+            regressed = change > tolerance
+        else:
+            continue
+
+        if regressed:
+            regressions.append({"metric": path, "baseline": base, "current": value, "change": change})
+
+    return regressions
+
+
+def get_environment():
+    versions = {}
+    for package in TRACKED_PACKAGES:
+        try:
+            versions[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            versions[package] = None
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "packages": versions,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="The numbers of chunks of the index stages")
+    parser.add_argument("--backend", choices=["chroma", "mmap"], default="chroma")
+    parser.add_argument("--embeddings", choices=["hash", "model"], default="hash")
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--num-files", type=int, default=5, help="The number of parsed files per format")
+    parser.add_argument("--pages-per-file", type=int, default=10)
+    parser.add_argument("--formats", nargs="+", choices=["pdf", "docx"], default=["pdf", "docx"])
+    parser.add_argument("--skip-parse", action="store_true")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds per answer of the fake LLM")
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--output", help="A path to write the results as JSON")
+    parser.add_argument("--baseline", help="A results file of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="The allowed relative slowdown")
+    args = parser.parse_args()
+
+    if args.embeddings == "model":
+        embeddings = EmbeddingProvider(
+            model_name=EMBEDDING_MODEL_NAME, device="cpu", batch_size=EMBEDDING_BATCH_SIZE
+        ).embedding_function
+    else:
+        embeddings = HashingEmbeddings()
+
+    results = {
+        "environment": get_environment(),
+        "config": {
+            key: value for key, value in vars(args).items() if key not in ("output", "baseline", "tolerance")
+        },
+        "metrics": {},
+    }
+
+    # One generator for all queries, a new seeded generator per query would repeat the same question
+    query_generator = TextGenerator(seed=1)
+    queries = [query_generator.question() for _ in range(args.num_queries)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if not args.skip_parse:
+            results["metrics"]["parse"] = benchmark_parse(tmp_dir, args.num_files, args.pages_per_file, args.formats)
+
+        for size in args.sizes:
+            vectorstore_dir = os.path.join(tmp_dir, f"vectorstore_{size}")
+            documents = generate_chunks(size)
+
+            size_metrics = {"ingest": benchmark_ingest(vectorstore_dir, documents, embeddings, args.backend)}
+            del documents
+
+            retriever, size_metrics["retriever"] = benchmark_retriever_build(
+                vectorstore_dir, embeddings, args.backend, args.k
+            )
+            size_metrics["query"] = benchmark_queries(retriever, queries)
+            size_metrics["answer"] = benchmark_answers(retriever, queries, args.llm_latency, args.max_concurrency)
+
+            results["metrics"][f"chunks_{size}"] = size_metrics
+            print(f"{size} chunks: {json.dumps(size_metrics, indent=2)}")
+
+            del retriever
+            gc.collect()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+        regressions = compare_results(results["metrics"], baseline["metrics"], args.tolerance)
+        for regression in regressions:
+            print(
+                f"Regression of {regression['metric']}: {regression['baseline']:.4g} -> "
+                f"{regression['current']:.4g} ({regression['change']:+.1%})"
+            )
+        if regressions:
+            sys.exit(1)
+        print(f"No metric got worse than the baseline by more than {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Deterministic synthetic inputs for the offline benchmarks: texts, PDF and DOCX files,
+a hashing embedding function and a fake chat model, so nothing is downloaded or called over the network.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import textwrap
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage
+
+
+class TextGenerator:
+    """
+    Generates reproducible pseudo-English text over a fixed vocabulary with a Zipf-like word distribution,
+    so BM25 and the embeddings see realistic term frequencies.
+
+    Args:
+        vocabulary_size: The number of distinct words.
+        seed: The seed of the random generator.
+    """
+
+    SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "te", "vi", "do", "pa", "qu", "ze", "bo", "fi", "gra", "str"]
+
+    def __init__(self, vocabulary_size=5000, seed=0):
+        self.rng = np.random.default_rng(seed)
+
+        words = set()
+        while len(words) < vocabulary_size:
+            length = int(self.rng.integers(1, 5))
+            words.add("".join(self.rng.choice(self.SYLLABLES, size=length)))
+        self.vocabulary = sorted(words)
+
+        weights = 1 / np.arange(1, vocabulary_size + 1)
+        self.probabilities = weights / weights.sum()
+
+    def words(self, n):
+        return [self.vocabulary[i] for i in self.rng.choice(len(self.vocabulary), size=n, p=self.probabilities)]
+
+    def sentence(self, min_words=6, max_words=18):
+        words = self.words(int(self.rng.integers(min_words, max_words + 1)))
+        return " ".join(words).capitalize() + "."
+
+    def paragraph(self, num_sentences=5):
+        return " ".join(self.sentence() for _ in range(num_sentences))
+
+    def title(self):
+        return " ".join(self.words(int(self.rng.integers(2, 6)))).title()
+
+    def question(self):
+        return " ".join(self.words(int(self.rng.integers(4, 10)))).capitalize() + "?"
+
+
+def generate_chunks(num_chunks, chunks_per_file=50, words_per_chunk=150, seed=0):
+    """
+    Returns Document objects shaped like parsed chunks, grouped into files of chunks_per_file chunks.
+    """
+    generator = TextGenerator(seed=seed)
+
+    documents = []
+    for i in range(num_chunks):
+        filename = f"file_{i // chunks_per_file:05d}.pdf"
+        documents.append(Document(
+            page_content=" ".join(generator.words(words_per_chunk)),
+            metadata={"filename": filename, "source": filename, "page_number": i % chunks_per_file // 5 + 1}
+        ))
+
+    return documents
+
+
+def _escape_pdf_text(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path, pages, line_width=90):
+    """
+    Write a text-only PDF with one page per item of pages.
+
+    Args:
+        path: The output path.
+        pages: A list of pages, every page a list of (text, font size) tuples.
+        line_width: The number of characters per line of wrapped text.
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # The page tree, written once the page objects are numbered
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+
+    page_ids = []
+    for page in pages:
+        commands = ["BT", "50 790 Td"]
+        for text, font_size in page:
+            commands.append(f"/F1 {font_size} Tf {font_size + 4} TL")
+            for line in textwrap.wrap(text, line_width):
+                commands.append(f"({_escape_pdf_text(line)}) Tj T*")
+            commands.append("T*")
+        commands.append("ET")
+        content = "\n".join(commands).encode("latin-1")
+
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects)
+        )
+        page_ids.append(len(objects))
+
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids).encode()
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+
+    xref_offset = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+
+    with open(path, "wb") as f:
+        f.write(output)
+
+
+def generate_pdf(path, num_pages, generator, paragraphs_per_page=4):
+    """
+    Write a PDF of num_pages pages with a title and paragraphs on every page.
+    """
+    pages = []
+    for _ in range(num_pages):
+        page = [(generator.title(), 16)]
+        page += [(generator.paragraph(), 10) for _ in range(paragraphs_per_page)]
+        pages.append(page)
+
+    write_pdf(path, pages)
+
+
+def generate_docx(path, num_pages, generator, paragraphs_per_page=4, table_every=3):
+    """
+    Write a DOCX with num_pages page-break separated sections of a heading, paragraphs and sometimes a table.
+    """
+    import docx
+
+    document = docx.Document()
+    for page in range(num_pages):
+        document.add_heading(generator.title(), level=1)
+        for _ in range(paragraphs_per_page):
+            document.add_paragraph(generator.paragraph())
+
+        if table_every and page % table_every == 0:
+            table = document.add_table(rows=4, cols=3)
+            for row in table.rows:
+                for cell in row.cells:
+                    cell.text = " ".join(generator.words(3))
+
+        if page < num_pages - 1:
+            document.add_page_break()
+
+    document.save(path)
+
+
+def generate_files(directory, num_files, num_pages, formats=("pdf", "docx"), seed=0):
+    """
+    Write num_files files of every format into the directory.
+
+    Returns:
+        A list of (path, format, number of pages) tuples.
+    """
+    generator = TextGenerator(seed=seed)
+    writers = {"pdf": generate_pdf, "docx": generate_docx}
+
+    files = []
+    for file_format in formats:
+        for i in range(num_files):
+            path = os.path.join(directory, f"synthetic_{i:03d}.{file_format}")
+            writers[file_format](path, num_pages, generator)
+            files.append((path, file_format, num_pages))
+
+    return files
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    A deterministic embedding function of hashed token counts with random signs, a stand-in for
+    the sentence-transformers model that needs no download. Texts sharing words are close.
+
+    Args:
+        dim: The dimension of the embeddings, the one of all-MiniLM-L6-v2 by default.
+    """
+
+    def __init__(self, dim=384):
+        self.dim = dim
+        self._buckets = {}
+
+    def embed_documents(self, texts):
+        return [self._embed(text).tolist() for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text).tolist()
+
+    def _embed(self, text):
+        tokens = re.findall(r"\w+", text.lower())
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if len(tokens) == 0:
+            return vector
+
+        buckets = np.array([self._bucket(token) for token in tokens])
+        vector += np.bincount(np.abs(buckets) - 1, weights=np.sign(buckets), minlength=self.dim)
+
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _bucket(self, token):
+        # A signed 1-based bucket, cached as the vocabulary is small
+        bucket = self._buckets.get(token)
+        if bucket is None:
+            digest = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+            bucket = (digest % self.dim + 1) * (1 if digest >> 63 else -1)
+            self._buckets[token] = bucket
+        return bucket
+
+
+class FakeChatModel:
+    """
+    A chat model answering with a fixed template and the first source of the prompt after a fixed latency,
+    with the invoke and ainvoke interface used by the agent's single-shot answers.
+
+    Args:
+        latency: The number of seconds an answer takes.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def invoke(self, prompt):
+        return AIMessage(content=self._answer(prompt))
+
+    async def ainvoke(self, prompt):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return AIMessage(content=self._answer(prompt))
+
+    @staticmethod
+    def _answer(prompt):
+        prompt = prompt if isinstance(prompt, str) else str(prompt)
+        # The question and the documents follow the examples of the prompt
+        tail = prompt.rsplit("\nQUESTION: ", 1)[-1]
+        question = tail.split("\n", 1)[0]
+        sources = re.findall(r"Source: (.*)", tail)
+
+        return f"A synthetic answer to: {question}\nSOURCES: {sources[0] if sources else ''}"
+
+
+class FakeLLM:
+    """
+    A stand-in of agent.llm.LLM holding a FakeChatModel.
+    """
+
+    def __init__(self, latency=0.0):
+        self.model = FakeChatModel(latency=latency)
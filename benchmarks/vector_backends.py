@@ -0,0 +1,127 @@
+"""
+Compare the recall and query latency of the vector backends on synthetic embeddings.
+
+Usage:
+    python -m benchmarks.vector_backends --num-vectors 100000 --output results.json
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from data_pipeline.vector_backends import ChromaBackend, MmapVectorBackend
+
+
+def generate_embeddings(num_vectors, dim, num_clusters, seed=0):
+    """
+    Returns normalized vectors grouped around random centers, like sentence embeddings of related texts.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(num_clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(num_clusters, size=num_vectors)] + 0.5 * rng.normal(size=(num_vectors, dim))
+    vectors = vectors.astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def exact_neighbors(vectors, queries, k):
+    """
+    Returns the indices of the k nearest vectors of every query by brute force.
+    """
+    distances = (vectors ** 2).sum(axis=1)[None, :] - 2 * queries @ vectors.T
+    return np.argsort(distances, axis=1)[:, :k]
+
+
+def build_backend(backend, vectors, batch_size=5000):
+    """
+    Add the vectors to the backend and returns the elapsed seconds.
+    """
+    ids = [str(i) for i in range(len(vectors))]
+
+    start = time.perf_counter()
+    for i in range(0, len(vectors), batch_size):
+        backend.add(
+            ids[i:i + batch_size],
+            vectors[i:i + batch_size],
+            ["" for _ in ids[i:i + batch_size]],
+            [{"group": j % 10} for j in range(i, min(i + batch_size, len(vectors)))]
+        )
+
+    return time.perf_counter() - start
+
+
+def benchmark_queries(backend, queries, truth, k):
+    """
+    Returns the recall and the latency percentiles of the queries.
+    """
+    latencies = []
+    recalls = []
+    for query, query_truth in zip(queries, truth):
+        start = time.perf_counter()
+        results = backend.query(query, k)
+        latencies.append(time.perf_counter() - start)
+
+        found = {int(chunk_id) for chunk_id, _ in results}
+        recalls.append(len(found & set(query_truth.tolist())) / k)
+
+    latencies_ms = np.array(latencies) * 1000
+
+    return {
+        f"recall_at_{k}": float(np.mean(recalls)),
+        "latency_p50_ms": float(np.percentile(latencies_ms, 50)),
+        "latency_p95_ms": float(np.percentile(latencies_ms, 95)),
+        "latency_p99_ms": float(np.percentile(latencies_ms, 99)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-vectors", type=int, default=100000)
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--skip-chroma", action="store_true")
+    parser.add_argument("--output", help="A path to write the results as JSON")
+    args = parser.parse_args()
+
+    # Queries come from the same distribution but are not stored
+    embeddings = generate_embeddings(
+        args.num_vectors + args.num_queries, args.dim, num_clusters=max(1, args.num_vectors // 100)
+    )
+    vectors, queries = embeddings[:args.num_vectors], embeddings[args.num_vectors:]
+    truth = exact_neighbors(vectors, queries, args.k)
+
+    results = {"num_vectors": args.num_vectors, "dim": args.dim, "k": args.k, "backends": {}}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for quantization in ("float32", "int8"):
+            backend = MmapVectorBackend(os.path.join(tmp_dir, quantization), quantization=quantization)
+            build_seconds = build_backend(backend, vectors)
+
+            for nprobe in args.nprobe:
+                name = f"mmap-{quantization}-nprobe{nprobe}"
+                backend.nprobe = nprobe
+                results["backends"][name] = {
+                    "build_seconds": build_seconds,
+                    **benchmark_queries(backend, queries, truth, args.k)
+                }
+                print(name, results["backends"][name])
+
+        if not args.skip_chroma:
+            backend = ChromaBackend(os.path.join(tmp_dir, "chroma"))
+            results["backends"]["chroma"] = {
+                "build_seconds": build_backend(backend, vectors),
+                **benchmark_queries(backend, queries, truth, args.k)
+            }
+            print("chroma", results["backends"]["chroma"])
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,297 @@
-from langchain_community.retrievers import BM25Retriever
-from langchain.retrievers import EnsembleRetriever
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Literal
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
 from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from data_pipeline.metrics import metrics, track_stage
+from data_pipeline.retrieval_cache import RetrievalCache
+
+
+# Bounded pool for blocking retrieval work (query embedding, vector and BM25 search),
+# so concurrent requests do not block the event loop or spawn unbounded threads
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", 8))
+
+# Marks the threads of the retrieval pool, see submit_to_retrieval_executor
+_retrieval_worker = threading.local()
+
+
+def _mark_retrieval_worker():
+    _retrieval_worker.active = True
+
+
+retrieval_executor = ThreadPoolExecutor(
+    max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval", initializer=_mark_retrieval_worker
+)
+metrics.gauge(
+    "rag_retrieval_queue_depth", "Retrieval tasks waiting for a worker thread",
+    callback=lambda: retrieval_executor._work_queue.qsize()
+)
+
+# Shared by all retrievers, entries are scoped by the corpus version
+retrieval_cache = RetrievalCache(max_entries=int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", 1024)))
+
+
+async def run_in_retrieval_executor(func, *args, **kwargs):
+    """
+    Run a blocking function in the retrieval thread pool and await its result.
+    The function runs in a copy of the current context, so its stages are added to the request timings.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(retrieval_executor, partial(context.run, func, *args, **kwargs))
+
+
+def submit_to_retrieval_executor(func, *args, **kwargs):
+    """
+    Submit a blocking function to the retrieval thread pool in a copy of the current context.
+    Called from a thread of the pool, the function runs right away in that thread: a worker waiting
+    for a task queued behind the work of the other waiting workers would deadlock the pool.
+
+    Returns:
+        A Future of its result.
+    """
+    if not getattr(_retrieval_worker, "active", False):
+        return retrieval_executor.submit(contextvars.copy_context().run, func, *args, **kwargs)
+
+    future = Future()
+    try:
+        future.set_result(func(*args, **kwargs))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def fuse_rankings(dense_results, sparse_results, weights=(0.6, 0.4), method="rrf", c=60):
+    """
+    Fuse dense and sparse rankings of chunk ids.
+
+    Args:
+        dense_results: A list of (chunk id, distance) tuples, nearest first.
+        sparse_results: A list of (chunk id, BM25 score) tuples, best first.
+        weights: The weights of the dense and the sparse ranking.
+        method: "rrf" for weighted reciprocal rank fusion or "weighted" for
+            a weighted sum of min-max normalized scores.
+        c: The rank constant of reciprocal rank fusion.
+
+    Returns:
+        A list of (chunk id, score) tuples sorted by the fused score.
+    """
+    chunk_ids = list(dict.fromkeys([chunk_id for chunk_id, _ in dense_results] + [chunk_id for chunk_id, _ in sparse_results]))
+    if len(chunk_ids) == 0:
+        return []
+
+    positions = {chunk_id: position for position, chunk_id in enumerate(chunk_ids)}
+    scores = np.zeros(len(chunk_ids), dtype=np.float64)
+
+    # Lower distances are better, so they are negated to get a score
+    rankings = [
+        (dense_results, -np.array([distance for _, distance in dense_results], dtype=np.float64)),
+        (sparse_results, np.array([score for _, score in sparse_results], dtype=np.float64)),
+    ]
+
+    for (results, raw_scores), weight in zip(rankings, weights):
+        if len(results) == 0:
+            continue
+
+        indices = np.array([positions[chunk_id] for chunk_id, _ in results])
+
+        if method == "rrf":
+            scores[indices] += weight / (c + np.arange(1, len(results) + 1))
+        elif method == "weighted":
+            score_range = raw_scores.max() - raw_scores.min()
+            normalized = (raw_scores - raw_scores.min()) / score_range if score_range > 0 else np.ones_like(raw_scores)
+            scores[indices] += weight * normalized
+        else:
+            raise ValueError(f"Unknown fusion method: {method}")
+
+    order = np.argsort(-scores, kind="stable")
+
+    return [(chunk_ids[i], float(scores[i])) for i in order]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    A retriever that runs dense (vector) and sparse (BM25) search concurrently over chunk ids,
+    fuses the rankings and fetches the texts of the final top-k chunks only.
+
+    A metadata filter can be set on the retriever or passed per call,
+    e.g. retriever.invoke(query, filter={"filename": "report.pdf"}).
+
+    The vectorstore is a VectorStore or IndexGenerations object. Every query leases it
+    with acquire(), so it is answered from one generation of the corpus.
+    """
+
+    vectorstore: Any
+    k: int = 3
+    fetch_k: int = 20  # Number of candidates of each search
+    weights: list[float] = [0.6, 0.4]
+    fusion: Literal["rrf", "weighted"] = "rrf"
+    c: int = 60
+    filter: dict | None = None
+    cache: Any = None
+
+    def search(self, query, filter=None):
+        """
+        Rank the chunk ids for a query, using the cache if possible.
+
+        Returns:
+            A list of at most k (chunk id, score) tuples.
+        """
+        with self.vectorstore.acquire() as vectorstore:
+            return self._search(vectorstore, query, filter)
+
+    async def asearch(self, query, filter=None):
+        """
+        Async version of search, both searches run in the retrieval thread pool.
+        """
+        with self.vectorstore.acquire() as vectorstore:
+            return await self._asearch(vectorstore, query, filter)
+
+    def batch_search(self, queries, filter=None):
+        """
+        Rank the chunk ids for a batch of queries. The queries missing from the cache are embedded
+        with one model call, and the dense and sparse searches each run once for the whole batch.
+
+        Returns:
+            A list of lists of at most k (chunk id, score) tuples, one per query.
+        """
+        with self.vectorstore.acquire() as vectorstore:
+            return self._batch_search(vectorstore, queries, filter)
+
+    def batch_get_relevant_documents(self, queries, filter=None):
+        """
+        Retrieve the documents for a batch of queries, fetching the texts of all results at once.
+
+        Returns:
+            A list of lists of Document objects, one per query.
+        """
+        with track_stage("batch_retrieval"), self.vectorstore.acquire() as vectorstore:
+            results = self._batch_search(vectorstore, queries, filter)
+
+            return self._batch_to_documents(vectorstore, results)
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun, filter: dict | None = None
+    ) -> list[Document]:
+        with track_stage("retrieval"), self.vectorstore.acquire() as vectorstore:
+            results = self._search(vectorstore, query, filter)
+
+            return self._to_documents(vectorstore, results)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun, filter: dict | None = None
+    ) -> list[Document]:
+        with track_stage("retrieval"), self.vectorstore.acquire() as vectorstore:
+            results = await self._asearch(vectorstore, query, filter)
+
+            return await run_in_retrieval_executor(self._to_documents, vectorstore, results)
+
+    def _search(self, vectorstore, query, filter):
+        filter = filter or self.filter
+        corpus_version = vectorstore.corpus_version
+
+        cached = self._get_cached(query, corpus_version, filter)
+        if cached is not None:
+            return cached
+
+        dense_future = submit_to_retrieval_executor(self._dense_search, vectorstore, query, filter)
+        sparse_results = vectorstore.sparse_search(query, self.fetch_k, where=filter)
+
+        return self._fuse(query, corpus_version, filter, dense_future.result(), sparse_results)
+
+    async def _asearch(self, vectorstore, query, filter):
+        filter = filter or self.filter
+        corpus_version = vectorstore.corpus_version
+
+        cached = self._get_cached(query, corpus_version, filter)
+        if cached is not None:
+            return cached
+
+        dense_results, sparse_results = await asyncio.gather(
+            run_in_retrieval_executor(self._dense_search, vectorstore, query, filter),
+            run_in_retrieval_executor(vectorstore.sparse_search, query, self.fetch_k, where=filter),
+        )
+
+        return self._fuse(query, corpus_version, filter, dense_results, sparse_results)
+
+    def _batch_search(self, vectorstore, queries, filter):
+        filter = filter or self.filter
+        corpus_version = vectorstore.corpus_version
+
+        results = [self._get_cached(query, corpus_version, filter) for query in queries]
+        missing = [i for i, cached in enumerate(results) if cached is None]
+        if len(missing) == 0:
+            return results
+
+        missing_queries = [queries[i] for i in missing]
+        dense_future = submit_to_retrieval_executor(self._batch_dense_search, vectorstore, missing_queries, filter)
+        sparse_results = vectorstore.batch_sparse_search(missing_queries, self.fetch_k, where=filter)
+
+        for i, dense, sparse in zip(missing, dense_future.result(), sparse_results):
+            results[i] = self._fuse(queries[i], corpus_version, filter, dense, sparse)
+
+        return results
+
+    def _batch_dense_search(self, vectorstore, queries, filter):
+        query_embeddings = vectorstore.embed_queries(queries)
+        return vectorstore.batch_dense_search(query_embeddings, self.fetch_k, where=filter)
+
+    def _dense_search(self, vectorstore, query, filter):
+        query_embedding = vectorstore.embed_query(query)
+        return vectorstore.dense_search(query_embedding, self.fetch_k, where=filter)
+
+    def _get_cached(self, query, corpus_version, filter):
+        if self.cache is None:
+            return None
+        return self.cache.get(query, self.k, corpus_version, filter=filter)
+
+    def _fuse(self, query, corpus_version, filter, dense_results, sparse_results):
+        results = fuse_rankings(
+            dense_results, sparse_results, weights=self.weights, method=self.fusion, c=self.c
+        )[:self.k]
+
+        if self.cache is not None:
+            self.cache.put(query, self.k, corpus_version, results, filter=filter)
+
+        return results
+
+    def _to_documents(self, vectorstore, results):
+        scores = dict(results)
+        documents = vectorstore.get_documents([chunk_id for chunk_id, _ in results])
+
+        for document in documents:
+            document.metadata["retrieval_score"] = scores.get(document.metadata.get("chunk_id"))
+
+        return documents
+
+    def _batch_to_documents(self, vectorstore, results):
+        chunk_ids = list(dict.fromkeys(chunk_id for query_results in results for chunk_id, _ in query_results))
+        documents_by_id = {
+            document.metadata.get("chunk_id"): document for document in vectorstore.get_documents(chunk_ids)
+        }
+
+        batch_documents = []
+        for query_results in results:
+            documents = []
+            for chunk_id, score in query_results:
+                if chunk_id in documents_by_id:
+                    # A copy per query, as the score differs between queries
+                    document = documents_by_id[chunk_id]
+                    documents.append(Document(
+                        page_content=document.page_content,
+                        metadata={**document.metadata, "retrieval_score": score}
+                    ))
+            batch_documents.append(documents)
+
+        return batch_documents
 
 
 def create_document_retriever(
@@ -11,30 +302,22 @@ def create_document_retriever(
     Create a retriever that will be used by the agent to retrieve documents.
 
     Args:
-        vectorstore: vectorstore containing chunks of documents
+        vectorstore: VectorStore or IndexGenerations object containing chunks of documents
         num_documents: number of documents to retrieve
     
     Returns:
-        Ensemble of vectorstore backed retriever and BM25Retriever
+        Hybrid retriever over the vectorstore and its BM25 index.
+        Fused rankings are cached in the shared retrieval cache.
     """
 
-    vectorstore_retriever = vectorstore.as_retriever()
-
-    all_docs = vectorstore.get()
-    prepared_documents = []
-    for i in range(len(all_docs["ids"])):
-        document = Document(
-            page_content=all_docs["documents"][i],
-            metadata=all_docs["metadatas"][i]
+    with track_stage("create_retriever"):
+        retriever = HybridRetriever(
+            vectorstore=vectorstore,
+            k=num_documents,
+            fetch_k=int(os.getenv("RETRIEVAL_FETCH_K", 20)),
+            weights=[0.6, 0.4],
+            fusion=os.getenv("RETRIEVAL_FUSION", "rrf"),
+            cache=retrieval_cache
         )
-        prepared_documents.append(document)
-
-    bm25_retriever = BM25Retriever.from_documents(prepared_documents)
-    bm25_retriever.k = num_documents
-
-    retriever = EnsembleRetriever(
-        retrievers=[vectorstore_retriever, bm25_retriever],
-        weights=[0.6, 0.4]
-    )
 
-    return retriever
\ No newline at end of file
+    return retriever
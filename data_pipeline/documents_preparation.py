@@ -1,12 +1,98 @@
+import importlib.metadata
 import os
+import multiprocessing
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, CancelledError, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import NamedTuple
 
-import nltk
-from langchain_unstructured.document_loaders import UnstructuredLoader
 from langchain_community.vectorstores.utils import filter_complex_metadata
+from langchain_core.documents import Document
 
-nltk.download('punkt_tab')
-nltk.download('averaged_perceptron_tagger_eng')
+from data_pipeline.element_cache import ElementCache
+from data_pipeline.metrics import collect_timings, record_stage, track_stage
 
+# NLTK data used by unstructured, provisioned once into a local directory
+NLTK_DATA_DIR = os.getenv("NLTK_DATA_DIR", "nltk_data")
+NLTK_PACKAGES = {
+    "punkt_tab": "tokenizers/punkt_tab",
+    "averaged_perceptron_tagger_eng": "taggers/averaged_perceptron_tagger_eng",
+}
+
+# Settings of the unstructured parser, the parsed elements are cached per settings
+PARSER_SETTINGS = {"strategy": "fast", "skip_infer_table_types": []}
+
+# Raw elements of parsed files are cached by file hash, set ELEMENT_CACHE_DIR to an empty string to disable the cache
+ELEMENT_CACHE_DIR = os.getenv("ELEMENT_CACHE_DIR", "element_cache")
+
+_nltk_data_ready = False
+_element_cache = None
+
+# Lazily created pool of parser processes, reused between batches
+_process_pool = None
+_process_pool_workers = None
+
+
+# Parameters of the by_title chunking of the parsed elements
+class ChunkingConfig(NamedTuple):
+    max_characters: int
+    new_after_n_chars: int
+    combine_text_under_n_chars: int
+
+
+# Chunking of new files, stored files chunked differently are chunked again when they are re-ingested
+DEFAULT_CHUNKING = ChunkingConfig(
+    max_characters=int(os.getenv("CHUNK_MAX_CHARACTERS", 1700)),
+    new_after_n_chars=int(os.getenv("CHUNK_NEW_AFTER_N_CHARS", 1500)),
+    combine_text_under_n_chars=int(os.getenv("CHUNK_COMBINE_TEXT_UNDER_N_CHARS", 1000)),
+)
+
+
+class DocumentLoadResult(NamedTuple):
+    documents: list
+    error: str | None
+    timings: dict | None = None  # Seconds per stage, measured in the parser process
+
+
+def ensure_nltk_data():
+    """
+    Make the NLTK data available to the parser, downloading only the missing packages into NLTK_DATA_DIR.
+    Called at startup and by every parser process before the first file.
+    """
+    global _nltk_data_ready
+
+    if _nltk_data_ready:
+        return
+
+    import nltk
+
+    data_dir = os.path.abspath(NLTK_DATA_DIR)
+    if data_dir not in nltk.data.path:
+        nltk.data.path.insert(0, data_dir)
+
+    for package, resource in NLTK_PACKAGES.items():
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            nltk.download(package, download_dir=data_dir, quiet=True)
+
+    _nltk_data_ready = True
+
+def get_element_cache():
+    """
+    Returns the cache of parsed elements, or None if it is disabled.
+    The elements of different unstructured versions and parser settings are kept apart.
+    """
+    global _element_cache
+
+    if _element_cache is None and ELEMENT_CACHE_DIR:
+        try:
+            version = importlib.metadata.version("unstructured")
+        except importlib.metadata.PackageNotFoundError:
+            version = "unknown"
+        _element_cache = ElementCache(ELEMENT_CACHE_DIR, namespace=f"{PARSER_SETTINGS['strategy']}-{version}")
+
+    return _element_cache
 
 def prepare_table_elements(documents):
     """Merge table element with the previous element in order to provide context to tables.
@@ -21,15 +107,9 @@ def prepare_table_elements(documents):
     cleaned_documents = []
 
     for document in documents:
-        if "category" in document.metadata:
-            category = document.metadata["category"]
-            if category == "Table" and len(cleaned_documents) > 0:
-                new_doc = cleaned_documents[-1] # Pick the last document
-                new_doc.page_content += document.page_content
-                cleaned_documents = cleaned_documents[:-1] # Remove the last document
-                cleaned_documents.append(new_doc)
-            else:
-                cleaned_documents.append(document)
+        if document.metadata.get("category") == "Table" and len(cleaned_documents) > 0:
+            # Extend the last document in place instead of rebuilding the list
+            cleaned_documents[-1].page_content += document.page_content
         else:
             cleaned_documents.append(document)
 
@@ -56,38 +136,254 @@ def change_source_metadata(documents, filename):
         document.metadata.update({"source": filename})
     return documents 
 
-def load_single_document(file):
+def parse_elements(file, filename="data.pdf"):
+    """
+    Parse a file into unstructured elements, without chunking.
+
+    Args:
+        file: The path to the file to be parsed or a file stream.
+        filename: The name of the file stored in the metadata of the elements.
+
+    Returns:
+        A list of element dicts.
+    """
+
+    # unstructured and torch are imported on the first parsed file, not at startup
+    from unstructured.partition.auto import partition
+    from unstructured.staging.base import elements_to_dicts
+
+    ensure_nltk_data()
+
+    # Paths are read by the parser directly instead of being copied into memory
+    source = {"filename": os.fspath(file)} if isinstance(file, (str, os.PathLike)) else {"file": file}
+
+    with track_stage("parse"):
+        elements = partition(**source, metadata_filename=filename, **PARSER_SETTINGS)
+
+    return elements_to_dicts(elements)
+
+def chunk_elements(elements, filename="data.pdf", chunking=None):
     """
-    Load a document using the UnstructuredFileLoader and extract images if the document is a PDF.
+    Chunk parsed elements by title and convert the chunks to Document objects.
 
     Args:
-        file: The path to the file to be loaded or bytes.
-        images_dir: The directory to save the extracted images.
+        elements: A list of element dicts of a file.
+        filename: The name of the file stored in the metadata of the documents.
+        chunking: A ChunkingConfig object. Defaults to DEFAULT_CHUNKING.
+
+    Returns:
+        A list of Document objects.
+    """
+    from unstructured.chunking.title import chunk_by_title
+    from unstructured.staging.base import elements_from_dicts, elements_to_dicts
+
+    chunking = chunking or DEFAULT_CHUNKING
+
+    with track_stage("chunk"):
+        chunks = chunk_by_title(elements_from_dicts(elements), **chunking._asdict())
+
+        # The same metadata as the documents of the UnstructuredLoader in "elements" mode
+        documents = []
+        for chunk in elements_to_dicts(chunks):
+            metadata = dict(chunk.get("metadata") or {})
+            # Cached elements keep the name the file had when it was parsed
+            metadata["filename"] = filename
+            metadata.update({"category": chunk.get("type"), "element_id": chunk.get("element_id")})
+            documents.append(Document(page_content=chunk.get("text") or "", metadata=metadata))
+
+    with track_stage("prepare_elements"):
+        # Concat table elements to the previos context
+        cleaned_documents = prepare_table_elements(documents)
+
+        # Add filename to the metadata (required if "chunk_mode" == "single")
+        cleaned_documents = change_source_metadata(cleaned_documents, filename)
+
+        cleaned_documents_metadata = filter_complex_metadata(cleaned_documents)
+
+    return cleaned_documents_metadata
+
+def load_single_document(file, filename="data.pdf", file_hash=None, chunking=None):
+    """
+    Load a document: parse it into elements with unstructured, or read its elements from the cache,
+    and chunk them.
+
+    Args:
+        file: The path to the file to be loaded or a file stream.
+            May be None if the elements of the file are cached.
+        filename: The name of the file stored in the metadata of the documents.
+        file_hash: The content hash of the file, the key of the element cache. The cache is not used if not set.
+        chunking: A ChunkingConfig object. Defaults to DEFAULT_CHUNKING.
 
     Returns:
         A list of Document objects. 
     """
+    element_cache = get_element_cache() if file_hash else None
 
-    loader = UnstructuredLoader(
-            file=file,
-            strategy="fast",
-            mode="elements",
-            chunking_strategy="by_title",
-            max_characters=1700,
-            new_after_n_chars=1500,
-            combine_text_under_n_chars=1000,
-            skip_infer_table_types=[],
-            metadata_filename="data.pdf"
-        )
+    elements = None
+    if element_cache is not None:
+        with track_stage("load_elements"):
+            elements = element_cache.get(file_hash)
 
-    documents = loader.load()
-    
-    # Concat table elements to the previos context
-    cleaned_documents = prepare_table_elements(documents)
+    if elements is None:
+        if file is None:
+            raise FileNotFoundError(f"The elements of {filename} are not cached, the file has to be ingested again")
+
+        elements = parse_elements(file, filename)
+
+        if element_cache is not None:
+            with track_stage("store_elements"):
+                element_cache.put(file_hash, elements)
+
+    return chunk_elements(elements, filename, chunking)
+
+def load_documents(files, filenames=None, workers=None, on_progress=None, file_hashes=None, chunking=None):
+    """
+    Load a batch of documents in parallel using a pool of processes.
+
+    Args:
+        files: A list of paths to the files to be loaded or file streams.
+        filenames: An optional list of names of the files, one per file.
+        workers: The number of parser processes. Defaults to the number of CPUs.
+        on_progress: An optional callback called with the number of processed files.
+        file_hashes: An optional list of content hashes of the files, used to cache their elements.
+        chunking: A ChunkingConfig object. Defaults to DEFAULT_CHUNKING.
+
+    Returns:
+        A list of DocumentLoadResult objects in the same order as the input files.
+        A file that failed to load has no documents and an error message.
+    """
+    results = [None] * len(files)
+
+    for num_done, (i, result) in enumerate(iter_load_documents(
+        files, filenames, workers=workers, file_hashes=file_hashes, chunking=chunking
+    ), start=1):
+        results[i] = result
+        if on_progress:
+            on_progress(num_done)
+
+    return results
+
+def iter_load_documents(files, filenames=None, workers=None, max_pending=None, file_hashes=None, chunking=None):
+    """
+    Load documents in parallel using a pool of processes and yield them as they are parsed.
+    At most max_pending files are parsed or waiting to be consumed at once, so a slow consumer
+    holds back the parsers instead of the parsed documents piling up in memory.
+    The files in flight when a parser process crashes are parsed again one at a time,
+    only a file that crashes the parser on its own fails.
+
+    Args:
+        files: A list of paths to the files to be loaded or file streams.
+        filenames: An optional list of names of the files, one per file.
+        workers: The number of parser processes. Defaults to the number of CPUs.
+        max_pending: The maximum number of files in flight. Defaults to twice the number of workers.
+        file_hashes: An optional list of content hashes of the files, used to cache their elements.
+        chunking: A ChunkingConfig object. Defaults to DEFAULT_CHUNKING.
+
+    Yields:
+        Tuples of the index of the file and its DocumentLoadResult, in the order they finish.
+    """
+    workers = workers or os.cpu_count() or 1
+    filenames = filenames or ["data.pdf"] * len(files)
+    file_hashes = file_hashes or [None] * len(files)
+    max_pending = max_pending or 2 * workers
+
+    # Avoid the pool overhead when there is nothing to parallelize
+    if workers == 1 or len(files) <= 1:
+        for i, (file, filename, file_hash) in enumerate(zip(files, filenames, file_hashes)):
+            yield i, _load_document_safe(file, filename, file_hash, chunking)
+        return
+
+    pool = _get_process_pool(workers)
+    pending_inputs = iter(enumerate(zip(files, filenames, file_hashes)))
+    # Files that were in flight when a parser process crashed, parsed again one at a time
+    suspect_inputs = deque()
+    futures = {}  # Future -> (index, arguments, whether it was parsed alone, its pool)
+
+    def submit(i, args, isolated):
+        nonlocal pool
+        try:
+            future = pool.submit(_load_document_safe, *args, chunking)
+        except BrokenProcessPool:
+            # The pool broke after the last results were collected
+            shutdown_process_pool()
+            pool = _get_process_pool(workers)
+            future = pool.submit(_load_document_safe, *args, chunking)
+        futures[future] = (i, args, isolated, pool)
+
+    try:
+        while True:
+            if suspect_inputs:
+                # Each suspect is parsed alone, so only the file that crashes the parser fails
+                if not futures:
+                    submit(*suspect_inputs.popleft(), isolated=True)
+            else:
+                # Keep up to max_pending files in flight
+                while len(futures) < max_pending:
+                    next_input = next(pending_inputs, None)
+                    if next_input is None:
+                        break
+                    submit(*next_input, isolated=False)
+
+            if not futures:
+                break
+
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                i, args, isolated, future_pool = futures.pop(future)
+                try:
+                    result = future.result()
+                    # Stages recorded in a parser process are lost with it, so they are recorded again here
+                    for stage, seconds in (result.timings or {}).items():
+                        record_stage(stage, seconds)
+                except (BrokenProcessPool, CancelledError):
+                    # A parser process crashed, e.g. on a malformed file, and took the pool and its files down
+                    if future_pool is pool:
+                        shutdown_process_pool()
+                        pool = _get_process_pool(workers)
+
+                    if not isolated:
+                        suspect_inputs.append((i, args))
+                        continue
+                    result = DocumentLoadResult([], "The parser process terminated abruptly")
+
+                yield i, result
+    finally:
+        # The consumer stopped early, the files that have not started are not parsed
+        for future in futures:
+            future.cancel()
+
+def shutdown_process_pool():
+    """
+    Shut down the pool of parser processes if it was started.
+    """
+    global _process_pool, _process_pool_workers
+
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+        _process_pool_workers = None
+
+def _get_process_pool(workers):
+    global _process_pool, _process_pool_workers
+
+    if _process_pool is None or _process_pool_workers != workers:
+        shutdown_process_pool()
+
+        # Spawn is used as the parent process may already run threads and torch
+        _process_pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+        _process_pool_workers = workers
 
-    # Add filename to the metadata (required if "chunk_mode" == "single")
-    cleaned_documents = change_source_metadata(cleaned_documents, "data.pdf")
+    return _process_pool
 
-    cleaned_documents_metadata = filter_complex_metadata(cleaned_documents)
+def _load_document_safe(file, filename, file_hash=None, chunking=None):
+    with collect_timings() as timings:
+        try:
+            documents = load_single_document(file, filename, file_hash, chunking)
+        except Exception as e:
+            return DocumentLoadResult([], f"{type(e).__name__}: {e}", timings)
 
-    return cleaned_documents_metadata
\ No newline at end of file
+    return DocumentLoadResult(documents, None, timings)
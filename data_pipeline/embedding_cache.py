@@ -0,0 +1,231 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Access times of hits are written in batches, once this many are buffered or this many seconds passed
+ACCESS_FLUSH_SIZE = 1000
+ACCESS_FLUSH_SECONDS = 30
+
+
+class EmbeddingCache:
+    """
+    A disk-backed store of float32 embeddings in SQLite with size-based LRU eviction.
+    The total size is kept in the database, so processes sharing the file evict by the same size.
+
+    Args:
+        path: The path to the SQLite database file.
+        max_size_bytes: The maximum total size of the stored vectors.
+    """
+
+    def __init__(self, path, max_size_bytes=1024 ** 3):
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        # The size of older databases is summed once, then the triggers keep it up to date
+        self._connection.executescript(
+            "BEGIN IMMEDIATE;"
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access);"
+            "CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER NOT NULL);"
+            "INSERT OR IGNORE INTO cache_size (id, size) SELECT 0, COALESCE(SUM(size), 0) FROM embeddings;"
+            "CREATE TRIGGER IF NOT EXISTS embeddings_insert AFTER INSERT ON embeddings "
+            "BEGIN UPDATE cache_size SET size = size + NEW.size WHERE id = 0; END;"
+            "CREATE TRIGGER IF NOT EXISTS embeddings_delete AFTER DELETE ON embeddings "
+            "BEGIN UPDATE cache_size SET size = size - OLD.size WHERE id = 0; END;"
+            "COMMIT;"
+        )
+
+        # Keys of hits and their access times that are not written yet
+        self._accessed = {}
+        self._accessed_flushed_at = time.monotonic()
+
+    def get_many(self, keys):
+        """
+        Returns a dictionary of the cached vectors for the given keys.
+        Missing keys are not included.
+        """
+        if len(keys) == 0:
+            return {}
+
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+
+        with self._lock:
+            # Stay below the SQLite limit of query parameters
+            for i in range(0, len(unique_keys), 500):
+                batch = unique_keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32)
+
+            # Hits only touch the buffer, the LRU order tolerates access times written a bit late
+            now = time.time()
+            self._accessed.update((key, now) for key in found)
+            if (
+                len(self._accessed) >= ACCESS_FLUSH_SIZE
+                or time.monotonic() - self._accessed_flushed_at >= ACCESS_FLUSH_SECONDS
+            ):
+                self._flush_accessed()
+                self._connection.commit()
+
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+
+        return found
+
+    def put_many(self, items):
+        """
+        Store vectors and evict the least recently used ones if the cache is full.
+
+        Args:
+            items: A dictionary of keys and vectors.
+        """
+        if len(items) == 0:
+            return
+
+        now = time.time()
+        rows = []
+        for key, vector in items.items():
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            rows.append((key, blob, len(blob), now))
+
+        with self._lock:
+            # The vector of a key never changes, so existing keys are kept as is
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, size, last_access) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            # Evict by the recent access times
+            self._flush_accessed()
+
+            size = self._read_size()
+            if size > self.max_size_bytes:
+                self._evict(size)
+
+            self._connection.commit()
+
+    def stats(self):
+        """
+        Returns the cache statistics.
+        """
+        requests = self.hits + self.misses
+        with self._lock:
+            size = self._read_size()
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.0,
+            "size_bytes": size,
+            "max_size_bytes": self.max_size_bytes,
+        }
+
+    def _flush_accessed(self):
+        if self._accessed:
+            self._connection.executemany(
+                "UPDATE embeddings SET last_access = MAX(last_access, ?) WHERE key = ?",
+                [(access_time, key) for key, access_time in self._accessed.items()]
+            )
+            self._accessed.clear()
+        self._accessed_flushed_at = time.monotonic()
+
+    def _read_size(self):
+        return self._connection.execute("SELECT size FROM cache_size WHERE id = 0").fetchone()[0]
+
+    def _evict(self, size):
+        # Free some room at once instead of evicting on every insert
+        target_size = int(self.max_size_bytes * 0.9)
+
+        rows = self._connection.execute(
+            "SELECT key, size FROM embeddings ORDER BY last_access ASC"
+        )
+
+        keys_to_delete = []
+        for key, vector_size in rows:
+            if size <= target_size:
+                break
+            keys_to_delete.append((key,))
+            size -= vector_size
+
+        self._connection.executemany("DELETE FROM embeddings WHERE key = ?", keys_to_delete)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    An embedding function that serves repeated texts from an EmbeddingCache.
+    Only the cache misses are sent to the model, in one batch.
+
+    Args:
+        embeddings: The underlying embedding function.
+        cache: The EmbeddingCache object.
+        model_name: The name of the model, part of the cache key.
+    """
+
+    def __init__(self, embeddings, cache, model_name):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name
+
+    def embed_documents(self, texts):
+        return self._embed_many("document", texts)
+
+    def embed_queries(self, texts):
+        """
+        Embed a batch of queries with one model call for the cache misses.
+        The sentence-transformers model embeds queries and documents the same way.
+        """
+        return self._embed_many("query", texts)
+
+    def embed_query(self, text):
+        key = self._key("query", text)
+        cached = self.cache.get_many([key])
+
+        if key in cached:
+            return cached[key].tolist()
+
+        vector = self.embeddings.embed_query(text)
+        self.cache.put_many({key: vector})
+
+        return vector
+
+    def _embed_many(self, kind, texts):
+        keys = [self._key(kind, text) for text in texts]
+        cached = self.cache.get_many(keys)
+
+        # Embed each missing text once, even if it is repeated in the batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_items = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(new_items)
+            cached.update({key: np.asarray(vector, dtype=np.float32) for key, vector in new_items.items()})
+
+        return [cached[key].tolist() for key in keys]
+
+    def _key(self, kind, text):
+        text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{self.model_name}:{kind}:{text_hash}"
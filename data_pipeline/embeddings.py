@@ -0,0 +1,127 @@
+import os
+import threading
+
+from data_pipeline.embedding_cache import CachedEmbeddings, EmbeddingCache
+
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+EMBEDDING_DEVICE = os.getenv("EMBEDDING_DEVICE")  # Picked by sentence-transformers if not set
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 32))
+EMBEDDING_NORMALIZE = os.getenv("EMBEDDING_NORMALIZE", "false").lower() == "true"
+
+# Set EMBEDDING_CACHE_PATH to an empty string to disable the cache
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache/embeddings.sqlite3")
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", 1024 ** 3))
+
+_embedding_provider = None
+_embedding_provider_lock = threading.Lock()
+
+
+class EmbeddingProvider:
+    """
+    A class that loads an embedding model once and shares it between ingestion and retrieval.
+
+    Args:
+        model_name: The name of the sentence-transformers model.
+        device: The device to run the model on, e.g. "cpu" or "cuda".
+        batch_size: The number of texts embedded in one forward pass.
+        normalize: Whether to normalize the embeddings to unit length.
+        cache_path: The path to the persistent embedding cache. The cache is disabled if not set.
+        cache_max_bytes: The maximum size of the embedding cache.
+    """
+
+    def __init__(
+        self,
+        model_name,
+        device=None,
+        batch_size=32,
+        normalize=False,
+        cache_path=None,
+        cache_max_bytes=1024 ** 3
+    ):
+        self.model_name = model_name
+        self.device = device
+        self.batch_size = batch_size
+        self.normalize = normalize
+
+        self.cache = None
+        if cache_path:
+            self.cache = EmbeddingCache(cache_path, max_size_bytes=cache_max_bytes)
+
+        self._embedding_function = None
+        self._lock = threading.Lock()
+
+    @property
+    def embedding_function(self):
+        """
+        The embedding function, the model is loaded on the first access.
+        """
+        if self._embedding_function is None:
+            with self._lock:
+                if self._embedding_function is None:
+                    self._embedding_function = self._create_embedding_function()
+
+        return self._embedding_function
+
+    def warm_up(self, num_texts=None):
+        """
+        Load the model and run a batch through it, so the first request does not pay for it.
+
+        Args:
+            num_texts: The number of texts in the warm-up batch. Defaults to the batch size.
+        """
+        num_texts = num_texts or self.batch_size
+
+        # The model itself is warmed up, through the cache the texts would be hits after the first start
+        model = self.embedding_function
+        if isinstance(model, CachedEmbeddings):
+            model = model.embeddings
+
+        model.embed_documents(["Warm-up text for the embedding model."] * num_texts)
+        model.embed_query("Warm-up query")
+
+        print(f"Embedding model {self.model_name} is ready")
+
+    def _create_embedding_function(self):
+        # sentence-transformers and torch are imported with the model
+        from langchain.embeddings.sentence_transformer import SentenceTransformerEmbeddings
+
+        model_kwargs = {}
+        if self.device:
+            model_kwargs["device"] = self.device
+
+        embedding_function = SentenceTransformerEmbeddings(
+            model_name=self.model_name,
+            model_kwargs=model_kwargs,
+            encode_kwargs={
+                "batch_size": self.batch_size,
+                "normalize_embeddings": self.normalize
+            }
+        )
+
+        if self.cache is not None:
+            # Normalized and raw vectors of the same model must not share cache entries
+            cache_model_name = f"{self.model_name}:normalized" if self.normalize else self.model_name
+            embedding_function = CachedEmbeddings(embedding_function, self.cache, cache_model_name)
+
+        return embedding_function
+
+
+def get_embedding_provider():
+    """
+    Returns the process-wide EmbeddingProvider configured from the environment.
+    """
+    global _embedding_provider
+
+    with _embedding_provider_lock:
+        if _embedding_provider is None:
+            _embedding_provider = EmbeddingProvider(
+                model_name=EMBEDDING_MODEL_NAME,
+                device=EMBEDDING_DEVICE,
+                batch_size=EMBEDDING_BATCH_SIZE,
+                normalize=EMBEDDING_NORMALIZE,
+                cache_path=EMBEDDING_CACHE_PATH,
+                cache_max_bytes=EMBEDDING_CACHE_MAX_BYTES
+            )
+
+    return _embedding_provider
@@ -0,0 +1,496 @@
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+
+from data_pipeline.sparse_index import BM25Index
+from data_pipeline.vector_backends import MmapVectorBackend
+from data_pipeline.vectorstore import BM25_INDEX_DIRNAME, MANIFEST_FILENAME, MMAP_VECTORS_DIRNAME, VectorStore
+
+
+CURRENT_FILENAME = "CURRENT"
+GENERATIONS_DIRNAME = "generations"
+LOCKS_DIRNAME = "locks"
+WRITER_LOCK_FILENAME = "WRITER.lock"
+
+# Files of a generation that are never modified in place, only replaced, so a new generation links them
+SHARED_PATHS = (
+    {MANIFEST_FILENAME}
+    | {os.path.join(BM25_INDEX_DIRNAME, name) for name in BM25Index.SHARED_FILES}
+    | {os.path.join(MMAP_VECTORS_DIRNAME, name) for name in MmapVectorBackend.SHARED_FILES}
+)
+
+# Linux ioctl cloning a file on copy-on-write filesystems, e.g. btrfs and XFS
+FICLONE = 0x40049409
+
+
+def copy_generation(source_dir, target_dir):
+    """
+    Copy the files of a generation. Files in SHARED_PATHS are hardlinked, the others are cloned
+    where the filesystem supports it and copied otherwise, so the cost of a copy does not grow
+    with the corpus on copy-on-write filesystems and with the mmap backend.
+    """
+    for directory, _, filenames in os.walk(source_dir):
+        relative_dir = os.path.relpath(directory, source_dir)
+        os.makedirs(os.path.join(target_dir, relative_dir), exist_ok=True)
+
+        for filename in filenames:
+            relative_path = os.path.normpath(os.path.join(relative_dir, filename))
+            source_path = os.path.join(source_dir, relative_path)
+            target_path = os.path.join(target_dir, relative_path)
+
+            if relative_path in SHARED_PATHS:
+                try:
+                    os.link(source_path, target_path)
+                    continue
+                except OSError:
+                    pass
+
+            clone_file(source_path, target_path)
+
+
+def clone_file(source_path, target_path):
+    """
+    Clone a file with a reflink, or copy it if the filesystem does not support it.
+    """
+    try:
+        import fcntl
+
+        with open(source_path, "rb") as source, open(target_path, "wb") as target:
+            fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+        shutil.copystat(source_path, target_path)
+        return
+    except (ImportError, OSError):
+        pass
+
+    shutil.copy2(source_path, target_path)
+
+
+class FileLock:
+    """
+    An advisory lock on a file, shared between processes. Every FileLock object opens the file itself,
+    so two objects exclude each other also within one process.
+    Without fcntl, e.g. on Windows, locking always succeeds and a single process must serve the directory.
+
+    Args:
+        path: The path of the lock file, created if it does not exist.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def acquire(self, shared=False, blocking=True):
+        """
+        Lock the file.
+
+        Args:
+            shared: Take a shared lock, held by any number of processes at once, instead of an exclusive one.
+            blocking: Wait for the lock instead of failing.
+
+        Returns:
+            Whether the lock was acquired.
+        """
+        try:
+            import fcntl
+        except ImportError:
+            return True
+
+        lock_file = open(self.path, "a+b")
+        flags = (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB)
+        try:
+            fcntl.flock(lock_file.fileno(), flags)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+
+        self._file = lock_file
+        return True
+
+    def release(self):
+        # Closing the file releases the lock
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class IndexGenerations:
+    """
+    Versioned generations of the vectorstore with atomic switching between them.
+
+    Every change of the corpus is applied to a new generation, a copy of the current one,
+    while queries keep reading the current generation. Publishing the new generation
+    atomically replaces the CURRENT pointer file and the served VectorStore.
+    Queries hold a lease on the generation they started with, so they finish on it.
+
+    Several processes, e.g. uvicorn workers, can serve the same directory:
+    - a process holds a shared lock on every generation it has opened, and a generation is only deleted
+      by the process that can lock it exclusively, i.e. when no process uses it and it is not current
+    - one writer at a time: prepare() waits for the writer lock, held until publish() or discard(),
+      so a new generation is always a copy of the latest published one
+    - the other processes follow the CURRENT pointer: it is checked whenever a generation is leased,
+      and a newer generation is opened in a background thread while the previous one is served
+
+    Published generations are opened read-only, only prepared generations are written.
+
+    Args:
+        root_dir: The directory of the pointer file and the generations.
+        embedding_function: The embedding function of the vectorstores.
+    """
+
+    def __init__(self, root_dir, embedding_function=None):
+        self.root_dir = root_dir
+        self.generations_dir = os.path.join(root_dir, GENERATIONS_DIRNAME)
+        self.locks_dir = os.path.join(root_dir, LOCKS_DIRNAME)
+        self.current_path = os.path.join(root_dir, CURRENT_FILENAME)
+        self.embedding_function = embedding_function
+
+        self._lock = threading.Lock()
+        self._follow_lock = threading.Lock()
+        self._following = False  # Whether a background thread is opening a newer generation
+        self._leases = {}  # Generation id -> number of active leases
+        self._retired = {}  # Replaced generations waiting for their leases to be released -> VectorStore
+        self._generation_locks = {}  # Generation id -> (FileLock, number of open VectorStores)
+        self._writer_locks = {}  # Prepared generation id -> FileLock of the writer
+
+        os.makedirs(self.locks_dir, exist_ok=True)
+
+        self.current_generation = self.load_current_generation()
+        self._current_mtime = os.stat(self.current_path).st_mtime_ns
+        self.current = self.open_generation(self.current_generation, read_only=True)
+
+        self.collect_garbage()
+
+    @property
+    def corpus_version(self):
+        """
+        The corpus version of the current generation.
+        """
+        self.follow_current(wait=False)
+        return self.current.corpus_version
+
+    def count(self):
+        """
+        Returns the number of chunks of the current generation.
+        """
+        self.follow_current(wait=False)
+        return self.current.count()
+
+    def list_files(self):
+        """
+        Returns the names of the files of the current generation.
+        """
+        self.follow_current(wait=False)
+        return self.current.list_files()
+
+    def list_file_hashes(self):
+        """
+        Returns the names and content hashes of the files of the current generation.
+        """
+        self.follow_current(wait=False)
+        return self.current.list_file_hashes()
+
+    @contextmanager
+    def acquire(self):
+        """
+        Lease the current generation for the duration of a query.
+
+        Yields:
+            The VectorStore of the generation. It is not deleted before the lease is released,
+            even if a newer generation is published in the meantime.
+        """
+        self.follow_current(wait=False)
+
+        with self._lock:
+            generation, vectorstore = self.current_generation, self.current
+            self._leases[generation] = self._leases.get(generation, 0) + 1
+
+        try:
+            yield vectorstore
+        finally:
+            with self._lock:
+                self._leases[generation] -= 1
+                if self._leases[generation] == 0:
+                    del self._leases[generation]
+                    retired = self._retired.pop(generation, None)
+                else:
+                    retired = None
+
+            if retired is not None:
+                self._release_generation(generation, retired)
+
+    def follow_current(self, wait=True):
+        """
+        Open the generation the CURRENT pointer refers to if another process published it.
+        The replaced generation is closed once its leases are released.
+
+        Args:
+            wait: Whether to wait for the generation to be opened. Otherwise it is opened in a background
+                thread and the previous generation is served meanwhile, so a query on the event loop
+                does not wait for the vector backend and the BM25 index to load.
+        """
+        if self._read_current_mtime() == self._current_mtime:
+            return
+
+        if wait:
+            self._follow()
+            return
+
+        with self._lock:
+            if self._following:
+                return
+            self._following = True
+
+        threading.Thread(target=self._follow_in_background, name="follow-generation", daemon=True).start()
+
+    def prepare(self):
+        """
+        Create a new generation as a copy of the current one.
+        Changes to it are not visible until it is published. Waits while another thread or process
+        prepares a generation, the writer lock is held until the generation is published or discarded.
+
+        Returns:
+            The VectorStore of the new generation.
+        """
+        writer_lock = FileLock(os.path.join(self.locks_dir, WRITER_LOCK_FILENAME))
+        writer_lock.acquire()
+
+        generation = uuid.uuid4().hex
+        generation_dir = os.path.join(self.generations_dir, generation)
+
+        try:
+            # The generation is locked before it exists, so no process collects it while it is copied
+            self._hold_generation(generation)
+            try:
+                self.follow_current()
+                source_dir = os.path.join(self.generations_dir, self.current_generation)
+                if os.path.isdir(source_dir):
+                    copy_generation(source_dir, generation_dir)
+
+                vectorstore = self.open_generation(generation)
+            finally:
+                self._unhold_generation(generation)
+        except BaseException:
+            self._delete_generation(generation)
+            writer_lock.release()
+            raise
+
+        with self._lock:
+            self._writer_locks[generation] = writer_lock
+
+        return vectorstore
+
+    def publish(self, vectorstore):
+        """
+        Make a prepared generation the current one and release the writer lock.
+        The previous generation is deleted once the queries of all processes using it have finished.
+        The prepared VectorStore is closed and the generation is opened again read-only.
+
+        Args:
+            vectorstore: The VectorStore returned by prepare().
+        """
+        generation = os.path.basename(vectorstore.vectorstore_dir)
+
+        # The pointer is replaced atomically, so a restart loads either generation completely
+        tmp_path = self.current_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(generation)
+        os.replace(tmp_path, self.current_path)
+
+        # The generation is served read-only like in the other workers, the writer is closed.
+        # It stays locked while it is opened again.
+        self._hold_generation(generation)
+        try:
+            self._close_generation(generation, vectorstore)
+            vectorstore = self.open_generation(generation, read_only=True)
+        finally:
+            self._unhold_generation(generation)
+
+        with self._follow_lock:
+            self._replace_current(generation, vectorstore)
+            self._current_mtime = self._read_current_mtime()
+
+        self._release_writer_lock(generation)
+        # Also collects the generations of processes that exited without releasing them
+        self.collect_garbage()
+
+        print(f"Vectorstore generation {generation} published")
+
+    def discard(self, vectorstore):
+        """
+        Delete a prepared generation that will not be published and release the writer lock.
+        """
+        generation = os.path.basename(vectorstore.vectorstore_dir)
+
+        self._release_generation(generation, vectorstore)
+        self._release_writer_lock(generation)
+
+    def open_generation(self, generation, read_only=False):
+        """
+        Returns the VectorStore of a generation, holding a shared lock on it until it is released.
+
+        Args:
+            generation: The generation id.
+            read_only: Open the memory-mapped backend read-only, as published generations are only queried.
+        """
+        generation_dir = os.path.join(self.generations_dir, generation)
+
+        self._hold_generation(generation)
+        try:
+            # A generation deleted by another process before it was locked is not recreated empty
+            if read_only and not os.path.isdir(generation_dir):
+                raise FileNotFoundError(f"The vectorstore generation {generation} does not exist")
+
+            return VectorStore(generation_dir, embedding_function=self.embedding_function, read_only=read_only)
+        except BaseException:
+            self._unhold_generation(generation)
+            raise
+
+    def load_current_generation(self):
+        """
+        Read the CURRENT pointer. A vectorstore stored directly in the root directory
+        by earlier versions is moved into the first generation.
+        """
+        if os.path.isfile(self.current_path):
+            return self._read_current_pointer()
+
+        writer_lock = FileLock(os.path.join(self.locks_dir, WRITER_LOCK_FILENAME))
+        writer_lock.acquire()
+        try:
+            # Another process may have moved the vectorstore while this one waited
+            if os.path.isfile(self.current_path):
+                return self._read_current_pointer()
+
+            generation = uuid.uuid4().hex
+            generation_dir = os.path.join(self.generations_dir, generation)
+            os.makedirs(generation_dir)
+
+            for name in os.listdir(self.root_dir):
+                if name not in (GENERATIONS_DIRNAME, LOCKS_DIRNAME, CURRENT_FILENAME):
+                    os.rename(os.path.join(self.root_dir, name), os.path.join(generation_dir, name))
+
+            tmp_path = self.current_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(generation)
+            os.replace(tmp_path, self.current_path)
+        finally:
+            writer_lock.release()
+
+        return generation
+
+    def collect_garbage(self):
+        """
+        Delete the generations that no process uses and that are not current,
+        e.g. left by interrupted ingestions or replaced while another process still served them.
+        """
+        if os.path.isdir(self.generations_dir):
+            for generation in os.listdir(self.generations_dir):
+                self._delete_generation(generation)
+
+        # Locks of generations deleted without their lock file
+        for name in os.listdir(self.locks_dir):
+            generation, extension = os.path.splitext(name)
+            if name != WRITER_LOCK_FILENAME and extension == ".lock" \
+                    and not os.path.isdir(os.path.join(self.generations_dir, generation)):
+                self._delete_generation(generation)
+
+    def _follow(self):
+        with self._follow_lock:
+            mtime = self._read_current_mtime()
+            if mtime is None or mtime == self._current_mtime:
+                return
+
+            generation = self._read_current_pointer()
+            if generation != self.current_generation:
+                self._replace_current(generation, self.open_generation(generation, read_only=True))
+            self._current_mtime = mtime
+
+    def _follow_in_background(self):
+        try:
+            self._follow()
+        except Exception as e:
+            # Retried on the next lease, the previous generation is served meanwhile
+            print(f"Failed to open the published vectorstore generation: {e}")
+        finally:
+            with self._lock:
+                self._following = False
+
+    def _read_current_mtime(self):
+        try:
+            return os.stat(self.current_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _read_current_pointer(self):
+        with open(self.current_path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+
+    def _replace_current(self, generation, vectorstore):
+        with self._lock:
+            previous_generation, previous_vectorstore = self.current_generation, self.current
+            self.current_generation, self.current = generation, vectorstore
+
+            is_leased = previous_generation in self._leases
+            if is_leased:
+                self._retired[previous_generation] = previous_vectorstore
+
+        if not is_leased:
+            self._release_generation(previous_generation, previous_vectorstore)
+
+    def _release_generation(self, generation, vectorstore):
+        # The clients of the backend are closed before its files are deleted,
+        # the files stay if another process still uses the generation
+        self._close_generation(generation, vectorstore)
+        self._delete_generation(generation)
+
+    def _close_generation(self, generation, vectorstore):
+        vectorstore.close()
+        self._unhold_generation(generation)
+
+    def _hold_generation(self, generation):
+        with self._lock:
+            lock, count = self._generation_locks.get(generation, (None, 0))
+            if lock is None:
+                lock = FileLock(self._generation_lock_path(generation))
+                lock.acquire(shared=True)
+            self._generation_locks[generation] = (lock, count + 1)
+
+    def _unhold_generation(self, generation):
+        with self._lock:
+            lock, count = self._generation_locks[generation]
+            if count > 1:
+                self._generation_locks[generation] = (lock, count - 1)
+                return
+            del self._generation_locks[generation]
+
+        lock.release()
+
+    def _delete_generation(self, generation):
+        # Only a generation no process holds can be locked exclusively
+        lock = FileLock(self._generation_lock_path(generation))
+        if not lock.acquire(blocking=False):
+            return
+
+        try:
+            with self._lock:
+                if generation in self._generation_locks:
+                    return
+            if os.path.isfile(self.current_path) and generation == self._read_current_pointer():
+                return
+
+            shutil.rmtree(os.path.join(self.generations_dir, generation), ignore_errors=True)
+            if os.path.exists(lock.path):
+                os.remove(lock.path)
+        finally:
+            lock.release()
+
+    def _release_writer_lock(self, generation):
+        with self._lock:
+            writer_lock = self._writer_locks.pop(generation, None)
+
+        if writer_lock is not None:
+            writer_lock.release()
+
+    def _generation_lock_path(self, generation):
+        return os.path.join(self.locks_dir, f"{generation}.lock")
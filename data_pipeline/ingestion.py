@@ -0,0 +1,226 @@
+import contextvars
+import os
+import queue
+import threading
+import weakref
+
+from data_pipeline.documents_preparation import DEFAULT_CHUNKING, iter_load_documents
+from data_pipeline.metrics import metrics
+
+# Chunks embedded in one call, across files
+INGESTION_EMBEDDING_BATCH_SIZE = int(os.getenv("INGESTION_EMBEDDING_BATCH_SIZE", 256))
+# Items waiting between two stages before the upstream stage blocks
+INGESTION_QUEUE_SIZE = int(os.getenv("INGESTION_QUEUE_SIZE", 4))
+
+_DONE = object()
+
+_running_pipelines = weakref.WeakSet()
+
+
+class PipelineCancelled(Exception):
+    pass
+
+
+class IngestionPipeline:
+    """
+    A class for ingesting files into a vectorstore with overlapping stages:
+
+    parse: a pool of parser processes, at most twice as many files in flight as parsers,
+        chunking the cached elements of files that were parsed before
+    embed: a thread embedding the new chunks in batches that span files
+    write: a thread storing the embedded batches and committing the files to the manifest
+
+    The stages are connected by bounded queues, so a slow stage holds back the ones before it
+    and the memory used does not grow with the number of files. A file is committed after all
+    of its chunks are written, so a failed run leaves no file half updated in the manifest.
+
+    Args:
+        vectorstore: The VectorStore object to update.
+        workers: The number of parser processes.
+        embedding_batch_size: The number of chunks embedded at once.
+        queue_size: The maximum number of items waiting between two stages.
+        chunking: A ChunkingConfig object. Defaults to DEFAULT_CHUNKING.
+    """
+
+    def __init__(
+        self,
+        vectorstore,
+        workers=None,
+        embedding_batch_size=INGESTION_EMBEDDING_BATCH_SIZE,
+        queue_size=INGESTION_QUEUE_SIZE,
+        chunking=None
+    ):
+        self.vectorstore = vectorstore
+        self.workers = workers
+        self.embedding_batch_size = embedding_batch_size
+        self.chunking = chunking or DEFAULT_CHUNKING
+
+        self.parsed_queue = queue.Queue(maxsize=queue_size)
+        self.embedded_queue = queue.Queue(maxsize=queue_size)
+
+        self._stop = threading.Event()
+        self._errors = []
+
+    def run(self, files, on_progress=None):
+        """
+        Parse, embed and store the files.
+
+        Args:
+            files: A list of (filename, file hash, file path or stream) tuples.
+                The file may be None if its elements are cached.
+            on_progress: An optional callback called with the number of finished files.
+
+        Returns:
+            A tuple of a dict with the number of added, deleted and unchanged chunks
+            and a list of dicts with the "filename" and "error" of the files that failed to parse.
+        """
+        stats = {"added": 0, "deleted": 0, "unchanged": 0}
+        failed_files = []
+        progress = {"done": 0}
+        progress_lock = threading.Lock()
+
+        # Called by the parse stage for failed files and by the write stage for committed ones
+        def file_finished():
+            with progress_lock:
+                progress["done"] += 1
+                if on_progress:
+                    on_progress(progress["done"])
+
+        def commit(update):
+            for key, value in self.vectorstore.commit_file_update(update).items():
+                stats[key] += value
+            file_finished()
+
+        # The stage threads record their timings in the context of the caller
+        threads = [
+            threading.Thread(target=contextvars.copy_context().run, args=(self._run_stage, self._embed_stage)),
+            threading.Thread(target=contextvars.copy_context().run, args=(self._run_stage, self._write_stage, commit)),
+        ]
+        for thread in threads:
+            thread.start()
+
+        _running_pipelines.add(self)
+        try:
+            self._run_stage(self._parse_stage, files, failed_files, file_finished)
+        finally:
+            for thread in threads:
+                thread.join()
+            _running_pipelines.discard(self)
+
+        if self._errors:
+            raise self._errors[0]
+
+        return stats, failed_files
+
+    def queue_depths(self):
+        """
+        Returns the number of items waiting in each queue.
+        """
+        return {"parsed": self.parsed_queue.qsize(), "embedded": self.embedded_queue.qsize()}
+
+    def _run_stage(self, stage, *args):
+        try:
+            stage(*args)
+        except PipelineCancelled:
+            pass
+        except BaseException as e:
+            self._errors.append(e)
+            self._stop.set()
+
+    def _parse_stage(self, files, failed_files, file_finished):
+        try:
+            results = iter_load_documents(
+                [file for _, _, file in files],
+                filenames=[filename for filename, _, _ in files],
+                workers=self.workers,
+                file_hashes=[file_hash for _, file_hash, _ in files],
+                chunking=self.chunking
+            )
+            for i, result in results:
+                filename, file_hash, _ = files[i]
+                if result.error is not None:
+                    failed_files.append({"filename": filename, "error": result.error})
+                    file_finished()
+                else:
+                    self._put(self.parsed_queue, (filename, file_hash, result.documents))
+        finally:
+            self._put(self.parsed_queue, _DONE)
+
+    def _embed_stage(self):
+        try:
+            pending_documents = []
+            pending_ids = []
+            # Updates of the files whose new chunks are all pending, committed after the next batch
+            pending_updates = []
+
+            def flush():
+                if pending_documents:
+                    embeddings = self.vectorstore.embed_documents(
+                        [document.page_content for document in pending_documents]
+                    )
+                    self._put(self.embedded_queue, ("batch", list(pending_documents), list(pending_ids), embeddings))
+                    pending_documents.clear()
+                    pending_ids.clear()
+
+                for update in pending_updates:
+                    self._put(self.embedded_queue, ("commit", update))
+                pending_updates.clear()
+
+            while (item := self._get(self.parsed_queue)) is not _DONE:
+                filename, file_hash, documents = item
+                update = self.vectorstore.plan_file_update(
+                    filename, file_hash, documents, chunking=self.chunking._asdict()
+                )
+
+                for document, chunk_id in zip(update.documents_to_add, update.ids_to_add):
+                    pending_documents.append(document)
+                    pending_ids.append(chunk_id)
+                    if len(pending_documents) >= self.embedding_batch_size:
+                        flush()
+
+                pending_updates.append(update)
+
+                # Files without new chunks are committed right away
+                if not pending_documents:
+                    flush()
+
+            flush()
+        finally:
+            self._put(self.embedded_queue, _DONE)
+
+    def _write_stage(self, commit):
+        while (item := self._get(self.embedded_queue)) is not _DONE:
+            if item[0] == "batch":
+                _, documents, ids, embeddings = item
+                self.vectorstore.add_embedded_documents(documents, ids, embeddings)
+            else:
+                commit(item[1])
+
+    def _put(self, target_queue, item):
+        # Blocks while the queue is full, unless a stage failed and the others are stopping
+        while True:
+            if self._stop.is_set():
+                raise PipelineCancelled()
+            try:
+                target_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _get(self, source_queue):
+        while True:
+            if self._stop.is_set():
+                raise PipelineCancelled()
+            try:
+                return source_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+metrics.gauge(
+    "rag_ingestion_queue_depth", "Items waiting between the stages of running ingestion pipelines", ["queue"],
+    callback=lambda: {
+        (name,): sum(pipeline.queue_depths()[name] for pipeline in list(_running_pipelines))
+        for name in ("parsed", "embedded")
+    }
+)
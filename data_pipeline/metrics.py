@@ -0,0 +1,338 @@
+import os
+import resource
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+# Upper bounds of the stage duration buckets in seconds, from a BM25 lookup to a slow LLM call
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Stage durations of the current request or job, see collect_timings
+_request_timings = ContextVar("request_timings", default=None)
+# Tokens of the retrieved context of the current request, see collect_context_tokens
+_request_context_tokens = ContextVar("request_context_tokens", default=None)
+# The stage LLM calls are recorded under, see llm_stage
+_llm_stage = ContextVar("llm_stage", default="llm")
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ""
+
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    Base class of the metrics of a MetricsRegistry, with samples keyed by the values of its labels.
+
+    Args:
+        name: The name of the metric.
+        description: The help text of the metric.
+        labelnames: The names of the labels.
+    """
+
+    type = None
+
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects the labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.type}"]
+        lines += self._render_samples()
+        return lines
+
+    def _render_samples(self):
+        with self._lock:
+            values = dict(self._values)
+
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class Counter(Metric):
+    """
+    A monotonically increasing count.
+    """
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down. Either set explicitly or read by a callback when the metrics are rendered.
+
+    Args:
+        callback: An optional function returning the value, or a dict of label value tuples to values.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name, description, labelnames=(), callback=None):
+        super().__init__(name, description, labelnames)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _render_samples(self):
+        if self.callback is None:
+            return super()._render_samples()
+
+        try:
+            values = self.callback()
+        except Exception:
+            # A component that is not created yet, e.g. during startup
+            return []
+
+        if values is None:
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class Histogram(Metric):
+    """
+    A distribution of observed values in cumulative buckets, with their sum and count.
+
+    Args:
+        buckets: The sorted upper bounds of the buckets.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, description, labelnames=(), buckets=STAGE_BUCKETS):
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * len(self.buckets), 0.0)
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def _render_samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+
+        lines = []
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, {"le": _format_value(float(bound))})
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+
+        return lines
+
+
+class MetricsRegistry:
+    """
+    A set of metrics rendered together in the Prometheus text format.
+    Metrics are created once by name, creating a metric again returns the existing one.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, description, labelnames=()):
+        return self._register(Counter, name, description, labelnames)
+
+    def gauge(self, name, description, labelnames=(), callback=None):
+        return self._register(Gauge, name, description, labelnames, callback=callback)
+
+    def histogram(self, name, description, labelnames=(), buckets=STAGE_BUCKETS):
+        return self._register(Histogram, name, description, labelnames, buckets=buckets)
+
+    def render(self):
+        """
+        Returns all metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric_class, name, description, labelnames, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = metric_class(name, description, labelnames, **kwargs)
+            return self._metrics[name]
+
+
+def get_rss_bytes():
+    """
+    Returns the resident set size of the process, or its peak where the current one is not available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# Process-wide registry exposed by /metrics
+metrics = MetricsRegistry()
+
+stage_seconds = metrics.histogram(
+    "rag_stage_duration_seconds", "Duration of the stages of requests and ingestion jobs", ["stage"]
+)
+llm_tokens = metrics.counter("rag_llm_tokens_total", "Tokens of the LLM calls", ["stage", "kind"])
+context_tokens = metrics.counter(
+    "rag_context_tokens_total", "Tokens of the retrieved documents in answer prompts, packed and saved", ["kind"]
+)
+metrics.gauge("process_resident_memory_bytes", "Resident memory size in bytes", callback=get_rss_bytes)
+
+
+def record_stage(stage, seconds):
+    """
+    Record the duration of a stage in the histogram and in the timings of the current request.
+    """
+    stage_seconds.observe(seconds, stage=stage)
+
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def track_stage(stage):
+    """
+    Measure the duration of the enclosed block as a stage, see record_stage.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+@contextmanager
+def collect_timings():
+    """
+    Collect the total seconds per stage of the enclosed block, including the stages of the tasks it starts
+    and of the functions it runs in the retrieval thread pool. A nested block adds its stages to the outer one.
+
+    Yields:
+        A dict of stage names to seconds, filled as the stages finish.
+    """
+    outer = _request_timings.get()
+    timings = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+        if outer is not None:
+            for stage, seconds in timings.items():
+                outer[stage] = outer.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def collect_context_tokens():
+    """
+    Collect the tokens of the retrieved documents packed into the answer prompts of the enclosed block,
+    the same way as collect_timings.
+
+    Yields:
+        A dict with the number of "retrieved", "packed" and "saved" tokens, empty if no context was packed.
+    """
+    outer = _request_context_tokens.get()
+    counts = {}
+    token = _request_context_tokens.set(counts)
+    try:
+        yield counts
+    finally:
+        _request_context_tokens.reset(token)
+        if outer is not None:
+            for kind, value in counts.items():
+                outer[kind] = outer.get(kind, 0) + value
+
+
+def record_context_tokens(retrieved_tokens, packed_tokens):
+    """
+    Count the tokens of the retrieved documents of an answer prompt before and after packing.
+    """
+    saved_tokens = retrieved_tokens - packed_tokens
+    context_tokens.inc(packed_tokens, kind="packed")
+    # Merged chunks may tokenize slightly differently, the counter only goes up
+    context_tokens.inc(max(0, saved_tokens), kind="saved")
+
+    counts = _request_context_tokens.get()
+    if counts is not None:
+        for kind, value in (("retrieved", retrieved_tokens), ("packed", packed_tokens), ("saved", saved_tokens)):
+            counts[kind] = counts.get(kind, 0) + value
+
+
+@contextmanager
+def llm_stage(stage):
+    """
+    Record the LLM calls of the enclosed block under the given stage name, e.g. "agent_llm".
+    """
+    token = _llm_stage.set(stage)
+    try:
+        yield
+    finally:
+        _llm_stage.reset(token)
+
+
+def get_llm_stage():
+    """
+    Returns the stage name of LLM calls made in the current context.
+    """
+    return _llm_stage.get()
+
+
+def record_llm_tokens(stage, prompt_tokens, completion_tokens):
+    """
+    Count the tokens of an LLM call.
+    """
+    if prompt_tokens:
+        llm_tokens.inc(prompt_tokens, stage=stage, kind="prompt")
+    if completion_tokens:
+        llm_tokens.inc(completion_tokens, stage=stage, kind="completion")
@@ -0,0 +1,21 @@
+"""
+Download the NLTK data and the embedding model into the local caches,
+so the server starts without network access, e.g. while building the image.
+
+Usage:
+    python -m data_pipeline.provision
+"""
+from data_pipeline.documents_preparation import NLTK_DATA_DIR, ensure_nltk_data
+from data_pipeline.embeddings import EMBEDDING_MODEL_NAME, EmbeddingProvider
+
+
+def main():
+    ensure_nltk_data()
+    print(f"NLTK data is available in {NLTK_DATA_DIR}")
+
+    # Without the embedding cache, so no cache file is created
+    EmbeddingProvider(model_name=EMBEDDING_MODEL_NAME).warm_up(num_texts=1)
+
+
+if __name__ == "__main__":
+    main()
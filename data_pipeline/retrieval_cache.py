@@ -0,0 +1,85 @@
+import json
+import threading
+from collections import OrderedDict
+
+
+class RetrievalCache:
+    """
+    A bounded LRU cache of retrieval results.
+
+    Maps (normalized query, k, metadata filter, corpus version) to the ranked chunk ids
+    and their fusion scores, so only the chunk texts have to be fetched on a hit.
+
+    Args:
+        max_entries: The maximum number of cached results.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, query, k, corpus_version, filter=None):
+        """
+        Returns a list of (chunk id, score) tuples or None.
+        """
+        key = self._key(query, k, corpus_version, filter)
+
+        with self._lock:
+            results = self.entries.get(key)
+
+            if results is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return results
+
+    def put(self, query, k, corpus_version, results, filter=None):
+        """
+        Cache a list of (chunk id, score) tuples.
+        """
+        key = self._key(query, k, corpus_version, filter)
+
+        with self._lock:
+            self.entries[key] = list(results)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Remove all cached results.
+        """
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self):
+        """
+        Returns the cache statistics.
+        """
+        requests = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.0,
+            "entries": len(self.entries),
+        }
+
+    def _key(self, query, k, corpus_version, filter):
+        filter_key = json.dumps(filter, sort_keys=True) if filter else None
+        return (self.normalize_query(query), k, filter_key, corpus_version)
+
+    @staticmethod
+    def normalize_query(query):
+        """
+        Lowercase the query and collapse whitespace.
+        """
+        return " ".join(query.lower().split())
@@ -0,0 +1,309 @@
+import json
+import math
+import os
+import re
+import threading
+from array import array
+
+import numpy as np
+
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text):
+    """
+    Split a text into lowercase word tokens.
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    A persistent inverted index with Okapi BM25 scoring.
+
+    Postings of every term are kept in growable int32 arrays of document positions and
+    term frequencies, so documents can be added without rebuilding the index.
+    Removed documents are marked as deleted and dropped from the postings on compaction.
+
+    Args:
+        k1: The term frequency saturation parameter.
+        b: The document length normalization parameter.
+        compaction_ratio: The share of deleted documents that triggers a compaction.
+    """
+
+    # Files written by save, always replaced and never modified in place
+    SHARED_FILES = ("postings.npz", "metadata.json")
+
+    def __init__(self, k1=1.5, b=0.75, compaction_ratio=0.2):
+        self.k1 = k1
+        self.b = b
+        self.compaction_ratio = compaction_ratio
+
+        self.doc_ids = []  # Document position -> document id
+        self.doc_positions = {}  # Document id -> document position
+        self.doc_lengths = array("i")
+        self.alive = array("b")
+        self.num_alive = 0
+        self.total_length = 0
+
+        self.vocabulary = {}  # Term -> term id
+        self.postings_docs = []  # Term id -> array of document positions
+        self.postings_freqs = []  # Term id -> array of term frequencies
+
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return self.num_alive
+
+    def add(self, doc_ids, texts):
+        """
+        Add documents to the index. Documents that are already indexed are skipped.
+
+        Args:
+            doc_ids: A list of document ids.
+            texts: A list of document texts.
+        """
+        with self._lock:
+            for doc_id, text in zip(doc_ids, texts):
+                if doc_id in self.doc_positions:
+                    continue
+
+                position = len(self.doc_ids)
+                tokens = tokenize(text)
+
+                term_frequencies = {}
+                for token in tokens:
+                    term_frequencies[token] = term_frequencies.get(token, 0) + 1
+
+                for term, frequency in term_frequencies.items():
+                    term_id = self.vocabulary.get(term)
+                    if term_id is None:
+                        term_id = len(self.postings_docs)
+                        self.vocabulary[term] = term_id
+                        self.postings_docs.append(array("i"))
+                        self.postings_freqs.append(array("i"))
+
+                    self.postings_docs[term_id].append(position)
+                    self.postings_freqs[term_id].append(frequency)
+
+                self.doc_ids.append(doc_id)
+                self.doc_positions[doc_id] = position
+                self.doc_lengths.append(len(tokens))
+                self.alive.append(1)
+                self.num_alive += 1
+                self.total_length += len(tokens)
+
+    def remove(self, doc_ids):
+        """
+        Remove documents from the index. Unknown ids are ignored.
+        """
+        with self._lock:
+            for doc_id in doc_ids:
+                position = self.doc_positions.pop(doc_id, None)
+                if position is None:
+                    continue
+
+                self.alive[position] = 0
+                self.num_alive -= 1
+                self.total_length -= self.doc_lengths[position]
+
+            num_deleted = len(self.doc_ids) - self.num_alive
+            if num_deleted > 0 and num_deleted >= self.compaction_ratio * len(self.doc_ids):
+                self.compact()
+
+    def clear(self):
+        """
+        Remove all documents from the index.
+        """
+        with self._lock:
+            self.__init__(k1=self.k1, b=self.b, compaction_ratio=self.compaction_ratio)
+
+    def search(self, query, k, allowed_ids=None):
+        """
+        Find the best matching documents for a query.
+
+        Args:
+            query: The query text.
+            k: The number of documents to return.
+            allowed_ids: An optional collection of document ids the search is restricted to.
+
+        Returns:
+            A list of (document id, score) tuples sorted by score.
+        """
+        return self.search_many([query], k, allowed_ids=allowed_ids)[0]
+
+    def search_many(self, queries, k, allowed_ids=None, batch_size=64):
+        """
+        Find the best matching documents for a batch of queries.
+        The postings of a term are scored once for all queries of the batch containing it.
+
+        Args:
+            queries: A list of query texts.
+            k: The number of documents to return per query.
+            allowed_ids: An optional collection of document ids the search is restricted to.
+            batch_size: The number of queries scored at once, bounds the size of the score matrix.
+
+        Returns:
+            A list of lists of (document id, score) tuples sorted by score, one per query.
+        """
+        with self._lock:
+            if self.num_alive == 0:
+                return [[] for _ in queries]
+
+            num_docs = len(self.doc_ids)
+            doc_lengths = np.frombuffer(self.doc_lengths, dtype=np.int32)
+            mask = np.frombuffer(self.alive, dtype=np.int8).astype(bool)
+
+            average_length = self.total_length / self.num_alive
+            length_norm = self.k1 * (1 - self.b + self.b * doc_lengths / max(average_length, 1e-9))
+
+            if allowed_ids is not None:
+                allowed = np.zeros(num_docs, dtype=bool)
+                positions = [self.doc_positions[doc_id] for doc_id in allowed_ids if doc_id in self.doc_positions]
+                allowed[positions] = True
+                mask &= allowed
+
+            results = []
+            for start in range(0, len(queries), batch_size):
+                batch = queries[start:start + batch_size]
+
+                # Term -> rows of the queries of the batch containing it
+                term_rows = {}
+                for row, query in enumerate(batch):
+                    for term in set(tokenize(query)):
+                        term_rows.setdefault(term, []).append(row)
+
+                scores = np.zeros((len(batch), num_docs), dtype=np.float32)
+                for term, rows in term_rows.items():
+                    term_id = self.vocabulary.get(term)
+                    if term_id is None:
+                        continue
+
+                    docs = np.frombuffer(self.postings_docs[term_id], dtype=np.int32)
+                    freqs = np.frombuffer(self.postings_freqs[term_id], dtype=np.int32)
+
+                    # Deleted documents are counted until the next compaction
+                    doc_frequency = len(docs)
+                    idf = math.log((num_docs - doc_frequency + 0.5) / (doc_frequency + 0.5) + 1)
+
+                    term_scores = idf * freqs * (self.k1 + 1) / (freqs + length_norm[docs])
+                    scores[np.array(rows)[:, None], docs[None, :]] += term_scores[None, :]
+
+                for row_scores in scores:
+                    candidates = np.flatnonzero(mask & (row_scores > 0))
+                    if len(candidates) > k:
+                        candidates = candidates[np.argpartition(-row_scores[candidates], k - 1)[:k]]
+                    candidates = candidates[np.argsort(-row_scores[candidates], kind="stable")]
+
+                    results.append([(self.doc_ids[position], float(row_scores[position])) for position in candidates])
+
+            return results
+
+    def compact(self):
+        """
+        Drop the deleted documents from the postings and renumber the remaining ones.
+        """
+        with self._lock:
+            alive = np.frombuffer(self.alive, dtype=np.int8).astype(bool)
+            new_positions = np.cumsum(alive, dtype=np.int32) - 1
+
+            for term_id in range(len(self.postings_docs)):
+                docs = np.frombuffer(self.postings_docs[term_id], dtype=np.int32)
+                freqs = np.frombuffer(self.postings_freqs[term_id], dtype=np.int32)
+                keep = alive[docs]
+
+                self.postings_docs[term_id] = array("i", new_positions[docs[keep]].tobytes())
+                self.postings_freqs[term_id] = array("i", freqs[keep].tobytes())
+
+            self.doc_ids = [doc_id for doc_id, is_alive in zip(self.doc_ids, alive) if is_alive]
+            self.doc_positions = {doc_id: position for position, doc_id in enumerate(self.doc_ids)}
+            self.doc_lengths = array("i", np.frombuffer(self.doc_lengths, dtype=np.int32)[alive].tobytes())
+            self.alive = array("b", [1] * len(self.doc_ids))
+
+    def save(self, index_dir):
+        """
+        Write the index to a directory. Postings are stored in a compressed sparse row layout.
+
+        Args:
+            index_dir: The directory of the index files.
+        """
+        with self._lock:
+            os.makedirs(index_dir, exist_ok=True)
+
+            offsets = np.zeros(len(self.postings_docs) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(docs) for docs in self.postings_docs])
+
+            postings_docs = np.frombuffer(b"".join(docs.tobytes() for docs in self.postings_docs), dtype=np.int32)
+            postings_freqs = np.frombuffer(b"".join(freqs.tobytes() for freqs in self.postings_freqs), dtype=np.int32)
+
+            arrays_path = os.path.join(index_dir, "postings.npz")
+            with open(arrays_path + ".tmp", "wb") as f:
+                np.savez(
+                    f,
+                    offsets=offsets,
+                    postings_docs=postings_docs,
+                    postings_freqs=postings_freqs,
+                    doc_lengths=np.frombuffer(self.doc_lengths, dtype=np.int32),
+                    alive=np.frombuffer(self.alive, dtype=np.int8),
+                )
+
+            metadata_path = os.path.join(index_dir, "metadata.json")
+            with open(metadata_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({
+                    "k1": self.k1,
+                    "b": self.b,
+                    "terms": list(self.vocabulary),
+                    "doc_ids": self.doc_ids,
+                }, f)
+
+            os.replace(arrays_path + ".tmp", arrays_path)
+            os.replace(metadata_path + ".tmp", metadata_path)
+
+    @classmethod
+    def load(cls, index_dir, compaction_ratio=0.2):
+        """
+        Load an index from a directory.
+
+        Args:
+            index_dir: The directory of the index files.
+
+        Returns:
+            A BM25Index object, or None if the directory does not contain an index.
+        """
+        arrays_path = os.path.join(index_dir, "postings.npz")
+        metadata_path = os.path.join(index_dir, "metadata.json")
+
+        if not (os.path.isfile(arrays_path) and os.path.isfile(metadata_path)):
+            return None
+
+        with open(metadata_path, "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+        arrays = np.load(arrays_path)
+
+        index = cls(k1=metadata["k1"], b=metadata["b"], compaction_ratio=compaction_ratio)
+
+        offsets = arrays["offsets"]
+        postings_docs = arrays["postings_docs"]
+        postings_freqs = arrays["postings_freqs"]
+
+        index.vocabulary = {term: term_id for term_id, term in enumerate(metadata["terms"])}
+        index.postings_docs = [
+            array("i", postings_docs[offsets[i]:offsets[i + 1]].tobytes()) for i in range(len(offsets) - 1)
+        ]
+        index.postings_freqs = [
+            array("i", postings_freqs[offsets[i]:offsets[i + 1]].tobytes()) for i in range(len(offsets) - 1)
+        ]
+
+        index.doc_ids = metadata["doc_ids"]
+        index.doc_lengths = array("i", arrays["doc_lengths"].tobytes())
+        index.alive = array("b", arrays["alive"].tobytes())
+
+        alive = arrays["alive"].astype(bool)
+        index.doc_positions = {
+            doc_id: position for position, doc_id in enumerate(index.doc_ids) if alive[position]
+        }
+        index.num_alive = int(alive.sum())
+        index.total_length = int(arrays["doc_lengths"][alive].sum())
+
+        return index
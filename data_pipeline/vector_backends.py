@@ -0,0 +1,897 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+
+# The IVF index is trained once the store has this many vectors, brute force is fast enough below it
+IVF_MIN_SIZE = 4096
+
+
+def matches_filter(metadata, where):
+    """
+    Check whether metadata matches a Chroma style filter.
+    Supports equality, $eq, $ne, $in, $nin, $and and $or.
+
+    Args:
+        metadata: A metadata dictionary.
+        where: A filter, e.g. {"filename": "report.pdf"} or {"filename": {"$in": ["a.pdf", "b.pdf"]}}.
+    """
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, sub_filter) for sub_filter in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_filter(metadata, sub_filter) for sub_filter in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for operator, operand in condition.items():
+                if operator == "$eq" and value != operand:
+                    return False
+                if operator == "$ne" and value == operand:
+                    return False
+                if operator == "$in" and value not in operand:
+                    return False
+                if operator == "$nin" and value in operand:
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+
+    return True
+
+
+class VectorBackend(ABC):
+    """
+    Storage of chunk embeddings, texts and metadata used by VectorStore.
+    Distances are squared L2 distances, lower is closer.
+    """
+
+    @abstractmethod
+    def add(self, ids, embeddings, texts, metadatas):
+        """
+        Add or replace chunks.
+        """
+
+    @abstractmethod
+    def delete(self, ids):
+        """
+        Delete chunks by ids. Unknown ids are ignored.
+        """
+
+    @abstractmethod
+    def update_metadata(self, ids, metadatas):
+        """
+        Replace the metadata of stored chunks, keeping their embeddings and texts. Unknown ids are ignored.
+        """
+
+    @abstractmethod
+    def get(self, ids):
+        """
+        Returns a list of (id, text, metadata) tuples of the found chunks.
+        """
+
+    @abstractmethod
+    def get_ids(self, where=None):
+        """
+        Returns the ids of the chunks matching a metadata filter, or all ids.
+        """
+
+    @abstractmethod
+    def get_all_texts(self):
+        """
+        Returns a tuple of lists of all ids and texts.
+        """
+
+    @abstractmethod
+    def query(self, embedding, k, where=None):
+        """
+        Returns a list of (id, distance) tuples of the nearest chunks, nearest first.
+        """
+
+    def query_many(self, embeddings, k, where=None):
+        """
+        Returns a list of query results, one per embedding. Backends override it to search the batch at once.
+        """
+        return [self.query(embedding, k, where=where) for embedding in embeddings]
+
+    @abstractmethod
+    def count(self):
+        """
+        Returns the number of stored chunks.
+        """
+
+    @abstractmethod
+    def clear(self):
+        """
+        Delete all chunks.
+        """
+
+    def close(self):
+        """
+        Release the files and clients of the backend. It must not be used afterwards.
+        """
+
+
+class ChromaBackend(VectorBackend):
+    """
+    A backend storing chunks in a persistent ChromaDB collection.
+
+    Args:
+        directory: The persist directory of ChromaDB.
+        collection_name: The name of the collection, the LangChain default by default.
+        batch_size: The maximum number of items per ChromaDB call.
+    """
+
+    def __init__(self, directory, collection_name="langchain", batch_size=5000):
+        import chromadb
+
+        self.directory = directory
+        self.collection_name = collection_name
+        self.batch_size = batch_size
+        self.client = chromadb.PersistentClient(path=directory)
+        self.collection = self.client.get_or_create_collection(collection_name, embedding_function=None)
+
+    def add(self, ids, embeddings, texts, metadatas):
+        for i in range(0, len(ids), self.batch_size):
+            self.collection.upsert(
+                ids=ids[i:i + self.batch_size],
+                embeddings=[list(map(float, embedding)) for embedding in embeddings[i:i + self.batch_size]],
+                documents=texts[i:i + self.batch_size],
+                metadatas=metadatas[i:i + self.batch_size]
+            )
+
+    def delete(self, ids):
+        for i in range(0, len(ids), self.batch_size):
+            self.collection.delete(ids=ids[i:i + self.batch_size])
+
+    def update_metadata(self, ids, metadatas):
+        for i in range(0, len(ids), self.batch_size):
+            self.collection.update(ids=ids[i:i + self.batch_size], metadatas=metadatas[i:i + self.batch_size])
+
+    def get(self, ids):
+        found = self.collection.get(ids=list(ids), include=["documents", "metadatas"])
+        return list(zip(found["ids"], found["documents"], found["metadatas"]))
+
+    def get_ids(self, where=None):
+        return self.collection.get(where=where, include=[])["ids"]
+
+    def get_all_texts(self):
+        found = self.collection.get(include=["documents"])
+        return found["ids"], found["documents"]
+
+    def query(self, embedding, k, where=None):
+        count = self.collection.count()
+        if count == 0:
+            return []
+
+        results = self.collection.query(
+            query_embeddings=[list(map(float, embedding))],
+            n_results=min(k, count),
+            where=where,
+            include=["distances"]
+        )
+
+        return list(zip(results["ids"][0], results["distances"][0]))
+
+    def query_many(self, embeddings, k, where=None):
+        count = self.collection.count()
+        if count == 0:
+            return [[] for _ in embeddings]
+
+        results = []
+        for i in range(0, len(embeddings), self.batch_size):
+            found = self.collection.query(
+                query_embeddings=[list(map(float, embedding)) for embedding in embeddings[i:i + self.batch_size]],
+                n_results=min(k, count),
+                where=where,
+                include=["distances"]
+            )
+            results.extend(list(zip(ids, distances)) for ids, distances in zip(found["ids"], found["distances"]))
+
+        return results
+
+    def count(self):
+        return self.collection.count()
+
+    def clear(self):
+        self.client.delete_collection(self.collection_name)
+        self.collection = self.client.get_or_create_collection(self.collection_name, embedding_function=None)
+
+    def close(self):
+        from chromadb.api.client import SharedSystemClient
+
+        # chromadb keeps the system of a path for the life of the process, unless it is removed from its cache
+        system = self.client._system
+        systems = getattr(SharedSystemClient, "_identifer_to_system", {})
+        for identifier, shared_system in list(systems.items()):
+            if shared_system is system:
+                del systems[identifier]
+        system.stop()
+
+
+class MmapVectorBackend(VectorBackend):
+    """
+    A backend keeping embeddings in memory-mapped files with an optional IVF index.
+
+    Vectors are stored as float32 or int8 with a per-vector scale, texts and metadata in SQLite.
+    The files are mapped without copying at startup, so several processes opened with
+    read_only=True share the same pages. Read-only instances reopen the files when
+    the writer publishes a new version.
+
+    Once the store reaches IVF_MIN_SIZE vectors, they are clustered with k-means into nlist lists
+    and a query only scans the vectors of the nprobe nearest lists.
+
+    New rows are only appended to the array files and existing rows are rewritten after _unshare,
+    so the array files can be hardlinked from another copy of the store, see SHARED_FILES.
+
+    The id and the file name of every row are stored in memory-mapped columns next to the vectors,
+    so queries and filters on the file name do not read SQLite. The file names are stored once
+    in the header and referenced by their position. Filters on other metadata keys are checked
+    against the metadata in SQLite.
+
+    Args:
+        directory: The directory of the files.
+        quantization: "float32" or "int8".
+        nlist: The number of IVF lists. Defaults to the square root of the number of vectors.
+        nprobe: The number of IVF lists scanned per query.
+        read_only: Open the files without write access.
+    """
+
+    # Files that are only appended to or replaced atomically, safe to hardlink into a copy of the store
+    SHARED_FILES = (
+        "index.json", "centroids.npy", "vectors.bin", "norms.bin", "alive.bin", "assignments.bin", "scales.bin",
+        "ids.bin", "filenames.bin"
+    )
+    # The metadata key stored in the filenames column
+    FILENAME_KEY = "filename"
+    # The maximum length of a chunk id in bytes, a SHA-256 hex digest
+    ID_WIDTH = 64
+
+    def __init__(self, directory, quantization="float32", nlist=None, nprobe=8, read_only=False):
+        if quantization not in ("float32", "int8"):
+            raise ValueError(f"Unknown quantization: {quantization}")
+
+        self.directory = directory
+        self.quantization = quantization
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.read_only = read_only
+
+        self.header_path = os.path.join(directory, "index.json")
+        self.database_path = os.path.join(directory, "documents.sqlite3")
+
+        self._lock = threading.RLock()
+        self._header = None
+        self._header_mtime = None
+        self._arrays = {}
+        self._centroids = None
+        self._lists = None
+        self._connection = None
+        self._filename_codes = {}  # File name -> its position in the header, the value of the filenames column
+
+        if not read_only:
+            os.makedirs(directory, exist_ok=True)
+        self._open()
+
+    def add(self, ids, embeddings, texts, metadatas):
+        if len(ids) == 0:
+            return
+        self._check_writable()
+
+        encoded_ids = [chunk_id.encode("utf-8") for chunk_id in ids]
+        if max(len(chunk_id) for chunk_id in encoded_ids) > self.ID_WIDTH:
+            raise ValueError(f"Chunk ids longer than {self.ID_WIDTH} bytes are not supported")
+
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+
+        with self._lock:
+            if self._header is None:
+                self._create(embeddings.shape[1])
+
+            self.delete(ids)
+
+            start = self._header["size"]
+            end = start + len(ids)
+            self._ensure_capacity(end)
+
+            self._write_vectors(start, embeddings)
+            self._arrays["norms"][start:end] = np.einsum("ij,ij->i", embeddings, embeddings)
+            self._arrays["alive"][start:end] = 1
+            self._arrays["ids"][start:end] = encoded_ids
+            self._arrays["filenames"][start:end] = [self._get_filename_code(metadata) for metadata in metadatas]
+
+            if self._centroids is not None:
+                self._arrays["assignments"][start:end] = self._nearest_centroids(embeddings, 1)[:, 0]
+            else:
+                self._arrays["assignments"][start:end] = -1
+
+            self._connection.executemany(
+                "INSERT INTO chunks (id, row, text, metadata) VALUES (?, ?, ?, ?)",
+                [
+                    (chunk_id, start + i, text, json.dumps(metadata or {}))
+                    for i, (chunk_id, text, metadata) in enumerate(zip(ids, texts, metadatas))
+                ]
+            )
+            self._connection.commit()
+
+            self._header["size"] = end
+            self._lists = None
+
+            if self._should_train():
+                self.build_index()
+            else:
+                self._publish()
+
+    def delete(self, ids):
+        if len(ids) == 0 or self._header is None:
+            return
+        self._check_writable()
+
+        with self._lock:
+            rows = []
+            for i in range(0, len(ids), 500):
+                batch = list(ids[i:i + 500])
+                placeholders = ",".join("?" * len(batch))
+                rows += [row for (row,) in self._connection.execute(
+                    f"SELECT row FROM chunks WHERE id IN ({placeholders})", batch
+                )]
+                self._connection.execute(f"DELETE FROM chunks WHERE id IN ({placeholders})", batch)
+            self._connection.commit()
+
+            if rows:
+                self._unshare(["alive"])
+                self._arrays["alive"][rows] = 0
+                self._publish()
+
+    def update_metadata(self, ids, metadatas):
+        if len(ids) == 0 or self._header is None:
+            return
+        self._check_writable()
+
+        with self._lock:
+            rows_by_id = {}
+            for i in range(0, len(ids), 500):
+                batch = list(ids[i:i + 500])
+                placeholders = ",".join("?" * len(batch))
+                rows_by_id.update(self._connection.execute(
+                    f"SELECT id, row FROM chunks WHERE id IN ({placeholders})", batch
+                ).fetchall())
+
+            self._connection.executemany(
+                "UPDATE chunks SET metadata = ? WHERE id = ?",
+                [(json.dumps(metadata or {}), chunk_id) for chunk_id, metadata in zip(ids, metadatas)]
+            )
+            self._connection.commit()
+
+            changed = [
+                (rows_by_id[chunk_id], code)
+                for chunk_id, code in zip(ids, map(self._get_filename_code, metadatas))
+                if chunk_id in rows_by_id and self._arrays["filenames"][rows_by_id[chunk_id]] != code
+            ]
+            if changed:
+                self._unshare(["filenames"])
+                for row, code in changed:
+                    self._arrays["filenames"][row] = code
+            self._publish()
+
+    def get(self, ids):
+        self._refresh()
+
+        found = {}
+        for i in range(0, len(ids), 500):
+            batch = list(ids[i:i + 500])
+            placeholders = ",".join("?" * len(batch))
+            with self._lock:
+                rows = self._connection.execute(
+                    f"SELECT id, text, metadata FROM chunks WHERE id IN ({placeholders})", batch
+                ).fetchall()
+            for chunk_id, text, metadata in rows:
+                found[chunk_id] = (chunk_id, text, json.loads(metadata))
+
+        return [found[chunk_id] for chunk_id in ids if chunk_id in found]
+
+    def get_ids(self, where=None):
+        self._refresh()
+
+        with self._lock:
+            if self._header is None:
+                return []
+            size = self._header["size"]
+            arrays = dict(self._arrays)
+            filename_codes = self._filename_codes
+
+        rows = self._filter_rows(where, size, arrays, filename_codes)
+        return self._decode_ids(arrays["ids"][rows])
+
+    def get_all_texts(self):
+        self._refresh()
+        with self._lock:
+            rows = self._connection.execute("SELECT id, text FROM chunks ORDER BY row").fetchall()
+        return [chunk_id for chunk_id, _ in rows], [text for _, text in rows]
+
+    def query(self, embedding, k, where=None):
+        self._refresh()
+
+        with self._lock:
+            if self._header is None or self._header["size"] == 0:
+                return []
+
+            size = self._header["size"]
+            arrays = dict(self._arrays)
+            centroids = self._centroids
+            lists = self._get_lists()
+            filename_codes = self._filename_codes
+
+        query = np.asarray(embedding, dtype=np.float32)
+        allowed_rows = self._filter_rows(where, size, arrays, filename_codes) if where else None
+
+        if centroids is not None:
+            nearest_lists = self._nearest_centroids(query[None, :], min(self.nprobe, len(centroids)), centroids)[0]
+            rows = np.concatenate([lists.get(int(list_id), np.empty(0, dtype=np.int64)) for list_id in nearest_lists]
+                                  + [lists.get(-1, np.empty(0, dtype=np.int64))])
+            rows = rows[arrays["alive"][rows].astype(bool)]
+
+            if allowed_rows is not None:
+                rows = rows[np.isin(rows, allowed_rows)]
+                # The nearest lists hold too few matching chunks, all matching chunks are searched
+                if len(rows) < min(k, len(allowed_rows)):
+                    rows = allowed_rows
+
+            dots = self._dot(arrays["vectors"][rows], arrays, query, rows)
+        elif allowed_rows is not None:
+            rows = allowed_rows
+            dots = self._dot(arrays["vectors"][rows], arrays, query, rows)
+        else:
+            # Brute force over the mapped vectors without copying them
+            dots = self._dot(arrays["vectors"][:size], arrays, query)
+            rows = np.flatnonzero(arrays["alive"][:size])
+            dots = dots[rows]
+
+        if len(rows) == 0:
+            return []
+
+        distances = arrays["norms"][rows] - 2 * dots + float(query @ query)
+
+        k = min(k, len(rows))
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top], kind="stable")]
+
+        return list(zip(self._decode_ids(arrays["ids"][rows[top]]), map(float, distances[top])))
+
+    def query_many(self, embeddings, k, where=None):
+        self._refresh()
+
+        with self._lock:
+            if self._header is None or self._header["size"] == 0:
+                return [[] for _ in embeddings]
+
+            size = self._header["size"]
+            arrays = dict(self._arrays)
+            centroids = self._centroids
+            filename_codes = self._filename_codes
+
+        if centroids is not None:
+            # Every query probes its own lists
+            return super().query_many(embeddings, k, where=where)
+
+        queries = np.asarray(embeddings, dtype=np.float32)
+
+        if where:
+            rows = self._filter_rows(where, size, arrays, filename_codes)
+        else:
+            rows = np.flatnonzero(arrays["alive"][:size])
+        if len(rows) == 0:
+            return [[] for _ in embeddings]
+
+        # One matrix product over the mapped vectors for the whole batch
+        dots = self._dot(arrays["vectors"][:size], arrays, queries.T)[rows]
+        distances = (
+            np.asarray(arrays["norms"][rows])[:, None]
+            - 2 * dots
+            + np.einsum("ij,ij->i", queries, queries)[None, :]
+        )
+
+        k = min(k, len(rows))
+        top = np.argpartition(distances, k - 1, axis=0)[:k]
+        top = np.take_along_axis(top, np.take_along_axis(distances, top, axis=0).argsort(axis=0, kind="stable"), axis=0)
+
+        positions = rows[top]
+        ids = np.array(self._decode_ids(arrays["ids"][positions.ravel()]), dtype=object).reshape(positions.shape)
+
+        return [
+            [(ids[i, column], float(distances[top[i, column], column])) for i in range(k)]
+            for column in range(len(queries))
+        ]
+
+    def count(self):
+        self._refresh()
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def clear(self):
+        self._check_writable()
+
+        with self._lock:
+            self._close()
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.makedirs(self.directory, exist_ok=True)
+            self._open()
+
+    def build_index(self):
+        """
+        Train the IVF lists with k-means over the stored vectors and assign every vector to a list.
+        Deleted vectors are dropped by rewriting the files.
+        """
+        self._check_writable()
+
+        with self._lock:
+            # Compaction and the new assignments rewrite existing rows
+            self._unshare(list(self._array_specs()))
+            self._compact()
+
+            size = self._header["size"]
+            if size == 0:
+                return
+
+            nlist = self.nlist or max(1, int(np.sqrt(size)))
+            vectors = self._read_vectors(0, size)
+
+            # Train on a sample, assign all vectors afterwards
+            rng = np.random.default_rng(0)
+            sample = vectors[rng.choice(size, size=min(size, nlist * 64), replace=False)]
+            centroids = sample[rng.choice(len(sample), size=min(nlist, len(sample)), replace=False)].copy()
+
+            for _ in range(10):
+                assignments = self._nearest_centroids(sample, 1, centroids)[:, 0]
+                for list_id in range(len(centroids)):
+                    members = sample[assignments == list_id]
+                    if len(members) > 0:
+                        centroids[list_id] = members.mean(axis=0)
+
+            self._centroids = centroids
+            centroids_path = os.path.join(self.directory, "centroids.npy")
+            with open(centroids_path + ".tmp", "wb") as f:
+                np.save(f, centroids)
+            os.replace(centroids_path + ".tmp", centroids_path)
+
+            for start in range(0, size, 65536):
+                end = min(start + 65536, size)
+                self._arrays["assignments"][start:end] = self._nearest_centroids(vectors[start:end], 1)[:, 0]
+
+            self._header["trained_size"] = size
+            self._lists = None
+            self._publish()
+
+    def _should_train(self):
+        size = self._header["size"]
+        if size < IVF_MIN_SIZE:
+            return False
+
+        # Retrain when the store doubled since the last training
+        return size >= 2 * self._header.get("trained_size", 0)
+
+    def _dot(self, vectors, arrays, query, rows=None):
+        if self.quantization == "int8":
+            scales = arrays["scales"][rows] if rows is not None else arrays["scales"][:len(vectors)]
+            # A matrix of queries has one column per query
+            return (vectors @ query) * (scales if query.ndim == 1 else scales[:, None])
+        return vectors @ query
+
+    def _nearest_centroids(self, vectors, n, centroids=None):
+        centroids = self._centroids if centroids is None else centroids
+        distances = (
+            np.einsum("ij,ij->i", centroids, centroids)[None, :]
+            - 2 * vectors @ centroids.T
+        )
+        if n >= centroids.shape[0]:
+            return np.argsort(distances, axis=1)
+        nearest = np.argpartition(distances, n - 1, axis=1)[:, :n]
+        order = np.take_along_axis(distances, nearest, axis=1).argsort(axis=1)
+        return np.take_along_axis(nearest, order, axis=1)
+
+    def _get_lists(self):
+        if self._lists is None and self._centroids is not None:
+            size = self._header["size"]
+            assignments = np.asarray(self._arrays["assignments"][:size])
+            order = np.argsort(assignments, kind="stable")
+            list_ids, starts = np.unique(assignments[order], return_index=True)
+            ends = list(starts[1:]) + [size]
+            self._lists = {int(list_id): order[start:end] for list_id, start, end in zip(list_ids, starts, ends)}
+
+        return self._lists
+
+    def _filter_rows(self, where, size, arrays, filename_codes):
+        """
+        Returns the live rows matching a metadata filter, all live rows without a filter.
+        """
+        mask = arrays["alive"][:size].astype(bool)
+        if not where:
+            return np.flatnonzero(mask)
+
+        filename_mask = self._match_filenames(where, arrays["filenames"][:size], filename_codes)
+        if filename_mask is not None:
+            return np.flatnonzero(mask & filename_mask)
+
+        # Filters on other metadata keys are checked against the metadata in SQLite
+        with self._lock:
+            rows = self._connection.execute("SELECT row, metadata FROM chunks WHERE row < ?", (size,)).fetchall()
+        allowed = np.zeros(size, dtype=bool)
+        allowed[[row for row, metadata in rows if matches_filter(json.loads(metadata), where)]] = True
+
+        return np.flatnonzero(mask & allowed)
+
+    def _match_filenames(self, where, codes, filename_codes):
+        # A mask of the rows matching a filter on the file name only, None if it has other conditions
+        mask = np.ones(len(codes), dtype=bool)
+
+        for key, condition in where.items():
+            if key in ("$and", "$or"):
+                sub_masks = [self._match_filenames(sub_filter, codes, filename_codes) for sub_filter in condition]
+                if any(sub_mask is None for sub_mask in sub_masks):
+                    return None
+
+                combined = np.full(len(codes), key == "$and")
+                for sub_mask in sub_masks:
+                    combined = combined & sub_mask if key == "$and" else combined | sub_mask
+                mask &= combined
+            elif key == self.FILENAME_KEY:
+                condition = condition if isinstance(condition, dict) else {"$eq": condition}
+                for operator, operand in condition.items():
+                    if operator in ("$eq", "$ne"):
+                        matches = codes == self._lookup_filename_code(operand, filename_codes)
+                    elif operator in ("$in", "$nin"):
+                        matches = np.isin(codes, [self._lookup_filename_code(value, filename_codes) for value in operand])
+                    else:
+                        return None
+                    mask &= ~matches if operator in ("$ne", "$nin") else matches
+            else:
+                return None
+
+        return mask
+
+    @staticmethod
+    def _lookup_filename_code(filename, filename_codes):
+        # Chunks without a file name have -1, names that are not stored match no chunk
+        return -1 if filename is None else filename_codes.get(filename, -2)
+
+    def _get_filename_code(self, metadata):
+        filename = (metadata or {}).get(self.FILENAME_KEY)
+        if not isinstance(filename, str):
+            return -1
+
+        code = self._filename_codes.get(filename)
+        if code is None:
+            code = len(self._header["filenames"])
+            self._header["filenames"].append(filename)
+            self._filename_codes[filename] = code
+
+        return code
+
+    @staticmethod
+    def _decode_ids(values):
+        return [value.decode("utf-8") for value in values]
+
+    def _write_vectors(self, start, embeddings):
+        end = start + len(embeddings)
+        if self.quantization == "int8":
+            scales = np.abs(embeddings).max(axis=1) / 127
+            scales[scales == 0] = 1
+            self._arrays["vectors"][start:end] = np.round(embeddings / scales[:, None]).astype(np.int8)
+            self._arrays["scales"][start:end] = scales
+        else:
+            self._arrays["vectors"][start:end] = embeddings
+
+    def _read_vectors(self, start, end):
+        vectors = np.asarray(self._arrays["vectors"][start:end], dtype=np.float32)
+        if self.quantization == "int8":
+            vectors = vectors * self._arrays["scales"][start:end, None]
+        return vectors
+
+    def _array_specs(self):
+        dim = self._header["dim"]
+        specs = {
+            "vectors": (np.int8 if self.quantization == "int8" else np.float32, (dim,)),
+            "norms": (np.float32, ()),
+            "alive": (np.uint8, ()),
+            "assignments": (np.int32, ()),
+        }
+        if self.quantization == "int8":
+            specs["scales"] = (np.float32, ())
+        specs["ids"] = (f"S{self.ID_WIDTH}", ())
+        specs["filenames"] = (np.int32, ())
+        return specs
+
+    def _open(self):
+        if os.path.isfile(self.header_path):
+            with open(self.header_path, "r", encoding="utf-8") as f:
+                self._header = json.load(f)
+            self._header_mtime = os.stat(self.header_path).st_mtime_ns
+
+            if self._header["quantization"] != self.quantization:
+                raise ValueError(
+                    f"The store uses {self._header['quantization']} vectors, not {self.quantization}"
+                )
+
+            # Stores of earlier versions have no id and filename columns, they are filled from SQLite
+            missing_columns = "filenames" not in self._header
+            if missing_columns:
+                self._header["filenames"] = []
+            self._filename_codes = {filename: code for code, filename in enumerate(self._header["filenames"])}
+
+            self._map_arrays()
+
+            centroids_path = os.path.join(self.directory, "centroids.npy")
+            self._centroids = np.load(centroids_path) if os.path.isfile(centroids_path) else None
+        else:
+            self._header = None
+            missing_columns = False
+
+        if self.read_only:
+            if os.path.isfile(self.database_path):
+                self._connection = sqlite3.connect(
+                    f"file:{self.database_path}?mode=ro", uri=True, check_same_thread=False
+                )
+            else:
+                self._connection = sqlite3.connect(":memory:", check_same_thread=False)
+                self._create_table()
+        else:
+            self._connection = sqlite3.connect(self.database_path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._create_table()
+
+        if missing_columns:
+            self._fill_columns()
+
+    def _fill_columns(self):
+        for chunk_id, row, metadata in self._connection.execute("SELECT id, row, metadata FROM chunks"):
+            self._arrays["ids"][row] = chunk_id.encode("utf-8")
+            self._arrays["filenames"][row] = self._get_filename_code(json.loads(metadata))
+
+        if not self.read_only:
+            self._publish()
+
+    def _close(self):
+        self._arrays = {}
+        self._lists = None
+        self._centroids = None
+        self._filename_codes = {}
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _refresh(self):
+        # Read-only instances follow the versions published by the writer
+        if not self.read_only or not os.path.isfile(self.header_path):
+            return
+
+        mtime = os.stat(self.header_path).st_mtime_ns
+        if mtime != self._header_mtime:
+            with self._lock:
+                self._close()
+                self._open()
+
+    def _create(self, dim):
+        self._header = {
+            "dim": int(dim),
+            "quantization": self.quantization,
+            "size": 0,
+            "capacity": 0,
+            "filenames": [],
+        }
+        self._ensure_capacity(1024)
+
+    def _create_table(self):
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, row INTEGER NOT NULL, text TEXT, metadata TEXT)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS chunks_row ON chunks (row)")
+        self._connection.commit()
+
+    def _ensure_capacity(self, required):
+        capacity = self._header["capacity"]
+        if required <= capacity:
+            return
+
+        new_capacity = max(required, 2 * capacity, 1024)
+
+        # Growing a file keeps its content, the arrays are mapped again with the new size
+        self._arrays = {}
+        for name, (dtype, shape) in self._array_specs().items():
+            path = os.path.join(self.directory, f"{name}.bin")
+            item_size = np.dtype(dtype).itemsize * int(np.prod(shape))
+            with open(path, "ab") as f:
+                f.truncate(new_capacity * item_size)
+
+        self._header["capacity"] = new_capacity
+        self._map_arrays()
+
+    def _map_arrays(self):
+        mode = "r" if self.read_only else "r+"
+        capacity = self._header["capacity"]
+
+        self._arrays = {}
+        for name, (dtype, shape) in self._array_specs().items():
+            path = os.path.join(self.directory, f"{name}.bin")
+
+            # The columns missing from stores of earlier versions are created, or kept in memory if read-only
+            if not os.path.isfile(path):
+                if self.read_only:
+                    self._arrays[name] = np.zeros((capacity, *shape), dtype=dtype)
+                    continue
+                with open(path, "wb") as f:
+                    f.truncate(capacity * np.dtype(dtype).itemsize * int(np.prod(shape)))
+
+            self._arrays[name] = np.memmap(path, dtype=dtype, mode=mode, shape=(capacity, *shape))
+
+    def _compact(self):
+        size = self._header["size"]
+        alive = np.flatnonzero(self._arrays["alive"][:size])
+        if len(alive) == size:
+            return
+
+        new_positions = np.full(size, -1, dtype=np.int64)
+        new_positions[alive] = np.arange(len(alive))
+
+        for array in self._arrays.values():
+            array[:len(alive)] = array[alive]
+        self._arrays["alive"][len(alive):size] = 0
+
+        self._connection.executemany(
+            "UPDATE chunks SET row = ? WHERE row = ?",
+            [(int(new_positions[row]), int(row)) for row in alive if new_positions[row] != row]
+        )
+        self._connection.commit()
+
+        self._header["size"] = len(alive)
+
+    def _unshare(self, names):
+        # Array files hardlinked from another copy of the store are copied before rows are rewritten in place
+        unshared = False
+        for name in names:
+            path = os.path.join(self.directory, f"{name}.bin")
+            if os.path.isfile(path) and os.stat(path).st_nlink > 1:
+                shutil.copyfile(path, path + ".tmp")
+                os.replace(path + ".tmp", path)
+                unshared = True
+
+        if unshared:
+            self._map_arrays()
+
+    def _publish(self):
+        for array in self._arrays.values():
+            array.flush()
+
+        tmp_path = self.header_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._header, f)
+        os.replace(tmp_path, self.header_path)
+
+    def _check_writable(self):
+        if self.read_only:
+            raise PermissionError("The vector store is opened read-only")
+
+
+def create_vector_backend(name, directory, **options):
+    """
+    Create a vector backend by its name.
+
+    Args:
+        name: "chroma" or "mmap".
+        directory: The directory of the backend data.
+        options: Options of the backend class.
+    """
+    if name == "chroma":
+        return ChromaBackend(directory, **options)
+    if name == "mmap":
+        return MmapVectorBackend(directory, **options)
+
+    raise ValueError(f"Unknown vector backend: {name}")
@@ -1,21 +1,90 @@
+import hashlib
+import json
 import os
+import uuid
+from contextlib import contextmanager
+from typing import NamedTuple
 
-from langchain.embeddings.sentence_transformer import SentenceTransformerEmbeddings
-from langchain_community.vectorstores.chroma import Chroma
+from langchain_core.documents import Document
+
+from data_pipeline.embeddings import get_embedding_provider
+from data_pipeline.metrics import track_stage
+from data_pipeline.sparse_index import BM25Index
+from data_pipeline.vector_backends import create_vector_backend
+
+
+MANIFEST_FILENAME = "manifest.json"
+BM25_INDEX_DIRNAME = "bm25_index"
+MMAP_VECTORS_DIRNAME = "vectors"
+
+# "chroma" or "mmap", the memory-mapped backend with an IVF index
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "float32")
+VECTOR_NPROBE = int(os.getenv("VECTOR_NPROBE", "8"))
+
+
+class FileUpdate(NamedTuple):
+    filename: str
+    file_hash: str
+    chunk_ids: list  # All chunk ids of the file, in order
+    ids_to_add: list
+    documents_to_add: list
+    ids_to_delete: list
+    ids_to_update: list  # Stored chunks kept by the update, their metadata is rewritten
+    documents_to_update: list
+    chunking: dict | None = None  # The chunking parameters of the file, recorded in the manifest
+
+
+def compute_file_hash(file_bytes):
+    """
+    Returns a content hash of the file.
+    """
+    return hashlib.sha256(file_bytes).hexdigest()
+
+def compute_chunk_id(filename, text):
+    """
+    Returns a content addressed id of the chunk: the hash of the file name and the chunk text.
+    A chunk keeps its id when other parts of its file change, so it is not embedded again.
+    The name is part of the id, so copies of a file stored under other names do not share chunks
+    and removing or replacing one of them leaves the others intact.
+    """
+    return hashlib.sha256(f"{filename}:{text}".encode("utf-8")).hexdigest()
 
 
 class VectorStore:
     """
-    A class for managing a ChromaDB vectorstore.
+    A class for managing a vectorstore of document chunks.
+
+    Chunks are keyed by the content hash of their file and text, so the files
+    can be added, updated and removed without re-embedding unchanged chunks.
+    A manifest of the stored files and their chunk ids and a BM25 index of the chunks
+    are kept next to the data and updated together with it.
+
+    The embeddings are stored by a vector backend: ChromaDB or the memory-mapped backend.
 
     Args:
         vectorstore_dir: The working directory of vectorstore data.
+        embedding_function: The embedding function. Defaults to the shared embedding model.
+        backend: The name of the vector backend, "chroma" or "mmap". Defaults to VECTOR_BACKEND.
+        read_only: Open the memory-mapped backend read-only, e.g. in additional worker processes.
     """
 
-    def __init__(self, vectorstore_dir):
+    def __init__(self, vectorstore_dir, embedding_function=None, backend=None, read_only=False):
         self.vectorstore_dir = vectorstore_dir
-        self.embedding_function = SentenceTransformerEmbeddings(model_name="all-MiniLM-L6-v2")
-        self.vectorstore = self.load_vectorstore()
+        self.backend = backend or VECTOR_BACKEND
+        self.read_only = read_only
+        self.manifest_path = os.path.join(vectorstore_dir, MANIFEST_FILENAME)
+        self.bm25_index_dir = os.path.join(vectorstore_dir, BM25_INDEX_DIRNAME)
+        self.embedding_function = embedding_function or get_embedding_provider().embedding_function
+        # Chunks stored without a manifest, cleared before the first update
+        self.has_unmanaged_chunks = False
+        with track_stage("load_vectorstore"):
+            self.vectorstore = self.load_vectorstore()
+            self.bm25_index = self.load_bm25_index()
+            self.manifest = self.load_manifest()
+
+        # Changes whenever the stored chunks change, used to scope cached results
+        self.corpus_version = uuid.uuid4().hex
 
     def create_vectorstore(self, documents):
         """
@@ -25,31 +94,366 @@ class VectorStore:
             documents: A list of Document objects.
         """
 
-        # Split documents to avoid Chroma batch limit
-        batched_documents = self.split_list(documents)
-        
-        for batch in batched_documents:
-            self.vectorstore = Chroma.from_documents(
-                batch,
-                embedding=self.embedding_function,
-                persist_directory=self.vectorstore_dir
+        documents_by_file = {}
+        for document in documents:
+            filename = document.metadata.get("filename", document.metadata.get("source", ""))
+            documents_by_file.setdefault(filename, []).append(document)
+
+        # Without the original file bytes the file is keyed by the content of its chunks
+        for filename, file_documents in documents_by_file.items():
+            file_hash = compute_file_hash(
+                "\n".join(document.page_content for document in file_documents).encode("utf-8")
             )
-            self.vectorstore.persist()
+            self.update_file(filename, file_hash, file_documents)
+        self.save()
 
         print("Vectorstore created succesfully")
         return self.vectorstore
+
+    def is_file_current(self, filename, file_hash, chunking=None):
+        """
+        Check whether the file with the same content is already stored under the given name,
+        and chunked with the given chunking parameters if they are set.
+        """
+        entry = self.manifest.get(filename)
+        if entry is None or entry["file_hash"] != file_hash:
+            return False
+
+        # Files stored before the chunking was recorded were chunked with the defaults
+        return chunking is None or entry.get("chunking", chunking) == chunking
+
+    def list_files(self):
+        """
+        Returns the names of the stored files.
+        """
+        return list(self.manifest)
+
+    def list_file_hashes(self):
+        """
+        Returns a dictionary of the names of the stored files and their content hashes.
+        """
+        return {filename: entry["file_hash"] for filename, entry in self.manifest.items()}
+
+    def update_file(self, filename, file_hash, documents):
+        """
+        Add or replace the chunks of a file. Only chunks that are not stored yet are embedded,
+        and chunks that are no longer part of the file are deleted.
+        Call save() to persist the changes of the manifest and the BM25 index.
+
+        Args:
+            filename: The name of the file.
+            file_hash: The content hash of the file.
+            documents: A list of Document objects of the file.
+
+        Returns:
+            A dictionary with the number of added, deleted and unchanged chunks.
+        """
+        update = self.plan_file_update(filename, file_hash, documents)
+        self.upsert_documents(update.documents_to_add, update.ids_to_add)
+
+        return self.commit_file_update(update)
+
+    def plan_file_update(self, filename, file_hash, documents, chunking=None):
+        """
+        Assign the chunk ids of a file and find the chunks to embed, to delete and to keep, without changing the store.
+        Kept chunks get the file hash and the chunk index of their new position.
+        The new chunks are stored with upsert_documents or add_embedded_documents, then the update
+        is finished with commit_file_update.
+
+        Args:
+            filename: The name of the file.
+            file_hash: The content hash of the file.
+            documents: A list of Document objects of the file.
+            chunking: An optional dictionary of the chunking parameters the documents were created with.
+
+        Returns:
+            A FileUpdate object.
+        """
+        self.clear_unmanaged_chunks()
+
+        documents_by_id = {}
+        for i, document in enumerate(documents):
+            chunk_id = compute_chunk_id(filename, document.page_content)
+            document.metadata.update({"file_hash": file_hash, "chunk_id": chunk_id, "chunk_index": i})
+
+            # Identical chunks of the same file are stored once
+            documents_by_id.setdefault(chunk_id, document)
+
+        old_ids = set(self.manifest.get(filename, {}).get("chunk_ids", []))
+        ids_to_add = [chunk_id for chunk_id in documents_by_id if chunk_id not in old_ids]
+        ids_to_update = [chunk_id for chunk_id in documents_by_id if chunk_id in old_ids]
+
+        return FileUpdate(
+            filename=filename,
+            file_hash=file_hash,
+            chunk_ids=list(documents_by_id),
+            ids_to_add=ids_to_add,
+            documents_to_add=[documents_by_id[chunk_id] for chunk_id in ids_to_add],
+            ids_to_delete=[chunk_id for chunk_id in old_ids if chunk_id not in documents_by_id],
+            ids_to_update=ids_to_update,
+            documents_to_update=[documents_by_id[chunk_id] for chunk_id in ids_to_update],
+            chunking=chunking
+        )
+
+    def commit_file_update(self, update):
+        """
+        Delete the chunks that are no longer part of the file, update the metadata of the kept chunks
+        and record its new chunks in the manifest.
+
+        Returns:
+            A dictionary with the number of added, deleted and unchanged chunks.
+        """
+        self.delete_documents(update.ids_to_delete)
+        self.update_metadata(update.ids_to_update, [document.metadata for document in update.documents_to_update])
+        entry = {"file_hash": update.file_hash, "chunk_ids": update.chunk_ids}
+        if update.chunking is not None:
+            entry["chunking"] = update.chunking
+        self.manifest[update.filename] = entry
+
+        return {
+            "added": len(update.ids_to_add),
+            "deleted": len(update.ids_to_delete),
+            "unchanged": len(update.chunk_ids) - len(update.ids_to_add)
+        }
+
+    def remove_files(self, filenames):
+        """
+        Delete all chunks of the given files.
+        Call save() to persist the changes of the manifest and the BM25 index.
+
+        Args:
+            filenames: A list of names of the files.
+
+        Returns:
+            The number of deleted chunks.
+        """
+        self.clear_unmanaged_chunks()
+
+        ids_to_delete = []
+        for filename in filenames:
+            entry = self.manifest.pop(filename, None)
+            if entry is not None:
+                ids_to_delete += entry["chunk_ids"]
+
+        self.delete_documents(ids_to_delete)
+
+        return len(ids_to_delete)
+
+    def upsert_documents(self, documents, ids):
+        """
+        Embed and store Document objects under the given ids.
+
+        Args:
+            documents: A list of Document objects.
+            ids: A list of ids, one per document.
+        """
+        if len(documents) == 0:
+            return
+
+        # Embed in batches to bound the memory of the embeddings
+        for batch_documents, batch_ids in zip(self.split_list(documents), self.split_list(ids)):
+            embeddings = self.embed_documents([document.page_content for document in batch_documents])
+            self.add_embedded_documents(batch_documents, batch_ids, embeddings)
+
+    def embed_documents(self, texts):
+        """
+        Returns the embeddings of the texts.
+        """
+        with track_stage("embed_documents"):
+            return self.embedding_function.embed_documents(texts)
+
+    def add_embedded_documents(self, documents, ids, embeddings):
+        """
+        Store Document objects with their precomputed embeddings under the given ids.
+
+        Args:
+            documents: A list of Document objects.
+            ids: A list of ids, one per document.
+            embeddings: A list of embeddings, one per document.
+        """
+        if len(documents) == 0:
+            return
+
+        if self.vectorstore is None:
+            self.vectorstore = self.create_backend()
+
+        texts = [document.page_content for document in documents]
+        with track_stage("vector_write"):
+            self.vectorstore.add(ids, embeddings, texts, [document.metadata for document in documents])
+
+        with track_stage("bm25_index"):
+            self.bm25_index.add(ids, texts)
+        self.corpus_version = uuid.uuid4().hex
+
+    def delete_documents(self, ids):
+        """
+        Delete the documents with the given ids.
+        """
+        if self.vectorstore is None or len(ids) == 0:
+            return
+
+        self.vectorstore.delete(ids)
+
+        self.bm25_index.remove(ids)
+        self.corpus_version = uuid.uuid4().hex
+
+    def update_metadata(self, ids, metadatas):
+        """
+        Replace the metadata of stored documents, e.g. the chunk index of a chunk that moved within its file.
+        """
+        if self.vectorstore is None or len(ids) == 0:
+            return
+
+        self.vectorstore.update_metadata(ids, metadatas)
+        self.corpus_version = uuid.uuid4().hex
+
+    def get_documents(self, ids):
+        """
+        Fetch Document objects by their ids.
+
+        Args:
+            ids: A list of chunk ids.
+
+        Returns:
+            A list of Document objects in the order of the ids. Unknown ids are skipped.
+        """
+        if self.vectorstore is None or len(ids) == 0:
+            return []
+
+        with track_stage("fetch_documents"):
+            found = self.vectorstore.get(list(ids))
+        found_by_id = {chunk_id: (text, metadata) for chunk_id, text, metadata in found}
+
+        documents = []
+        for chunk_id in ids:
+            if chunk_id in found_by_id:
+                text, metadata = found_by_id[chunk_id]
+                documents.append(Document(page_content=text, metadata=metadata or {}))
+
+        return documents
+
+    @contextmanager
+    def acquire(self):
+        """
+        Use the vectorstore for a query. Same interface as IndexGenerations.acquire().
+        """
+        yield self
+
+    def embed_query(self, query):
+        """
+        Returns the embedding of the query.
+        """
+        with track_stage("embed_query"):
+            return self.embedding_function.embed_query(query)
+
+    def embed_queries(self, queries):
+        """
+        Returns the embeddings of a batch of queries, computed with one model call.
+        """
+        with track_stage("embed_query"):
+            if hasattr(self.embedding_function, "embed_queries"):
+                return self.embedding_function.embed_queries(queries)
+
+            return self.embedding_function.embed_documents(queries)
+
+    def dense_search(self, query_embedding, k, where=None):
+        """
+        Find the nearest chunks to the query embedding without fetching their texts.
+
+        Args:
+            query_embedding: The embedding of the query.
+            k: The number of chunks to return.
+            where: An optional Chroma metadata filter, e.g. {"filename": "report.pdf"}.
+
+        Returns:
+            A list of (chunk id, distance) tuples, nearest first.
+        """
+        if self.vectorstore is None:
+            return []
+
+        with track_stage("vector_search"):
+            return self.vectorstore.query(query_embedding, k, where=where)
+
+    def batch_dense_search(self, query_embeddings, k, where=None):
+        """
+        Batch version of dense_search, the backend searches all query embeddings at once.
+
+        Returns:
+            A list of lists of (chunk id, distance) tuples, one per query embedding.
+        """
+        if self.vectorstore is None:
+            return [[] for _ in query_embeddings]
+
+        with track_stage("vector_search"):
+            return self.vectorstore.query_many(query_embeddings, k, where=where)
+
+    def sparse_search(self, query, k, where=None):
+        """
+        Find the best BM25 matches of the query without fetching their texts.
+
+        Args:
+            query: The query text.
+            k: The number of chunks to return.
+            where: An optional Chroma metadata filter, e.g. {"filename": "report.pdf"}.
+
+        Returns:
+            A list of (chunk id, BM25 score) tuples, best first.
+        """
+        with track_stage("bm25_search"):
+            allowed_ids = self.get_ids(where) if where else None
+
+            return self.bm25_index.search(query, k, allowed_ids=allowed_ids)
+
+    def batch_sparse_search(self, queries, k, where=None):
+        """
+        Batch version of sparse_search, the postings of shared terms are scored once.
+
+        Returns:
+            A list of lists of (chunk id, BM25 score) tuples, one per query.
+        """
+        with track_stage("bm25_search"):
+            allowed_ids = self.get_ids(where) if where else None
+
+            return self.bm25_index.search_many(queries, k, allowed_ids=allowed_ids)
+
+    def get_ids(self, where):
+        """
+        Returns the ids of the chunks matching a Chroma metadata filter.
+        """
+        if self.vectorstore is None:
+            return []
+
+        return self.vectorstore.get_ids(where)
+
+    def count(self):
+        """
+        Returns the number of stored chunks.
+        """
+        if self.vectorstore is None:
+            return 0
+
+        return self.vectorstore.count()
     
+    def close(self):
+        """
+        Release the files of the vector backend, e.g. of a replaced generation.
+        """
+        if self.vectorstore is not None:
+            self.vectorstore.close()
+            self.vectorstore = None
+
     def clear_vectorstore(self):
         """
         Clear the vectorstore
         """
 
         if self.vectorstore is not None:
-            all_ids = self.vectorstore.get()["ids"]
-            if len(all_ids) != 0:
-                batched_ids = self.split_list(all_ids)
-                for batch in batched_ids:
-                    self.vectorstore.delete(batch)
+            self.vectorstore.clear()
+
+        self.manifest = {}
+        self.bm25_index.clear()
+        self.corpus_version = uuid.uuid4().hex
+        self.save()
 
     def load_vectorstore(self):
         """
@@ -58,15 +462,97 @@ class VectorStore:
 
         # Load vectorstore if it exists
         if os.path.isdir(self.vectorstore_dir):
-            vectorstore = Chroma(
-                persist_directory=self.vectorstore_dir, 
-                embedding_function=self.embedding_function
-            )
+            vectorstore = self.create_backend()
             print("Vectorstore loaded")
 
             return vectorstore
         
         return None
+
+    def create_backend(self):
+        """
+        Open the configured vector backend in the vectorstore folder.
+        """
+        if self.backend == "mmap":
+            return create_vector_backend(
+                "mmap",
+                os.path.join(self.vectorstore_dir, MMAP_VECTORS_DIRNAME),
+                quantization=VECTOR_QUANTIZATION,
+                nprobe=VECTOR_NPROBE,
+                read_only=self.read_only
+            )
+
+        return create_vector_backend(self.backend, self.vectorstore_dir)
+
+    def load_manifest(self):
+        """
+        Load the manifest of the stored files.
+
+        A vectorstore created without a manifest can't be updated incrementally,
+        so it is cleared before the first update, see clear_unmanaged_chunks. Until then
+        its chunks are served as they are. A manifest of files missing from the vector backend is discarded.
+        """
+        if os.path.isfile(self.manifest_path):
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+
+            # The files were stored by another vector backend, they are ingested again
+            if manifest and self.count() == 0:
+                self.bm25_index.clear()
+                return {}
+
+            return manifest
+
+        self.has_unmanaged_chunks = self.vectorstore is not None and self.count() > 0
+
+        return {}
+
+    def clear_unmanaged_chunks(self):
+        """
+        Clear a vectorstore created without a manifest before its first update,
+        as its chunks can't be attributed to files.
+        """
+        if self.has_unmanaged_chunks:
+            self.has_unmanaged_chunks = False
+            self.clear_vectorstore()
+
+    def load_bm25_index(self):
+        """
+        Load the BM25 index of the chunks, or build it from the vectorstore if it does not exist.
+        """
+        bm25_index = BM25Index.load(self.bm25_index_dir)
+        if bm25_index is not None:
+            print("BM25 index loaded")
+            return bm25_index
+
+        bm25_index = BM25Index()
+        if self.vectorstore is not None:
+            all_ids, all_texts = self.vectorstore.get_all_texts()
+            bm25_index.add(all_ids, all_texts)
+            # A read-only store may be shared with a writer, only the writer persists the index
+            if not self.read_only:
+                bm25_index.save(self.bm25_index_dir)
+
+        return bm25_index
+
+    def save(self):
+        """
+        Persist the manifest and the BM25 index.
+        """
+        with track_stage("save_index"):
+            self.save_manifest()
+            self.bm25_index.save(self.bm25_index_dir)
+
+    def save_manifest(self):
+        """
+        Atomically write the manifest of the stored files.
+        """
+        os.makedirs(self.vectorstore_dir, exist_ok=True)
+
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, self.manifest_path)
     
     def split_list(self, input_list, chunk_size=5000):
         """
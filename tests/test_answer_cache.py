@@ -0,0 +1,50 @@
+from agent.answer_cache import SemanticAnswerCache
+
+
+class FakeEmbeddings:
+    """
+    Embeds a question by its topic, so differently worded questions on one topic are similar.
+    """
+
+    def __init__(self):
+        self.embedded_questions = []
+
+    def embed_query(self, question):
+        self.embedded_questions.append(question)
+        return [1.0, 0.0] if "tcp" in question.lower() else [0.0, 1.0]
+
+
+def test_answers_are_keyed_by_corpus_version_and_normalized_question():
+    embeddings = FakeEmbeddings()
+    cache = SemanticAnswerCache(embeddings)
+    cache.store("What is TCP?", "version-1:agent", "Answer of the agent", ["a.pdf"])
+    cache.store("What is TCP?", "version-1:single", "Single answer", ["b.pdf"])
+    embeddings.embedded_questions.clear()
+
+    assert cache.lookup("  what is  TCP? ", "version-1:agent") == {"answer": "Answer of the agent", "sources": ["a.pdf"]}
+    assert cache.lookup("What is TCP?", "version-1:single") == {"answer": "Single answer", "sources": ["b.pdf"]}
+    # Identical questions are found without an embedding
+    assert embeddings.embedded_questions == []
+    assert cache.stats()["entries"] == 2
+
+
+def test_similar_questions_only_hit_answers_of_the_same_corpus_version():
+    cache = SemanticAnswerCache(FakeEmbeddings())
+    cache.store("What is TCP?", "version-1:agent", "Answer", [])
+
+    assert cache.lookup("Explain the TCP protocol", "version-1:agent") == {"answer": "Answer", "sources": []}
+    assert cache.lookup("Explain the TCP protocol", "version-2:agent") is None
+    assert cache.lookup("What is UDP?", "version-1:agent") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_least_recently_used_answers_are_evicted():
+    cache = SemanticAnswerCache(FakeEmbeddings(), max_entries=2)
+    cache.store("What is TCP?", "version-1", "First", [])
+    cache.store("What is UDP?", "version-1", "Second", [])
+
+    cache.lookup("What is TCP?", "version-1")
+    cache.store("What is IP?", "version-1", "Third", [])
+
+    assert [question for _, question in cache.entries] == ["what is tcp?", "what is ip?"]
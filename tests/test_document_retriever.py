@@ -0,0 +1,51 @@
+import asyncio
+import time
+from contextlib import contextmanager
+
+from langchain_core.documents import Document
+
+from data_pipeline.document_retriever import RETRIEVAL_WORKERS, HybridRetriever, run_in_retrieval_executor
+
+
+class FakeVectorStore:
+    """
+    A vectorstore of a few chunks whose sparse search is slow enough
+    for all retrieval workers to be busy at the same time.
+    """
+
+    corpus_version = "test"
+
+    def __init__(self):
+        self.chunk_ids = [f"chunk-{i}" for i in range(5)]
+
+    @contextmanager
+    def acquire(self):
+        yield self
+
+    def embed_queries(self, queries):
+        return [[0.0] for _ in queries]
+
+    def batch_dense_search(self, query_embeddings, k, where=None):
+        return [[(chunk_id, float(i)) for i, chunk_id in enumerate(self.chunk_ids[:k])] for _ in query_embeddings]
+
+    def batch_sparse_search(self, queries, k, where=None):
+        time.sleep(0.05)
+        return [[(chunk_id, 1.0) for chunk_id in reversed(self.chunk_ids[:k])] for _ in queries]
+
+    def get_documents(self, ids):
+        return [Document(page_content=chunk_id, metadata={"chunk_id": chunk_id}) for chunk_id in ids]
+
+
+def test_concurrent_batch_retrievals_do_not_deadlock_the_pool():
+    retriever = HybridRetriever(vectorstore=FakeVectorStore(), k=3)
+
+    async def run():
+        return await asyncio.wait_for(asyncio.gather(*[
+            run_in_retrieval_executor(retriever.batch_get_relevant_documents, [f"question {i}"])
+            for i in range(2 * RETRIEVAL_WORKERS)
+        ]), timeout=10)
+
+    results = asyncio.run(run())
+
+    assert len(results) == 2 * RETRIEVAL_WORKERS
+    assert all(len(documents) == 3 for batch in results for documents in batch)
@@ -0,0 +1,92 @@
+import os
+
+import pytest
+from langchain_core.documents import Document
+
+from data_pipeline import vectorstore as vectorstore_module
+from data_pipeline.index_generations import IndexGenerations
+
+
+class FakeEmbeddings:
+    def embed_documents(self, texts):
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        return [float(len(text)), 1.0]
+
+
+@pytest.fixture(autouse=True)
+def mmap_backend(monkeypatch):
+    monkeypatch.setattr(vectorstore_module, "VECTOR_BACKEND", "mmap")
+
+
+def add_file(generations, filename, text):
+    vectorstore = generations.prepare()
+    vectorstore.update_file(filename, filename, [Document(page_content=text, metadata={"filename": filename})])
+    vectorstore.save()
+    return vectorstore
+
+
+def list_generations(generations):
+    return sorted(os.listdir(generations.generations_dir))
+
+
+def test_changes_are_visible_only_after_publish(tmp_path):
+    generations = IndexGenerations(str(tmp_path), embedding_function=FakeEmbeddings())
+    first_generation = generations.current_generation
+
+    vectorstore = add_file(generations, "a.txt", "alpha")
+    assert generations.list_files() == []
+
+    generations.publish(vectorstore)
+
+    assert generations.list_files() == ["a.txt"]
+    # The replaced generation is not leased, so it is deleted at once
+    assert list_generations(generations) == [generations.current_generation]
+    assert generations.current_generation != first_generation
+
+
+def test_leased_generation_is_kept_until_the_lease_is_released(tmp_path):
+    generations = IndexGenerations(str(tmp_path), embedding_function=FakeEmbeddings())
+    generations.publish(add_file(generations, "a.txt", "alpha"))
+    leased_generation = generations.current_generation
+
+    with generations.acquire() as vectorstore:
+        generations.publish(add_file(generations, "b.txt", "beta"))
+
+        # The query finishes on the generation it started with
+        assert leased_generation in list_generations(generations)
+        assert vectorstore.list_files() == ["a.txt"]
+
+    assert list_generations(generations) == [generations.current_generation]
+    assert generations.list_files() == ["a.txt", "b.txt"]
+
+
+def test_generation_used_by_another_process_is_not_deleted(tmp_path):
+    writer = IndexGenerations(str(tmp_path), embedding_function=FakeEmbeddings())
+    # Another worker process, its file locks are separate from the ones of the writer
+    reader = IndexGenerations(str(tmp_path), embedding_function=FakeEmbeddings())
+
+    writer.publish(add_file(writer, "a.txt", "alpha"))
+    reader.follow_current()
+    served_generation = reader.current_generation
+
+    writer.publish(add_file(writer, "b.txt", "beta"))
+    assert served_generation in list_generations(writer)
+
+    # The reader closes the replaced generation once it follows the pointer
+    reader.follow_current()
+    assert reader.list_files() == ["a.txt", "b.txt"]
+    assert list_generations(writer) == [writer.current_generation]
+    assert sorted(os.listdir(writer.locks_dir)) == sorted([f"{writer.current_generation}.lock", "WRITER.lock"])
+
+
+def test_discarded_generation_is_deleted_and_releases_the_writer_lock(tmp_path):
+    generations = IndexGenerations(str(tmp_path), embedding_function=FakeEmbeddings())
+    current_generation = generations.current_generation
+
+    generations.discard(add_file(generations, "a.txt", "alpha"))
+
+    assert list_generations(generations) == [current_generation]
+    # The next writer does not wait
+    generations.discard(generations.prepare())
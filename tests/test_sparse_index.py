@@ -0,0 +1,41 @@
+from data_pipeline.sparse_index import BM25Index
+
+
+def test_removed_documents_are_not_returned_before_compaction():
+    index = BM25Index(compaction_ratio=0.9)
+    index.add(["a", "b", "c"], ["red apple", "green apple", "yellow banana"])
+
+    index.remove(["a"])
+
+    # The document is only marked as deleted
+    assert index.doc_ids == ["a", "b", "c"]
+    assert len(index) == 2
+    assert [doc_id for doc_id, _ in index.search("apple", k=3)] == ["b"]
+
+
+def test_compaction_drops_deleted_documents_from_the_postings():
+    index = BM25Index(compaction_ratio=0.5)
+    index.add(["a", "b", "c", "d"], ["red apple", "green apple", "yellow banana", "red cherry"])
+
+    index.remove(["a", "c"])
+
+    assert index.doc_ids == ["b", "d"]
+    assert index.doc_positions == {"b": 0, "d": 1}
+    assert list(index.alive) == [1, 1]
+    assert [doc_id for doc_id, _ in index.search("red apple", k=3)] == ["b", "d"]
+
+    # A removed document can be added again after the compaction
+    index.add(["a"], ["red apple"])
+    assert [doc_id for doc_id, _ in index.search("red apple", k=1)] == ["a"]
+
+
+def test_deleted_documents_survive_save_and_load(tmp_path):
+    index = BM25Index(compaction_ratio=0.9)
+    index.add(["a", "b"], ["red apple", "green apple"])
+    index.remove(["a"])
+    index.save(tmp_path)
+
+    loaded = BM25Index.load(tmp_path)
+
+    assert len(loaded) == 1
+    assert [doc_id for doc_id, _ in loaded.search("apple", k=2)] == ["b"]
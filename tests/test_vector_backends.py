@@ -0,0 +1,66 @@
+import numpy as np
+
+from data_pipeline.vector_backends import MmapVectorBackend
+
+
+def create_backend(directory, num_chunks=200):
+    """
+    A store of clustered vectors in an IVF index scanning a single list per query.
+    The chunks of "rare.pdf" are the ones farthest from the origin.
+    """
+    rng = np.random.default_rng(0)
+    centers = rng.normal(scale=10, size=(4, 8))
+    embeddings = centers[np.arange(num_chunks) % 4] + rng.normal(size=(num_chunks, 8))
+    embeddings[-3:] = 100.0
+
+    ids = [f"chunk-{i}" for i in range(num_chunks)]
+    filenames = [f"file-{i % 5}.pdf" for i in range(num_chunks - 3)] + ["rare.pdf"] * 3
+    metadatas = [{"filename": filename, "page": i % 2} for i, filename in enumerate(filenames)]
+
+    backend = MmapVectorBackend(str(directory), nlist=8, nprobe=1)
+    backend.add(ids, embeddings, [f"text of {chunk_id}" for chunk_id in ids], metadatas)
+    backend.build_index()
+
+    return backend, embeddings, metadatas
+
+
+def test_filters_on_the_filename_column_and_on_other_metadata(tmp_path):
+    backend, _, metadatas = create_backend(tmp_path)
+
+    def expected(condition):
+        return sorted(f"chunk-{i}" for i, metadata in enumerate(metadatas) if condition(metadata))
+
+    assert sorted(backend.get_ids({"filename": "file-1.pdf"})) == expected(lambda m: m["filename"] == "file-1.pdf")
+    assert sorted(backend.get_ids({"filename": {"$in": ["file-1.pdf", "rare.pdf"]}})) == \
+        expected(lambda m: m["filename"] in ("file-1.pdf", "rare.pdf"))
+    assert sorted(backend.get_ids({"filename": {"$ne": "file-1.pdf"}})) == \
+        expected(lambda m: m["filename"] != "file-1.pdf")
+    # Keys other than the file name are read from SQLite
+    assert sorted(backend.get_ids({"$and": [{"filename": "file-2.pdf"}, {"page": 1}]})) == \
+        expected(lambda m: m["filename"] == "file-2.pdf" and m["page"] == 1)
+    assert backend.get_ids({"filename": "missing.pdf"}) == []
+
+
+def test_filtered_ivf_query_finds_chunks_outside_the_scanned_lists(tmp_path):
+    backend, embeddings, _ = create_backend(tmp_path)
+    query = embeddings[0]
+
+    results = backend.query(query, 5, where={"filename": "rare.pdf"})
+
+    assert sorted(chunk_id for chunk_id, _ in results) == ["chunk-197", "chunk-198", "chunk-199"]
+    assert backend.query_many([query], 5, where={"filename": "rare.pdf"})[0] == results
+    # Without the filter only the nearest list is scanned
+    assert all(chunk_id not in ("chunk-197", "chunk-198", "chunk-199") for chunk_id, _ in backend.query(query, 5))
+
+
+def test_read_only_instance_sees_deletes_and_new_file_names(tmp_path):
+    backend, embeddings, _ = create_backend(tmp_path)
+    reader = MmapVectorBackend(str(tmp_path), nprobe=1, read_only=True)
+
+    backend.delete(["chunk-197"])
+    backend.add(["chunk-new"], embeddings[:1], ["new text"], [{"filename": "new.pdf"}])
+
+    assert reader.get_ids({"filename": "new.pdf"}) == ["chunk-new"]
+    assert sorted(reader.get_ids({"filename": "rare.pdf"})) == ["chunk-198", "chunk-199"]
+    assert reader.query(embeddings[0], 1, where={"filename": "new.pdf"})[0][0] == "chunk-new"
+    reader.close()
@@ -0,0 +1,82 @@
+import json
+
+from langchain_core.documents import Document
+
+from data_pipeline.vectorstore import VectorStore, compute_chunk_id
+
+
+class FakeEmbeddings:
+    """
+    An embedding function that counts the embedded texts.
+    """
+
+    def __init__(self):
+        self.embedded_texts = []
+
+    def embed_documents(self, texts):
+        self.embedded_texts += texts
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        return [float(len(text)), 1.0]
+
+
+def make_documents(filename, texts):
+    return [Document(page_content=text, metadata={"filename": filename, "source": filename}) for text in texts]
+
+
+def create_vectorstore(tmp_path):
+    embeddings = FakeEmbeddings()
+    return VectorStore(str(tmp_path / "vectorstore"), embedding_function=embeddings, backend="mmap"), embeddings
+
+
+def test_adding_a_file_records_its_chunks_in_the_manifest(tmp_path):
+    vectorstore, embeddings = create_vectorstore(tmp_path)
+
+    stats = vectorstore.update_file("a.txt", "hash-1", make_documents("a.txt", ["one", "two"]))
+    vectorstore.save()
+
+    assert stats == {"added": 2, "deleted": 0, "unchanged": 0}
+    assert embeddings.embedded_texts == ["one", "two"]
+    with open(vectorstore.manifest_path, "r", encoding="utf-8") as f:
+        assert json.load(f) == {
+            "a.txt": {
+                "file_hash": "hash-1",
+                "chunk_ids": [compute_chunk_id("a.txt", "one"), compute_chunk_id("a.txt", "two")]
+            }
+        }
+
+
+def test_updating_a_file_embeds_only_new_chunks_and_moves_the_kept_ones(tmp_path):
+    vectorstore, embeddings = create_vectorstore(tmp_path)
+    vectorstore.update_file("a.txt", "hash-1", make_documents("a.txt", ["one", "two", "three"]))
+    embeddings.embedded_texts.clear()
+
+    stats = vectorstore.update_file("a.txt", "hash-2", make_documents("a.txt", ["zero", "one", "three"]))
+
+    assert stats == {"added": 1, "deleted": 1, "unchanged": 2}
+    assert embeddings.embedded_texts == ["zero"]
+    assert vectorstore.is_file_current("a.txt", "hash-2")
+
+    documents = vectorstore.get_documents(vectorstore.manifest["a.txt"]["chunk_ids"])
+    assert [document.page_content for document in documents] == ["zero", "one", "three"]
+    assert [document.metadata["chunk_index"] for document in documents] == [0, 1, 2]
+    assert {document.metadata["file_hash"] for document in documents} == {"hash-2"}
+    assert vectorstore.count() == 3
+
+
+def test_removing_a_file_keeps_a_copy_stored_under_another_name(tmp_path):
+    vectorstore, _ = create_vectorstore(tmp_path)
+    vectorstore.update_file("a.txt", "hash-1", make_documents("a.txt", ["one", "two"]))
+    vectorstore.update_file("b.txt", "hash-1", make_documents("b.txt", ["one", "two"]))
+
+    assert vectorstore.remove_files(["a.txt", "missing.txt"]) == 2
+    vectorstore.save()
+
+    assert vectorstore.list_files() == ["b.txt"]
+    assert vectorstore.count() == 2
+    assert [chunk_id for chunk_id, _ in vectorstore.sparse_search("one", k=5)] == [compute_chunk_id("b.txt", "one")]
+
+    reopened = VectorStore(vectorstore.vectorstore_dir, embedding_function=FakeEmbeddings(), backend="mmap")
+    assert reopened.list_file_hashes() == {"b.txt": "hash-1"}
+    reopened.close()